@@ -0,0 +1,155 @@
+from datetime import date, timedelta
+
+from init import db
+from models.department import Department
+from models.employee import Employee
+from models.leave_request import LeaveRequest
+from models.leave_summary import LeaveSummary
+from models.status import status_registry
+from models.team import Team
+from utils import dialect_insert
+from workdays import calendars
+
+# Rows written per INSERT when rebuilding the summary
+SUMMARY_BATCH_SIZE = 1000
+
+# Splits a date range into (month, start_date, end_date) pieces, one per calendar month it touches
+def month_segments(start_date, end_date):
+    month = start_date.replace(day=1)
+    while month <= end_date:
+        next_month = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+        yield month, max(start_date, month), min(end_date, next_month - timedelta(days=1))
+        month = next_month
+
+# Totals of (days, requests) per (team_id, department_id, month, status_id) for leave given as
+# (team_id, department_id, status_id, start_date, end_date, sign) tuples, a sign of -1 taking the leave out.
+# The working days of every month piece are counted in one vectorized call.
+def summarize(leave):
+    keys, department_ids, start_dates, end_dates, signs = [], [], [], [], []
+    for team_id, department_id, status_id, start_date, end_date, sign in leave:
+        for month, segment_start, segment_end in month_segments(start_date, end_date):
+            keys.append((team_id, department_id, month, status_id))
+            department_ids.append(department_id)
+            start_dates.append(segment_start)
+            end_dates.append(segment_end)
+            signs.append(sign)
+
+    totals = {}
+    if keys:
+        working_days = calendars.count(department_ids, start_dates, end_dates).tolist()
+        for key, days, sign in zip(keys, working_days, signs):
+            total_days, total_requests = totals.get(key, (0, 0))
+            totals[key] = (total_days + sign * days, total_requests + sign)
+    return totals
+
+# Adds the totals to the summary table in one upsert, then drops the rows no request counts in any more.
+# Rows go in key order, so concurrent upserts lock the summary rows in the same order and cannot deadlock.
+def apply_summary(totals):
+    rows = [
+        {"team_id": team_id, "department_id": department_id, "month": month, "status_id": status_id, "days": days, "requests": requests}
+        for (team_id, department_id, month, status_id), (days, requests) in sorted(totals.items())
+        if days or requests
+    ]
+    if not rows:
+        return
+    stmt = dialect_insert(LeaveSummary).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[LeaveSummary.team_id, LeaveSummary.month, LeaveSummary.status_id],
+        set_={"days": LeaveSummary.days + stmt.excluded.days, "requests": LeaveSummary.requests + stmt.excluded.requests}
+    )
+    db.session.execute(stmt)
+    if any(row["requests"] < 0 for row in rows):
+        db.session.execute(db.delete(LeaveSummary).where(
+            LeaveSummary.requests <= 0,
+            LeaveSummary.team_id.in_({row["team_id"] for row in rows})
+        ))
+
+# Team and department of each employee, looked up in one query
+def _teams_of(employee_ids):
+    stmt = db.select(Employee.id, Employee.team_id, Team.department_id) \
+        .join(Team, Employee.team_id == Team.id) \
+        .filter(Employee.id.in_(set(employee_ids)))
+    return {row.id: (row.team_id, row.department_id) for row in db.session.execute(stmt)}
+
+# Updates the summary, in the current transaction, for leave requests (rows or objects with employee_id,
+# start_date and end_date) moving from one status to another. Use None as the old status for new requests
+# and as the new status for deleted ones.
+def update_leave_summary(leave_requests, old_status_id, new_status_id):
+    if not leave_requests:
+        return
+    teams = _teams_of({leave_request.employee_id for leave_request in leave_requests})
+    leave = []
+    for leave_request in leave_requests:
+        team_id, department_id = teams[leave_request.employee_id]
+        if old_status_id is not None:
+            leave.append((team_id, department_id, old_status_id, leave_request.start_date, leave_request.end_date, -1))
+        if new_status_id is not None:
+            leave.append((team_id, department_id, new_status_id, leave_request.start_date, leave_request.end_date, 1))
+    apply_summary(summarize(leave))
+
+# Moves an employee's leave between teams in the summary, in the current transaction
+def move_leave_summary(employee_id, old_team_id, new_team_id):
+    if old_team_id == new_team_id:
+        return
+    departments = dict(db.session.execute(db.select(Team.id, Team.department_id).filter(Team.id.in_([old_team_id, new_team_id]))).all())
+    stmt = db.select(LeaveRequest.status_id, LeaveRequest.start_date, LeaveRequest.end_date).filter(LeaveRequest.employee_id == employee_id)
+    leave = []
+    for row in db.session.execute(stmt):
+        leave.append((old_team_id, departments[old_team_id], row.status_id, row.start_date, row.end_date, -1))
+        leave.append((new_team_id, departments[new_team_id], row.status_id, row.start_date, row.end_date, 1))
+    apply_summary(summarize(leave))
+
+# Recomputes the whole summary from the leave requests in bulk. Returns the number of summary rows.
+def rebuild_leave_summary():
+    stmt = db.select(Employee.team_id, Team.department_id, LeaveRequest.status_id, LeaveRequest.start_date, LeaveRequest.end_date, db.literal(1)) \
+        .join(Employee, LeaveRequest.employee_id == Employee.id) \
+        .join(Team, Employee.team_id == Team.id)
+    totals = summarize(db.session.execute(stmt))
+
+    db.session.execute(db.delete(LeaveSummary))
+    rows = [
+        {"team_id": team_id, "department_id": department_id, "month": month, "status_id": status_id, "days": days, "requests": requests}
+        for (team_id, department_id, month, status_id), (days, requests) in totals.items()
+    ]
+    for start in range(0, len(rows), SUMMARY_BATCH_SIZE):
+        db.session.execute(db.insert(LeaveSummary), rows[start:start + SUMMARY_BATCH_SIZE])
+    return len(rows)
+
+# Leave days and requests per department (or team), month and status, read from the summary table
+def leave_analytics(group_by="department", from_date=None, to_date=None, status=None, department_id=None, team_id=None):
+    if group_by == "team":
+        group_columns = [LeaveSummary.team_id, Team.team_name, LeaveSummary.department_id, Department.department_name]
+    else:
+        group_columns = [LeaveSummary.department_id, Department.department_name]
+    stmt = db.select(
+        *group_columns,
+        LeaveSummary.month,
+        LeaveSummary.status_id,
+        db.func.sum(LeaveSummary.days).label("days"),
+        db.func.sum(LeaveSummary.requests).label("requests")
+    ).join(Department, LeaveSummary.department_id == Department.id) \
+     .group_by(*group_columns, LeaveSummary.month, LeaveSummary.status_id) \
+     .order_by(LeaveSummary.month, group_columns[0], LeaveSummary.status_id)
+    if group_by == "team":
+        stmt = stmt.join(Team, LeaveSummary.team_id == Team.id)
+
+    if from_date:
+        stmt = stmt.where(LeaveSummary.month >= from_date.replace(day=1))
+    if to_date:
+        stmt = stmt.where(LeaveSummary.month <= to_date)
+    if status:
+        stmt = stmt.where(LeaveSummary.status_id == status_registry.get_id(status))
+    if department_id:
+        stmt = stmt.where(LeaveSummary.department_id == department_id)
+    if team_id:
+        stmt = stmt.where(LeaveSummary.team_id == team_id)
+
+    result = []
+    for row in db.session.execute(stmt):
+        item = {column.key: row._mapping[column.key] for column in group_columns}
+        item["month"] = row.month.strftime("%Y-%m")
+        item["status"] = status_registry.get_name(row.status_id)
+        item["days"] = row.days
+        item["requests"] = row.requests
+        result.append(item)
+    return result
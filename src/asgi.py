@@ -0,0 +1,244 @@
+import contextlib
+import functools
+import io
+import os
+from datetime import datetime, timedelta
+
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+from flask import Response as FlaskResponse, current_app, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+
+from init import db
+from main import create_app
+from metrics import _watch_pool
+from models.department import Department, departments_schema
+from models.employee import Employee
+from models.leave_request import LeaveRequest, leave_requests_schema
+from models.status import status_registry
+from models.team import Team, teams_schema
+from loading import eager_load_options
+from pagination import get_limit, page_headers, page_statement, split_page
+from response_cache import response_cache, response_cache_key
+from serializers import compile_schema, fast_dump, select_rows
+from versions import DatabaseVersionStore, collection_versions, employee_leave_key, make_etag, own_leave_list, team_leave_key
+from workdays import department_ids_stmt, working_days_in
+
+# Async drivers of the databases the API runs on
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+# Pool settings the async engine takes over from SQLALCHEMY_ENGINE_OPTIONS, where its pool has them
+POOL_SIZING = ("pool_size", "max_overflow", "pool_timeout")
+
+# URL of the async engine: DATABASE_ASYNC_URL, else the replica or the primary with the driver swapped
+def async_database_url(app):
+    if os.environ.get("DATABASE_ASYNC_URL"):
+        return make_url(os.environ.get("DATABASE_ASYNC_URL"))
+    url = make_url(os.environ.get("DATABASE_REPLICA_URL") or app.config["SQLALCHEMY_DATABASE_URI"])
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+def create_async_sessions(app):
+    url = async_database_url(app)
+    options = dict(app.config["SQLALCHEMY_ENGINE_OPTIONS"])
+    # SQLite files are opened per connection, without a sized pool
+    if url.get_backend_name() == "sqlite":
+        for option in POOL_SIZING:
+            options.pop(option, None)
+    engine = create_async_engine(url, **options)
+    return engine, async_sessionmaker(engine, expire_on_commit=False)
+
+# Versions of the keys, read through the async session when they are kept in the database
+async def get_versions(session, keys):
+    store = collection_versions.store
+    if isinstance(store, DatabaseVersionStore):
+        result = await session.execute(store.stmt(keys))
+        return store.versions_of(keys, result.all())
+    return store.get_many(keys)
+
+# Id of a status name, loading the statuses through the async session on first use, so the
+# event loop never waits on a query of the sync session
+async def status_id(session, status_name):
+    if not status_registry.loaded:
+        result = await session.execute(status_registry.stmt())
+        ids, _ = status_registry.fill(result.all())
+        return ids.get(status_name)
+    return status_registry.get_id(status_name)
+
+def _names(keys, view_args):
+    return [key(**view_args) if callable(key) else key for key in keys]
+
+# Async counterpart of versions.conditional, for views taking the session first
+def conditional(*keys):
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(session, **kwargs):
+            names = _names(keys, kwargs)
+            # Read the versions before the data, so a tag never claims newer data than the response holds
+            etag = make_etag(names, await get_versions(session, names), request.full_path)
+            if request.if_none_match.contains(etag):
+                response = FlaskResponse(status=304)
+            else:
+                response = current_app.make_response(await fn(session, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = "private, no-cache"
+            return response
+        return wrapper
+    return decorator
+
+# Async counterpart of response_cache.cached_response, sharing its entries with the sync views
+def cached_response(*keys):
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(session, **kwargs):
+            names = _names(keys, kwargs)
+            cache_key = response_cache_key(request.endpoint, kwargs, names, await get_versions(session, names))
+            response = response_cache.get_response(cache_key)
+            if response is None:
+                response = current_app.make_response(await fn(session, **kwargs))
+                response_cache.set_response(cache_key, response)
+            return response
+        return wrapper
+    return decorator
+
+async def paginate(session, stmt, *columns, rows=False):
+    limit = get_limit()
+    result = await session.execute(page_statement(stmt, columns, limit, request.args.get("cursor")))
+    items = result.all() if rows else result.scalars().all()
+    return split_page(items, columns, limit)
+
+async def with_working_days(session, dumped, leave_requests):
+    result = await session.execute(department_ids_stmt({leave_request.employee_id for leave_request in leave_requests}))
+    for item, working_days in zip(dumped, working_days_in(dict(result.all()), leave_requests)):
+        item["working_days"] = working_days
+    return dumped
+
+# The read views below answer exactly like their namesakes in the controllers
+
+@conditional("department")
+async def get_all_departments(session):
+    departments, next_cursor = await paginate(session, db.select(Department), Department.department_name, Department.id)
+    return fast_dump(departments_schema, departments), 200, page_headers(next_cursor)
+
+@conditional("team")
+async def get_all_teams(session):
+    stmt = db.select(Team).options(*eager_load_options(Team, teams_schema))
+    teams, next_cursor = await paginate(session, stmt, Team.team_name, Team.id)
+    return fast_dump(teams_schema, teams), 200, page_headers(next_cursor)
+
+@cached_response(team_leave_key)
+async def view_approved_leaves_in_team(session, team_id):
+    start_date = datetime.today()
+    end_date = start_date + timedelta(days=30)
+
+    if not await session.get(Team, team_id):
+        return {"error": f"Team with ID {team_id} not found."}, 404
+
+    leaves_stmt = db.select(LeaveRequest).join(Employee).filter(
+        Employee.team_id == team_id,
+        LeaveRequest.status_id == await status_id(session, "approved"),
+        LeaveRequest.start_date.between(start_date, end_date)
+    ).options(*eager_load_options(LeaveRequest, leave_requests_schema))
+    approved_leaves = (await session.scalars(leaves_stmt)).all()
+
+    if not approved_leaves:
+        return {"message": f"No approved leave requests found for team ID {team_id} in the upcoming month."}, 404
+    return await with_working_days(session, fast_dump(leave_requests_schema, approved_leaves), approved_leaves), 200
+
+@cached_response(employee_leave_key)
+async def view_approved_leaves_for_employee(session, employee_id):
+    start_date = datetime.today()
+    end_date = start_date + timedelta(days=30)
+
+    employee = await session.get(Employee, employee_id)
+    if not employee:
+        return {"error": f"Employee ID {employee_id} not found."}, 404
+
+    approved_status_id = await status_id(session, "approved")
+    if not approved_status_id:
+        return {"error": "Approved status not found."}, 404
+    leaves_stmt = db.select(LeaveRequest).filter(
+        LeaveRequest.employee_id == employee.id,
+        LeaveRequest.status_id == approved_status_id,
+        LeaveRequest.start_date.between(start_date, end_date)
+    ).options(*eager_load_options(LeaveRequest, leave_requests_schema))
+    approved_leaves = (await session.scalars(leaves_stmt)).all()
+
+    if not approved_leaves:
+        return {"message": f"No approved leave requests for employee ID {employee_id} in the next 30 days."}, 404
+    return await with_working_days(session, fast_dump(leave_requests_schema, approved_leaves), approved_leaves), 200
+
+@conditional("leave_request", own_leave_list)
+async def view_leave_requests(session):
+    employee_id = get_jwt_identity()
+    stmt = select_rows(LeaveRequest, leave_requests_schema).add_columns(LeaveRequest.employee_id).where(LeaveRequest.employee_id == employee_id)
+    leave_requests, next_cursor = await paginate(session, stmt, LeaveRequest.id, rows=True)
+
+    if leave_requests:
+        dumped = compile_schema(leave_requests_schema).dump_rows(leave_requests)
+        return await with_working_days(session, dumped, leave_requests), 200, page_headers(next_cursor)
+    return {"message": "No leave requests found."}, 404
+
+# Runs an async view inside a Flask request context built from the ASGI request, so the JWT
+# checks, error handlers, metrics and instrumentation hooks, and the JSON encoding are the
+# Flask app's own. Mirrors Flask.full_dispatch_request with the view awaited instead of called.
+def flask_view(view):
+    async def endpoint(asgi_request):
+        flask_app = asgi_request.app.state.flask_app
+        environ = build_environ(asgi_request.scope, io.BytesIO())
+        with flask_app.request_context(environ):
+            try:
+                try:
+                    rv = flask_app.preprocess_request()
+                    if rv is None:
+                        verify_jwt_in_request()
+                        async with asgi_request.app.state.sessions() as session:
+                            rv = await view(session, **request.view_args)
+                except Exception as err:
+                    rv = flask_app.handle_user_exception(err)
+                response = flask_app.finalize_request(rv)
+            except Exception as err:
+                response = flask_app.handle_exception(err)
+            # Headers are copied as they are, repeated ones included
+            asgi_response = Response(response.get_data(), status_code=response.status_code)
+            asgi_response.raw_headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in response.headers.items()]
+            return asgi_response
+    return endpoint
+
+# ASGI app serving the read-heavy GET endpoints with async handlers on an async engine, and every
+# other request through the Flask app as before. Run with: uvicorn asgi:create_asgi_app --factory
+def create_asgi_app():
+    flask_app = create_app()
+    engine, sessions = create_async_sessions(flask_app)
+    if flask_app.extensions["metrics"].enabled:
+        _watch_pool("async", engine.sync_engine.pool)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        # Loaded now rather than by the first request; an unseeded table is read again on use
+        async with sessions() as session:
+            await status_id(session, "approved")
+        yield
+        await engine.dispose()
+
+    routes = [
+        Route("/department/list", flask_view(get_all_departments), methods=["GET"]),
+        Route("/team/list", flask_view(get_all_teams), methods=["GET"]),
+        Route("/team/list/{team_id:int}", flask_view(view_approved_leaves_in_team), methods=["GET"]),
+        Route("/employee/{employee_id:int}", flask_view(view_approved_leaves_for_employee), methods=["GET"]),
+        Route("/leave_request", flask_view(view_leave_requests), methods=["GET"]),
+        # Writes and the remaining reads stay on the sync stack
+        Mount("", WSGIMiddleware(flask_app)),
+    ]
+    app = Starlette(routes=routes, lifespan=lifespan)
+    # Flask decides about trailing slashes, as it does for the sync app
+    app.router.redirect_slashes = False
+    app.state.flask_app = flask_app
+    app.state.sessions = sessions
+    return app
@@ -0,0 +1,290 @@
+import threading
+from datetime import date, timedelta
+
+from marshmallow import fields, post_load, validates_schema, ValidationError
+
+from init import db, ma
+from cache import TTLCache
+from models.employee import Employee
+from models.leave_request import LeaveRequest, leave_period
+from models.status import status_registry
+from models.team import Team
+from versions import collection_versions, team_leave_key
+
+# Longest range a team calendar view can cover
+CALENDAR_MAX_DAYS = 366
+
+# True if two inclusive date ranges share at least one day
+def ranges_overlap(start_a, end_a, start_b, end_b):
+    return start_a <= end_b and start_b <= end_a
+
+# Filter for leave requests sharing at least one day with the range. On PostgreSQL it is written
+# as a daterange overlap so the GiST index on (employee_id, period) answers it; elsewhere the
+# (employee_id, start_date, end_date) index of uix_employee_dates narrows the scan.
+def overlap_clause(start_date, end_date):
+    if db.session.get_bind().dialect.name == "postgresql":
+        return leave_period(LeaveRequest.start_date, LeaveRequest.end_date).op("&&")(leave_period(start_date, end_date))
+    return db.and_(LeaveRequest.start_date <= end_date, LeaveRequest.end_date >= start_date)
+
+# Returns (id, start_date, end_date) of the employee's leave requests in one of the statuses that overlap the range
+def find_overlapping_leave(employee_id, start_date, end_date, status_ids, exclude_id=None):
+    stmt = db.select(LeaveRequest.id, LeaveRequest.start_date, LeaveRequest.end_date).filter(
+        LeaveRequest.employee_id == employee_id,
+        LeaveRequest.status_id.in_(status_ids),
+        overlap_clause(start_date, end_date)
+    ).order_by(LeaveRequest.start_date)
+    if exclude_id is not None:
+        stmt = stmt.filter(LeaveRequest.id != exclude_id)
+    return db.session.execute(stmt).all()
+
+# Locks the employees' rows until the end of the transaction, so concurrent submissions
+# or approvals for the same employee run their overlap checks one after the other
+def lock_employees(employee_ids):
+    stmt = db.select(Employee.id).filter(Employee.id.in_(employee_ids)).order_by(Employee.id).with_for_update()
+    db.session.execute(stmt).all()
+
+# Checks leave requests about to be approved, given as (id, employee_id, start_date, end_date) rows.
+# Returns {id: conflicting ids} for each request overlapping approved leave or an earlier request
+# of the same batch, using one range query over the employees' approved leave in the batch span.
+def find_approval_conflicts(candidates, approved_status_id):
+    if not candidates:
+        return {}
+    employee_ids = {row.employee_id for row in candidates}
+    lock_employees(employee_ids)
+    stmt = db.select(LeaveRequest.id, LeaveRequest.employee_id, LeaveRequest.start_date, LeaveRequest.end_date).filter(
+        LeaveRequest.employee_id.in_(employee_ids),
+        LeaveRequest.status_id == approved_status_id,
+        LeaveRequest.start_date <= max(row.end_date for row in candidates),
+        LeaveRequest.end_date >= min(row.start_date for row in candidates)
+    )
+    approved = {}
+    for row in db.session.execute(stmt):
+        approved.setdefault(row.employee_id, []).append(row)
+
+    conflicts = {}
+    for row in sorted(candidates, key=lambda candidate: candidate.id):
+        taken = approved.setdefault(row.employee_id, [])
+        conflicting_ids = [other.id for other in taken if ranges_overlap(row.start_date, row.end_date, other.start_date, other.end_date)]
+        if conflicting_ids:
+            conflicts[row.id] = conflicting_ids
+        else:
+            # Later requests in the batch must not overlap this one once it is approved
+            taken.append(row)
+    return conflicts
+
+# Highest number of intervals covering the same day between start_date and end_date,
+# found by sweeping over the interval start and end points in date order
+def max_concurrent(intervals, start_date, end_date):
+    events = []
+    for interval_start, interval_end in intervals:
+        if ranges_overlap(interval_start, interval_end, start_date, end_date):
+            events.append((max(interval_start, start_date), 1))
+            # A leave ending on a day still counts on that day, so it leaves the day after
+            events.append((min(interval_end, end_date) + timedelta(days=1), -1))
+    # On the same date, departures (-1) are processed before arrivals (+1)
+    events.sort()
+    highest = current = 0
+    for _, change in events:
+        current += change
+        highest = max(highest, current)
+    return highest
+
+# Checks leave requests about to be approved, given as (id, employee_id, start_date, end_date) rows,
+# against the capacity of each employee's team. Returns {id: error} for requests that would put more
+# team members on leave on some day than the team allows. The employees' rows are locked before their
+# team is read, so a team move cannot slip in between, then the teams' rows, so concurrent approvals
+# for a team are checked one after the other. Always employees first, then teams, in id order.
+# Only approved leave overlapping the candidates' span is read, in one range query.
+def find_capacity_conflicts(candidates, approved_status_id):
+    if not candidates:
+        return {}
+    stmt = db.select(Employee.id, Employee.team_id) \
+        .filter(Employee.id.in_({row.employee_id for row in candidates})) \
+        .order_by(Employee.id) \
+        .with_for_update()
+    team_of = dict(db.session.execute(stmt).all())
+    stmt = db.select(Team.id, Team.max_concurrent_absence) \
+        .filter(Team.id.in_(set(team_of.values()))) \
+        .order_by(Team.id) \
+        .with_for_update()
+    capacities = {team_id: capacity for team_id, capacity in db.session.execute(stmt) if capacity is not None}
+    limited = [row for row in candidates if team_of.get(row.employee_id) in capacities]
+    if not limited:
+        return {}
+
+    stmt = db.select(Employee.team_id, LeaveRequest.start_date, LeaveRequest.end_date) \
+        .join(Employee, LeaveRequest.employee_id == Employee.id) \
+        .filter(
+            Employee.team_id.in_({team_of[row.employee_id] for row in limited}),
+            LeaveRequest.status_id == approved_status_id,
+            LeaveRequest.start_date <= max(row.end_date for row in limited),
+            LeaveRequest.end_date >= min(row.start_date for row in limited)
+        )
+    approved = {}
+    for row in db.session.execute(stmt):
+        approved.setdefault(row.team_id, []).append((row.start_date, row.end_date))
+
+    conflicts = {}
+    for row in sorted(limited, key=lambda candidate: candidate.id):
+        team_id = team_of[row.employee_id]
+        intervals = approved.setdefault(team_id, [])
+        if max_concurrent(intervals, row.start_date, row.end_date) + 1 > capacities[team_id]:
+            conflicts[row.id] = f"Approving would put more than {capacities[team_id]} members of team ID {team_id} on leave on the same day."
+        else:
+            # Later requests in the batch are checked with this one approved
+            intervals.append((row.start_date, row.end_date))
+    return conflicts
+
+# Approved leave of one team that ends on or after `since`, held in memory so calendar views
+# are answered without a query, and updated in place by the approvals and deletions of this process
+class TeamCalendar:
+    def __init__(self, team_id, since, leaves):
+        self.team_id = team_id
+        self.since = since
+        # Leave request id -> (employee name, start date, end date)
+        self._leaves = {leave_id: (name, start, end) for leave_id, name, start, end in leaves}
+        self._lock = threading.Lock()
+
+    def add(self, leave_id, name, start_date, end_date):
+        if end_date >= self.since:
+            with self._lock:
+                self._leaves[leave_id] = (name, start_date, end_date)
+
+    def remove(self, leave_id):
+        with self._lock:
+            self._leaves.pop(leave_id, None)
+
+    # Returns the absences on each day from from_date to to_date. The counts come from a
+    # difference array, +1 on the first day of each leave and -1 on the day after its last,
+    # summed up day by day, so they take O(leaves + days) however long the leave is. The names
+    # are swept the same way: each leave joins the absent list on its first day and leaves it
+    # after its last, in (start date, name) order.
+    def days(self, from_date, to_date):
+        size = (to_date - from_date).days + 1
+        delta = [0] * (size + 1)
+        starting = [[] for _ in range(size)]
+        ending = [[] for _ in range(size)]
+        with self._lock:
+            leaves = list(self._leaves.items())
+        for leave_id, (name, start_date, end_date) in sorted(leaves, key=lambda leave: (leave[1][1], leave[1][0])):
+            first = max((start_date - from_date).days, 0)
+            last = min((end_date - from_date).days, size - 1)
+            if first > last:
+                continue
+            delta[first] += 1
+            delta[last + 1] -= 1
+            starting[first].append((leave_id, name))
+            ending[last].append(leave_id)
+
+        days = []
+        absent_count = 0
+        absent = {}
+        for index in range(size):
+            absent_count += delta[index]
+            absent.update(starting[index])
+            days.append({"date": (from_date + timedelta(days=index)).isoformat(), "absent": absent_count, "employees": list(absent.values())})
+            for leave_id in ending[index]:
+                del absent[leave_id]
+        return days
+
+# Team id -> (version, TeamCalendar). An entry is only used while the version of the team's
+# upcoming leave is unchanged (see versions.py), so a change committed by any process,
+# approving, deleting, moving or renaming, makes the next view reload the calendar.
+# Approvals and deletions made by this process update the entry in place instead.
+team_calendars = TTLCache(maxsize=256, ttl=300)
+_calendars_lock = threading.Lock()
+
+def _employee_name(first_name, last_name):
+    return f"{first_name} {last_name}"
+
+def _calendar_version(team_id):
+    key = team_leave_key(team_id)
+    return collection_versions.store.get_many([key])[key]
+
+# Returns the team's cached calendar if it is current and covers leave from from_date on, else None
+def cached_team_calendar(team_id, from_date):
+    entry = team_calendars.get(team_id)
+    if entry is None:
+        return None
+    version, calendar = entry
+    if version != _calendar_version(team_id) or calendar.since > from_date:
+        return None
+    return calendar
+
+# Loads the team's calendar covering leave from from_date on with one query, and caches it
+def load_team_calendar(team_id, from_date):
+    # Read the version before the data, so an entry never claims newer data than it holds
+    version = _calendar_version(team_id)
+    stmt = db.select(LeaveRequest.id, Employee.first_name, Employee.last_name, LeaveRequest.start_date, LeaveRequest.end_date) \
+        .join(Employee, LeaveRequest.employee_id == Employee.id) \
+        .filter(
+            Employee.team_id == team_id,
+            LeaveRequest.status_id == status_registry.get_id("approved"),
+            LeaveRequest.end_date >= from_date
+        )
+    leaves = [(row.id, _employee_name(row.first_name, row.last_name), row.start_date, row.end_date) for row in db.session.execute(stmt)]
+    calendar = TeamCalendar(team_id, from_date, leaves)
+    team_calendars.set(team_id, (version, calendar))
+    return calendar
+
+# Applies a change committed by the current request to the team's cached calendar, and moves the
+# entry to the version the commit bumped to. Only done when the entry was current right before
+# the commit, i.e. no other process changed the team's leave in between; else it is left to reload.
+def _update_calendar(team_id, change):
+    bumped = collection_versions.bumped(team_leave_key(team_id))
+    with _calendars_lock:
+        entry = team_calendars.get(team_id)
+        if bumped is None or entry is None or entry[0] != bumped[0]:
+            return
+        change(entry[1])
+        team_calendars.set(team_id, (bumped[1], entry[1]))
+
+# Adds newly approved leave, given as rows with id, employee_id, start_date and end_date, to the
+# cached calendars. Call after the commit.
+def record_approved_leave(leaves):
+    leaves = list(leaves)
+    if not leaves or not len(team_calendars):
+        return
+    stmt = db.select(Employee.id, Employee.team_id, Employee.first_name, Employee.last_name) \
+        .filter(Employee.id.in_({leave.employee_id for leave in leaves}))
+    employees = {row.id: row for row in db.session.execute(stmt)}
+    by_team = {}
+    for leave in leaves:
+        employee = employees.get(leave.employee_id)
+        if employee is not None and employee.team_id is not None:
+            by_team.setdefault(employee.team_id, []).append((leave, _employee_name(employee.first_name, employee.last_name)))
+    for team_id, team_leaves in by_team.items():
+        def add(calendar, team_leaves=team_leaves):
+            for leave, name in team_leaves:
+                calendar.add(leave.id, name, leave.start_date, leave.end_date)
+        _update_calendar(team_id, add)
+
+# Takes a deleted leave request off the cached calendar of the team, given as it was before the
+# commit. Call after the commit.
+def forget_leave(leave_id, team_id):
+    if team_id is not None:
+        _update_calendar(team_id, lambda calendar: calendar.remove(leave_id))
+
+class TeamCalendarSchema(ma.Schema):
+    # Date range of a calendar view, defaulting to the next 30 days
+    from_date = fields.Date(data_key="from")
+    to_date = fields.Date(data_key="to")
+
+    @post_load
+    def apply_defaults(self, data, **kwargs):
+        data.setdefault("from_date", date.today())
+        data.setdefault("to_date", data["from_date"] + timedelta(days=29))
+        return data
+
+    # Date range validation
+    @validates_schema
+    def validate_dates(self, data, **kwargs):
+        from_date = data.get("from_date", date.today())
+        to_date = data.get("to_date", from_date + timedelta(days=29))
+        if from_date > to_date:
+            raise ValidationError("From date must be before or the same as the to date.")
+        if (to_date - from_date).days >= CALENDAR_MAX_DAYS:
+            raise ValidationError(f"A calendar can cover at most {CALENDAR_MAX_DAYS} days.")
+
+# To validate the query string of a calendar view
+team_calendar_schema = TeamCalendarSchema()
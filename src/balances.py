@@ -0,0 +1,222 @@
+from datetime import date
+from decimal import Decimal
+
+from init import db
+from models.employee import Employee
+from models.leave_request import LeaveRequest
+from models.leave_ledger import LeaveLedgerEntry, LeaveBalance
+from models.status import status_registry
+from routing import on_primary
+from workdays import leave_working_days
+
+# Ledger entries are kept to two decimal places, a monthly accrual being a twelfth of the entitlement
+TWO_PLACES = Decimal("0.01")
+
+# Start of the accrual period a day falls in
+def accrual_period(accrual_rule, day):
+    if accrual_rule == "monthly":
+        return day.replace(day=1)
+    return day.replace(month=1, day=1)
+
+# Start of the accrual period following the one starting on `period`
+def next_accrual_period(accrual_rule, period):
+    if accrual_rule == "monthly":
+        return date(period.year + period.month // 12, period.month % 12 + 1, 1)
+    return date(period.year + 1, 1, 1)
+
+# Days credited for one accrual period
+def accrual_amount(accrual_rule, annual_entitlement):
+    if accrual_rule == "monthly":
+        return (Decimal(annual_entitlement) / 12).quantize(TWO_PLACES)
+    return Decimal(annual_entitlement)
+
+# Accrual periods not credited yet, up to the one containing `today`. A new balance starts with the current period.
+def due_accrual_periods(accrual_rule, accrued_through, today):
+    current = accrual_period(accrual_rule, today)
+    if accrued_through is None:
+        return [current]
+    periods = []
+    period = next_accrual_period(accrual_rule, accrued_through)
+    while period <= current:
+        periods.append(period)
+        period = next_accrual_period(accrual_rule, period)
+    return periods
+
+# The balance with the accrual periods due by `today` credited, as `flask db accrue` will post them,
+# without writing anything. `balance` is the LeaveBalance row, or None before the first posting.
+def projected_balance(employee_id, balance, accrual_rule, annual_entitlement, today=None):
+    today = today or date.today()
+    accrued_through = balance.accrued_through if balance is not None else None
+    periods = due_accrual_periods(accrual_rule, accrued_through, today)
+    due = accrual_amount(accrual_rule, annual_entitlement) * len(periods)
+    return {
+        "employee_id": employee_id,
+        "accrued": (balance.accrued if balance is not None else Decimal(0)) + due,
+        "taken": balance.taken if balance is not None else Decimal(0),
+        "balance": (balance.balance if balance is not None else Decimal(0)) + due,
+        "accrued_through": periods[-1] if periods else accrued_through,
+    }
+
+# Creates empty balances for the employees that don't have one yet
+def open_balances(employee_ids):
+    employee_ids = set(employee_ids)
+    # From the primary, as the rows found decide which ones are inserted
+    stmt = on_primary(db.select(LeaveBalance.employee_id).filter(LeaveBalance.employee_id.in_(employee_ids)))
+    missing = employee_ids - set(db.session.scalars(stmt))
+    if missing:
+        db.session.execute(db.insert(LeaveBalance), [{"employee_id": employee_id} for employee_id in sorted(missing)])
+
+# Adds entries to the ledger and applies their totals to the materialized balances, in the current transaction.
+# Each entry is a dict of employee_id, leave_request_id, entry_type, days and effective_date.
+def post_entries(entries):
+    if not entries:
+        return
+    db.session.execute(db.insert(LeaveLedgerEntry), entries)
+
+    # One increment per employee, so concurrent postings add up instead of overwriting each other
+    totals = {}
+    for entry in entries:
+        accrued, taken = totals.get(entry["employee_id"], (Decimal(0), Decimal(0)))
+        if entry["entry_type"] == "accrual":
+            accrued += entry["days"]
+        else:
+            taken -= entry["days"]
+        totals[entry["employee_id"]] = (accrued, taken)
+    balances = LeaveBalance.__table__
+    stmt = db.update(balances).where(balances.c.employee_id == db.bindparam("b_employee_id")).values(
+        accrued=balances.c.accrued + db.bindparam("b_accrued"),
+        taken=balances.c.taken + db.bindparam("b_taken"),
+        balance=balances.c.balance + db.bindparam("b_accrued") - db.bindparam("b_taken")
+    )
+    db.session.execute(stmt, [
+        {"b_employee_id": employee_id, "b_accrued": accrued, "b_taken": taken}
+        for employee_id, (accrued, taken) in totals.items()
+    ])
+
+# Credits the accrual periods that came due since each employee's balance was last accrued.
+# The balance rows are locked first, so concurrent callers cannot credit the same period twice.
+def accrue(employee_ids, today=None):
+    today = today or date.today()
+    open_balances(employee_ids)
+    stmt = db.select(LeaveBalance.employee_id, LeaveBalance.accrued_through, Employee.annual_entitlement, Employee.accrual_rule) \
+        .join(Employee, LeaveBalance.employee_id == Employee.id) \
+        .filter(LeaveBalance.employee_id.in_(set(employee_ids))) \
+        .order_by(LeaveBalance.employee_id) \
+        .with_for_update(of=LeaveBalance)
+
+    entries = []
+    accrued_through = []
+    for row in db.session.execute(stmt):
+        periods = due_accrual_periods(row.accrual_rule, row.accrued_through, today)
+        if not periods:
+            continue
+        amount = accrual_amount(row.accrual_rule, row.annual_entitlement)
+        entries.extend(
+            {"employee_id": row.employee_id, "leave_request_id": None, "entry_type": "accrual", "days": amount, "effective_date": period}
+            for period in periods
+        )
+        accrued_through.append({"b_employee_id": row.employee_id, "b_accrued_through": periods[-1]})
+
+    if accrued_through:
+        balances = LeaveBalance.__table__
+        stmt = db.update(balances).where(balances.c.employee_id == db.bindparam("b_employee_id")) \
+            .values(accrued_through=db.bindparam("b_accrued_through"))
+        db.session.execute(stmt, accrued_through)
+    post_entries(entries)
+
+# Debits the working days of newly approved leave, given as rows or objects with id, employee_id, start_date and end_date
+def post_leave_debits(leave_requests):
+    if not leave_requests:
+        return
+    open_balances({leave_request.employee_id for leave_request in leave_requests})
+    post_entries([
+        {
+            "employee_id": leave_request.employee_id,
+            "leave_request_id": leave_request.id,
+            "entry_type": "debit",
+            "days": -Decimal(working_days),
+            "effective_date": leave_request.start_date
+        }
+        for leave_request, working_days in zip(leave_requests, leave_working_days(leave_requests))
+    ])
+
+# Gives back the days debited for leave requests that are deleted or no longer approved.
+# Requests that were never debited, or were already given back, are left alone.
+def reverse_leave_debits(leave_request_ids):
+    if not leave_request_ids:
+        return
+    net_days = db.func.sum(LeaveLedgerEntry.days)
+    stmt = db.select(LeaveLedgerEntry.leave_request_id, LeaveLedgerEntry.employee_id, net_days.label("days")) \
+        .filter(LeaveLedgerEntry.leave_request_id.in_(set(leave_request_ids))) \
+        .group_by(LeaveLedgerEntry.leave_request_id, LeaveLedgerEntry.employee_id) \
+        .having(net_days != 0)
+    today = date.today()
+    post_entries([
+        {"employee_id": row.employee_id, "leave_request_id": row.leave_request_id, "entry_type": "reversal", "days": -Decimal(row.days).quantize(TWO_PLACES), "effective_date": today}
+        for row in db.session.execute(stmt)
+    ])
+
+# Brings the whole ledger and every balance up to date: credits due accruals, makes the net debit of each
+# approved leave request equal its working days (so calendar or holiday changes are picked up), gives back
+# debits of leave that is no longer approved, then recomputes the materialized balances from the ledger.
+# Returns the number of ledger entries posted and of balances that were corrected.
+def rebuild_balances(today=None):
+    employee_ids = db.session.scalars(db.select(Employee.id)).all()
+    if not employee_ids:
+        return 0, 0
+    entry_count = db.session.scalar(db.select(db.func.count()).select_from(LeaveLedgerEntry))
+    accrue(employee_ids, today)
+
+    # Net days debited per leave request according to the ledger
+    stmt = db.select(LeaveLedgerEntry.leave_request_id, db.func.sum(LeaveLedgerEntry.days)) \
+        .filter(LeaveLedgerEntry.leave_request_id.is_not(None)) \
+        .group_by(LeaveLedgerEntry.leave_request_id)
+    net_days = {leave_request_id: Decimal(days).quantize(TWO_PLACES) for leave_request_id, days in db.session.execute(stmt)}
+
+    # Working days of all approved leave, scored in one vectorized pass
+    stmt = db.select(LeaveRequest.id, LeaveRequest.employee_id, LeaveRequest.start_date, LeaveRequest.end_date) \
+        .filter(LeaveRequest.status_id == status_registry.get_id("approved"))
+    approved = db.session.execute(stmt).all()
+    adjustments = []
+    for leave_request, working_days in zip(approved, leave_working_days(approved)):
+        net = net_days.pop(leave_request.id, None)
+        difference = -Decimal(working_days) - (net or 0)
+        if difference:
+            adjustments.append({
+                "employee_id": leave_request.employee_id,
+                "leave_request_id": leave_request.id,
+                "entry_type": "debit" if net is None else "adjustment",
+                "days": difference,
+                "effective_date": leave_request.start_date
+            })
+    open_balances({entry["employee_id"] for entry in adjustments})
+    post_entries(adjustments)
+    # Whatever is left in net_days belongs to leave that is no longer approved
+    reverse_leave_debits([leave_request_id for leave_request_id, days in net_days.items() if days])
+    posted = db.session.scalar(db.select(db.func.count()).select_from(LeaveLedgerEntry)) - entry_count
+
+    # Totals per employee straight from the ledger, in one aggregate query
+    is_accrual = LeaveLedgerEntry.entry_type == "accrual"
+    stmt = db.select(
+        LeaveLedgerEntry.employee_id,
+        db.func.sum(db.case((is_accrual, LeaveLedgerEntry.days), else_=0)).label("accrued"),
+        -db.func.sum(db.case((is_accrual, 0), else_=LeaveLedgerEntry.days)).label("taken"),
+        db.func.sum(LeaveLedgerEntry.days).label("balance")
+    ).group_by(LeaveLedgerEntry.employee_id)
+    totals = {row.employee_id: row for row in db.session.execute(stmt)}
+
+    # Rewrite only the balances that drifted from the ledger
+    corrections = []
+    for balance in db.session.execute(db.select(LeaveBalance.employee_id, LeaveBalance.accrued, LeaveBalance.taken, LeaveBalance.balance)):
+        total = totals.get(balance.employee_id)
+        expected = tuple(Decimal(value).quantize(TWO_PLACES) for value in (total[1:] if total else (0, 0, 0)))
+        current = tuple(Decimal(value).quantize(TWO_PLACES) for value in balance[1:])
+        if expected != current:
+            corrections.append({"b_employee_id": balance.employee_id, "b_accrued": expected[0], "b_taken": expected[1], "b_balance": expected[2]})
+    if corrections:
+        balances = LeaveBalance.__table__
+        stmt = db.update(balances).where(balances.c.employee_id == db.bindparam("b_employee_id")).values(
+            accrued=db.bindparam("b_accrued"), taken=db.bindparam("b_taken"), balance=db.bindparam("b_balance")
+        )
+        db.session.execute(stmt, corrections)
+    return posted, len(corrections)
@@ -0,0 +1,419 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta, timezone
+
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Benchmarks every route of the API against a throwaway local database, at several data sizes.
+# Usage, from the src directory:
+#   python benchmark.py --output benchmark.json
+#   python benchmark.py --baseline benchmark.json   (exits with status 1 on a regression)
+# It also EXPLAINs the hot queries and exits with status 1 when one of them uses none of its indexes.
+# The database given with --database-url is dropped and recreated for every size. It defaults to a
+# temporary SQLite file, so DATABASE_URL from the environment is never touched.
+
+# Data generated for each size by seed_large()
+SIZES = {
+    "small": {"departments": 3, "teams": 10, "employees": 100, "leave_per_employee": 10},
+    "medium": {"departments": 10, "teams": 100, "employees": 2000, "leave_per_employee": 20},
+    "large": {"departments": 20, "teams": 400, "employees": 20000, "leave_per_employee": 25},
+}
+
+# A route is a regression when its median latency grows by more than the threshold and this many milliseconds
+MIN_LATENCY_REGRESSION_MS = 0.5
+
+# Statements sent to the database, counted for every request
+query_counter = {"count": 0}
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    query_counter["count"] += 1
+
+class Run:
+    def __init__(self, app, client):
+        self.app = app
+        self.client = client
+        self.samples = {}
+        self.trace = False
+        self._day = date(2090, 1, 1)
+
+    # Sends one request and records its latency, query count and, when tracing, peak allocation
+    def timed(self, route, method, url, **kwargs):
+        query_counter["count"] = 0
+        if self.trace:
+            tracemalloc.reset_peak()
+            allocated_before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        response = self.client.open(url, method=method, **kwargs)
+        # Streamed bodies are only produced while being read
+        response.get_data()
+        elapsed = time.perf_counter() - start
+        sample = self.samples.setdefault(route, {"status": response.status_code, "latency": [], "queries": [], "allocated": []})
+        if self.trace:
+            sample["allocated"].append(tracemalloc.get_traced_memory()[1] - allocated_before)
+        else:
+            sample["latency"].append(elapsed * 1000)
+            sample["queries"].append(query_counter["count"])
+        return response
+
+    # Sends a request that is set up or cleaned up around the measured one
+    def call(self, method, url, **kwargs):
+        response = self.client.open(url, method=method, **kwargs)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {url} returned {response.status_code}: {response.get_data(as_text=True)}")
+        return response
+
+    # Dates of a new leave request, each call a week after the previous one, far from the seeded leave
+    def next_dates(self):
+        start_date = self._day
+        self._day += timedelta(days=7)
+        return {"start_date": start_date.isoformat(), "end_date": (start_date + timedelta(days=2)).isoformat()}
+
+# Logs in and picks the records the routes are called with
+def prepare(run):
+    from init import db
+    from models.employee import Employee
+    from models.leave_request import LeaveRequest
+
+    login = {"email": "employee1@example.com", "password": "q1w2e3"}
+    run.admin = {"Authorization": "Bearer " + run.call("POST", "/auth/login", json=login).json["token"]}
+    login = {"email": "employee2@example.com", "password": "q1w2e3"}
+    run.user = {"Authorization": "Bearer " + run.call("POST", "/auth/login", json=login).json["token"]}
+    with run.app.app_context():
+        employee = db.session.scalar(db.select(Employee).filter_by(email="employee2@example.com"))
+        run.user_id = employee.id
+        run.team_id = employee.team_id
+        run.leave_request_id = db.session.scalar(db.select(LeaveRequest.id).filter_by(employee_id=employee.id).limit(1))
+        run.other_employee_id = db.session.scalar(db.select(Employee.id).filter_by(email="employee3@example.com"))
+
+def _add_leave(run):
+    return run.call("POST", "/leave_request/add", headers=run.user, json=run.next_dates()).json["id"]
+
+# One function per route, each measuring a single request. Routes that change data clean up after themselves.
+def _login(run):
+    run.timed("POST /auth/login", "POST", "/auth/login", json={"email": "employee2@example.com", "password": "q1w2e3"})
+
+def _register_delete(run):
+    body = {"first_name": "Bench", "last_name": "Mark", "email": f"bench{time.perf_counter_ns()}@example.com", "password": "q1w2e3", "team_id": run.team_id}
+    employee_id = run.timed("POST /auth/register", "POST", "/auth/register", json=body).json["id"]
+    run.timed("DELETE /auth/delete/<int:employee_id>", "DELETE", f"/auth/delete/{employee_id}", headers=run.admin)
+
+def _register_bulk(run):
+    body = [{"first_name": "Bench", "last_name": "Mark", "email": f"bench{time.perf_counter_ns()}@example.com", "password": "q1w2e3", "team_id": run.team_id}]
+    employee_id = run.timed("POST /auth/register/bulk", "POST", "/auth/register/bulk", headers=run.admin, json=body).json["created"][0]["id"]
+    run.call("DELETE", f"/auth/delete/{employee_id}", headers=run.admin)
+
+def _update_self(run):
+    run.timed("PUT /auth/update", "PUT", "/auth/update", headers=run.user, json={"first_name": "Bench"})
+
+def _admin_update(run):
+    run.timed("PUT /auth/update/<int:employee_id>", "PUT", f"/auth/update/{run.other_employee_id}", headers=run.admin, json={"last_name": "Mark"})
+
+def _admin_role(run):
+    run.timed("POST /auth/admin/<int:employee_id>", "POST", f"/auth/admin/{run.other_employee_id}", headers=run.admin)
+    run.timed("DELETE /auth/admin/<int:employee_id>", "DELETE", f"/auth/admin/{run.other_employee_id}", headers=run.admin)
+
+def _leave_requests(run):
+    run.timed("GET /leave_request", "GET", "/leave_request", headers=run.user)
+
+def _leave_request(run):
+    run.timed("GET /leave_request/<int:leave_request_id>", "GET", f"/leave_request/{run.leave_request_id}", headers=run.user)
+
+def _export(run):
+    run.timed("GET /leave_request/export", "GET", "/leave_request/export?format=csv&status=approved", headers=run.admin)
+
+def _add_approve_delete(run):
+    leave_request_id = run.timed("POST /leave_request/add", "POST", "/leave_request/add", headers=run.user, json=run.next_dates()).json["id"]
+    run.timed("POST /leave_request/approve/<int:leave_request_id>", "POST", f"/leave_request/approve/{leave_request_id}", headers=run.admin)
+    run.timed("DELETE /leave_request/delete/<int:leave_request_id>", "DELETE", f"/leave_request/delete/{leave_request_id}", headers=run.user)
+
+def _bulk(run):
+    body = [run.next_dates() for _ in range(5)]
+    created = run.timed("POST /leave_request/bulk", "POST", "/leave_request/bulk", headers=run.user, json=body).json["created"]
+    for leave_request in created:
+        run.call("DELETE", f"/leave_request/delete/{leave_request['id']}", headers=run.user)
+
+def _transition(run):
+    ids = [_add_leave(run) for _ in range(5)]
+    run.timed("POST /leave_request/transition", "POST", "/leave_request/transition", headers=run.admin, json={"ids": ids, "status": "rejected"})
+    for leave_request_id in ids:
+        run.call("DELETE", f"/leave_request/delete/{leave_request_id}", headers=run.user)
+
+def _employees(run):
+    run.timed("GET /employee/list", "GET", "/employee/list", headers=run.admin)
+
+def _employee(run):
+    run.timed("GET /employee/<int:employee_id>", "GET", f"/employee/{run.user_id}", headers=run.user)
+
+def _balance(run):
+    run.timed("GET /employee/<int:employee_id>/balance", "GET", f"/employee/{run.user_id}/balance", headers=run.user)
+
+def _departments(run):
+    run.timed("GET /department/list", "GET", "/department/list", headers=run.user)
+
+def _department_add_delete(run):
+    body = {"department_name": f"Bench {time.perf_counter_ns()}"}
+    department_id = run.timed("POST /department/add", "POST", "/department/add", headers=run.admin, json=body).json["id"]
+    run.timed("DELETE /department/delete/<int:department_id>", "DELETE", f"/department/delete/{department_id}", headers=run.admin)
+
+def _teams(run):
+    run.timed("GET /team/list", "GET", "/team/list", headers=run.user)
+
+def _team(run):
+    run.timed("GET /team/list/<int:team_id>", "GET", f"/team/list/{run.team_id}", headers=run.user)
+
+def _team_add_update_delete(run):
+    body = {"team_name": f"Bench {time.perf_counter_ns()}", "department_id": 1}
+    team_id = run.timed("POST /team/add", "POST", "/team/add", headers=run.admin, json=body).json["id"]
+    run.timed("PUT /team/update/<int:team_id>", "PUT", f"/team/update/{team_id}", headers=run.admin, json={"max_concurrent_absence": 2})
+    run.timed("DELETE /team/delete/<int:team_id>", "DELETE", f"/team/delete/{team_id}", headers=run.admin)
+
+def _calendar(run):
+    run.timed("GET /team/<int:team_id>/calendar", "GET", f"/team/{run.team_id}/calendar", headers=run.user)
+
+def _analytics(run):
+    run.timed("GET /analytics/leave", "GET", "/analytics/leave?group_by=team", headers=run.admin)
+
+def _metrics(run):
+    run.timed("GET /metrics", "GET", "/metrics")
+
+CASES = (
+    _login, _register_delete, _register_bulk, _update_self, _admin_update, _admin_role,
+    _leave_requests, _leave_request, _export, _add_approve_delete, _bulk, _transition,
+    _employees, _employee, _balance, _departments, _department_add_delete,
+    _teams, _team, _team_add_update_delete, _calendar, _analytics, _metrics,
+)
+
+# Recreates the database and fills it with the generated data of one size
+def seed(app, params):
+    from init import db
+    from seeding import seed_large
+    from analytics import rebuild_leave_summary
+    from balances import rebuild_balances
+    from models.status import status_registry
+
+    with app.app_context():
+        db.drop_all()
+        status_registry.invalidate()
+        db.create_all()
+        seed_large(**params, seed=1, progress=lambda message: None)
+        rebuild_leave_summary()
+        rebuild_balances()
+        db.session.commit()
+
+# Hot query shapes of the read routes, each with the indexes that can serve it
+def hot_queries():
+    from init import db
+    from models.employee import Employee
+    from models.leave_request import LeaveRequest
+    from models.status import status_registry
+
+    employee = db.session.execute(db.select(Employee.id, Employee.team_id).order_by(Employee.id).limit(1)).one()
+    approved_status_id = status_registry.get_id("approved")
+    start_date = date.today()
+    end_date = start_date + timedelta(days=30)
+    return {
+        # GET /leave_request
+        "leave requests of an employee": (
+            db.select(LeaveRequest.id).where(LeaveRequest.employee_id == employee.id).order_by(LeaveRequest.id).limit(51),
+            ("ix_leave_request_employee_id",),
+        ),
+        # GET /leave_request?cursor=...
+        "next page of an employee's leave requests": (
+            db.select(LeaveRequest.id).where(LeaveRequest.employee_id == employee.id, LeaveRequest.id > 0).order_by(LeaveRequest.id).limit(51),
+            ("ix_leave_request_employee_id",),
+        ),
+        # GET /employee/<int:employee_id>
+        "approved leave of an employee": (
+            db.select(LeaveRequest.id).where(
+                LeaveRequest.employee_id == employee.id,
+                LeaveRequest.status_id == approved_status_id,
+                LeaveRequest.start_date.between(start_date, end_date)
+            ),
+            ("ix_leave_request_employee_status_start",),
+        ),
+        # GET /team/list/<int:team_id>
+        "approved leave of a team": (
+            db.select(LeaveRequest.id).join(Employee).where(
+                Employee.team_id == employee.team_id,
+                LeaveRequest.status_id == approved_status_id,
+                LeaveRequest.start_date.between(start_date, end_date)
+            ),
+            ("ix_employee_team_id", "ix_leave_request_status_start"),
+        ),
+        # GET /leave_request/export?status=approved&from=...&to=...
+        "export of approved leave": (
+            db.select(LeaveRequest.id).where(
+                LeaveRequest.status_id == approved_status_id,
+                LeaveRequest.start_date <= end_date,
+                LeaveRequest.end_date >= start_date
+            ).order_by(LeaveRequest.id),
+            ("ix_leave_request_status_start",),
+        ),
+    }
+
+def explain(connection, stmt):
+    sql = str(stmt.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True}))
+    if connection.dialect.name == "sqlite":
+        return [row.detail for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + sql)]
+    # Shows whether an index can serve the query at all, however small the tables are
+    connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+    return [row[0] for row in connection.exec_driver_sql("EXPLAIN " + sql)]
+
+# EXPLAINs every hot query and records whether its plan uses one of the expected indexes
+def check_plans(app):
+    from init import db
+
+    plans = {}
+    with app.app_context():
+        queries = hot_queries()
+        with db.engine.begin() as connection:
+            for name, (stmt, indexes) in queries.items():
+                plan = explain(connection, stmt)
+                used = [index for index in indexes if any(index in line for line in plan)]
+                plans[name] = {"uses_index": bool(used), "indexes": used or list(indexes), "plan": plan}
+        db.session.remove()
+    return plans
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+# Runs every case `repeat` times for latency and query counts, then once more with tracemalloc for allocations
+def bench_size(app, params, repeat):
+    seed(app, params)
+    plans = check_plans(app)
+    run = Run(app, app.test_client())
+    prepare(run)
+    for case in CASES:
+        case(run)
+    # The first pass only warms up caches and connections
+    run.samples = {}
+    for _ in range(repeat):
+        for case in CASES:
+            case(run)
+    run.trace = True
+    tracemalloc.start()
+    for case in CASES:
+        case(run)
+    tracemalloc.stop()
+
+    routes = {}
+    for route, sample in sorted(run.samples.items()):
+        routes[route] = {
+            "status": sample["status"],
+            "p50_ms": round(statistics.median(sample["latency"]), 3),
+            "p95_ms": round(_percentile(sample["latency"], 0.95), 3),
+            "mean_ms": round(statistics.fmean(sample["latency"]), 3),
+            "queries": max(sample["queries"]),
+            "allocated_kb": round(max(sample["allocated"]) / 1024, 1),
+        }
+    return routes, plans
+
+# Rules of the app that no case measures
+def unbenchmarked_routes(app, results):
+    measured = {route for routes in results.values() for route in routes}
+    missing = []
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint == "static":
+            continue
+        for method in sorted(rule.methods - {"HEAD", "OPTIONS"}):
+            name = f"{method} {rule.rule}"
+            # Routes accepting both PUT and PATCH are measured once, with PUT
+            if name not in measured and not (method == "PATCH" and f"PUT {rule.rule}" in measured):
+                missing.append(name)
+    return sorted(missing)
+
+# Lists the routes whose query count grew, or whose median latency grew beyond the threshold
+def compare(current, baseline, threshold):
+    regressions = []
+    for size, routes in current["sizes"].items():
+        for route, result in routes.items():
+            previous = baseline.get("sizes", {}).get(size, {}).get(route)
+            if previous is None:
+                continue
+            if result["queries"] > previous["queries"]:
+                regressions.append(f"{size} {route}: {previous['queries']} -> {result['queries']} queries")
+            limit = previous["p50_ms"] * (1 + threshold)
+            if result["p50_ms"] > limit and result["p50_ms"] - previous["p50_ms"] > MIN_LATENCY_REGRESSION_MS:
+                regressions.append(f"{size} {route}: median {previous['p50_ms']} -> {result['p50_ms']} ms")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every API route against a throwaway database.")
+    parser.add_argument("--database-url", help="Database to drop and recreate, a temporary SQLite file by default.")
+    parser.add_argument("--sizes", default="small,medium", help=f"Comma separated sizes out of {', '.join(SIZES)}.")
+    parser.add_argument("--repeat", type=int, default=20, help="Measured requests per route and size.")
+    parser.add_argument("--output", default="benchmark.json", help="File the JSON results are written to.")
+    parser.add_argument("--baseline", help="Earlier results to compare against, exiting with status 1 on a regression.")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed growth of the median latency, 0.25 being 25%%.")
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes.split(",")
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        parser.error(f"Unknown sizes: {', '.join(unknown)}")
+
+    # The app reads its settings from the environment when it is created
+    database_url = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "benchmark.db")
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("JWT_SECRET_KEY", "benchmark-secret-key-of-at-least-32-bytes")
+    # Hash on the request thread, so the numbers do not include starting a process pool
+    os.environ.setdefault("HASHING_EXECUTOR", "inline")
+    from main import create_app
+    app = create_app()
+    # Query budgets are reported here instead of failing the requests
+    app.config["QUERY_BUDGET_ENFORCED"] = False
+
+    results = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "dialect": sqlalchemy.engine.make_url(database_url).get_dialect().name,
+            "repeat": args.repeat,
+        },
+        "sizes": {},
+        "plans": {},
+    }
+    for size in sizes:
+        print(f"Benchmarking {size}...", file=sys.stderr)
+        results["sizes"][size], results["plans"][size] = bench_size(app, SIZES[size], args.repeat)
+    results["unbenchmarked"] = unbenchmarked_routes(app, results["sizes"])
+
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    for size, routes in results["sizes"].items():
+        for route, result in routes.items():
+            print(f"{size:8} {route:55} {result['p50_ms']:9.2f} ms {result['queries']:4} queries {result['allocated_kb']:9.1f} KiB")
+    if results["unbenchmarked"]:
+        print("Not benchmarked: " + ", ".join(results["unbenchmarked"]))
+    # A hot query that no index serves fails the run, with or without a baseline
+    unindexed = [
+        f"{size} {name}: uses none of {', '.join(plan['indexes'])}: {' / '.join(plan['plan'])}"
+        for size, plans in results["plans"].items()
+        for name, plan in plans.items()
+        if not plan["uses_index"]
+    ]
+    for line in unindexed:
+        print("Plan: " + line)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for regression in regressions:
+            print("Regression: " + regression)
+        return 1 if regressions or unindexed else 0
+    return 1 if unindexed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
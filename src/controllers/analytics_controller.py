@@ -0,0 +1,20 @@
+from flask import Blueprint, request
+from flask_jwt_extended import jwt_required
+
+from models.leave_summary import leave_analytics_schema
+from utils import auth_as_admin_decorator
+from profiling import query_budget
+from analytics import leave_analytics
+
+analytics_bp = Blueprint("analytics", __name__, url_prefix="/analytics")
+
+# Leave days and requests per department or team, month and status (admin only)
+@analytics_bp.route("/leave", methods=["GET"])
+@query_budget(3)
+@jwt_required()
+@auth_as_admin_decorator
+def view_leave_analytics():
+    # Validate the grouping and filters from the query string
+    params = leave_analytics_schema.load(request.args)
+    # Read the pre-aggregated summary, so the cost does not grow with the years of history
+    return leave_analytics(**params), 200
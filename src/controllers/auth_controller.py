@@ -1,14 +1,18 @@
+import csv
+import io
 from datetime import timedelta
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 
-from init import bcrypt, db
+from init import db, hasher
 from models.employee import Employee, employee_schema, EmployeeSchema
-from utils import auth_as_admin_decorator
+from models.team import Team
+from utils import auth_as_admin_decorator, is_not_null_violation, is_unique_violation, violated_column
+from analytics import move_leave_summary
+from imports import import_employees
 
 from sqlalchemy.exc import IntegrityError
-from psycopg2 import errorcodes
 
 auth_bp = Blueprint("auth", __name__, url_prefix="/auth")
 
@@ -30,7 +34,7 @@ def register_employee():
         # Hash the password
         password = body_data.get("password")
         if password:
-            employee.password = bcrypt.generate_password_hash(password).decode("utf-8")
+            employee.password = hasher.generate_password_hash(password)
 
         # Add and commit to the database
         db.session.add(employee)
@@ -40,11 +44,47 @@ def register_employee():
     
     # Error handling
     except IntegrityError as err:
-        if err.orig.pgcode == errorcodes.NOT_NULL_VIOLATION:
-            return {"error": f"The column {err.orig.diag.column_name} is required."}, 400
-        if err.orig.pgcode == errorcodes.UNIQUE_VIOLATION:
+        if is_not_null_violation(err):
+            return {"error": f"The column {violated_column(err)} is required."}, 400
+        if is_unique_violation(err):
             return {"error": "Email address is already registered."}, 400
 
+# Largest number of employees accepted by one bulk registration
+BULK_MAX_EMPLOYEES = 10000
+
+# Register many employees at once from a JSON list or a CSV body (admin only)
+@auth_bp.route("/register/bulk", methods=["POST"])
+@jwt_required()
+@auth_as_admin_decorator
+def register_employees_bulk():
+    # CSV bodies need a header row naming the columns
+    if request.mimetype == "text/csv":
+        records = list(csv.DictReader(io.StringIO(request.get_data(as_text=True))))
+    else:
+        records = request.get_json()
+    # Check the body is a non-empty list within the size limit
+    if not isinstance(records, list) or not records or not all(isinstance(record, dict) for record in records):
+        return {"error": "A list of employees is required."}, 400
+    if len(records) > BULK_MAX_EMPLOYEES:
+        return {"error": f"No more than {BULK_MAX_EMPLOYEES} employees can be registered at once."}, 400
+    # Each plain password takes a bcrypt hash of about a third of a second of CPU at cost 12, so
+    # larger imports with plain passwords go through `flask db import-employees` instead
+    max_passwords = current_app.config["BULK_REGISTER_MAX_PASSWORDS"]
+    if sum(1 for record in records if record.get("password") and not record.get("password_hash")) > max_passwords:
+        return {"error": f"No more than {max_passwords} employees with a plain password can be registered at once. Send bcrypt password hashes, or use flask db import-employees."}, 413
+
+    # Validate, hash and insert every valid row, reporting the others by index
+    try:
+        created, errors = import_employees(records)
+        db.session.commit()
+    # Another request registered one of the emails since the check
+    except IntegrityError as err:
+        db.session.rollback()
+        if is_unique_violation(err):
+            return {"error": "Email addresses were registered at the same time, please try again."}, 400
+        raise
+    return {"created": created, "errors": errors}, 201 if created else 400
+
 # Login an an existing employee
 @auth_bp.route("/login", methods=["POST"])
 def login_employee():
@@ -55,9 +95,14 @@ def login_employee():
     stmt = db.select(Employee).filter_by(email=body_data.get("email"))
     employee = db.session.scalar(stmt)
     
-    # If employee exists and password is correct, create JWT
-    if employee and bcrypt.check_password_hash(employee.password, body_data.get("password")):
-        token = create_access_token(identity=str(employee.id), expires_delta=timedelta(days=1))
+    # If employee exists and password is correct, create JWT carrying the admin role
+    if employee and hasher.check_password_hash(employee.password, body_data.get("password")):
+        # Upgrade hashes made with an older cost factor while the plain password is at hand
+        if hasher.needs_rehash(employee.password):
+            employee.password = hasher.generate_password_hash(body_data.get("password"))
+            db.session.commit()
+        claims = {"is_admin": bool(employee.is_admin), "role_version": employee.role_version}
+        token = create_access_token(identity=str(employee.id), expires_delta=timedelta(days=1), additional_claims=claims)
         return {"email": employee.email, "is_admin": employee.is_admin, "token": token}
     # Else, return an error message
     else:
@@ -83,7 +128,7 @@ def update_employee():
     employee.last_name = body_data.get("last_name") or employee.last_name
     password = body_data.get("password")
     if password:
-        employee.password = bcrypt.generate_password_hash(password).decode("utf-8")
+        employee.password = hasher.generate_password_hash(password)
     
     # Commit to the database
     db.session.commit()
@@ -103,18 +148,29 @@ def admin_update_employee(employee_id):
     if employee:
         body_data = request.get_json()
         # Define allowed fields for the admin
-        admin_allowed_fields = {"first_name", "last_name", "email", "team_id"}
+        admin_allowed_fields = {"first_name", "last_name", "email", "team_id", "annual_entitlement", "accrual_rule"}
         # Check if there are any disallowed fields in the request
         if not all(field in admin_allowed_fields for field in body_data.keys()):
-            return jsonify({"error": "You can only update the employee's first name, last name, email, or team ID."}), 400
+            return jsonify({"error": "You can only update the employee's first name, last name, email, team ID, annual entitlement, or accrual rule."}), 400
 
         # Load data with schema after validating the fields
         valid_data = EmployeeSchema().load(body_data, partial=True)
+        # The new team must exist before the employee's leave is moved to it
+        new_team_id = valid_data.get("team_id")
+        if new_team_id and new_team_id != employee.team_id and not db.session.get(Team, new_team_id):
+            return {"error": f"Team ID {new_team_id} not found."}, 400
         # Update the fields as required
         employee.first_name = valid_data.get("first_name") or employee.first_name
         employee.last_name = valid_data.get("last_name") or employee.last_name
         employee.email = valid_data.get("email") or employee.email
+        previous_team_id = employee.team_id
         employee.team_id = valid_data.get("team_id") or employee.team_id
+        # Entitlement changes apply from the next accrual period
+        if "annual_entitlement" in valid_data:
+            employee.annual_entitlement = valid_data["annual_entitlement"]
+        employee.accrual_rule = valid_data.get("accrual_rule") or employee.accrual_rule
+        # The employee's leave counts towards the new team in the analytics summary
+        move_leave_summary(employee.id, previous_team_id, employee.team_id)
 
         # Commit to the database
         db.session.commit()
@@ -156,6 +212,7 @@ def add_admin(employee_id):
             return {"error": f"Employee ID {employee_id} is already an admin."}, 400
         # Add the employee as an admin
         employee.is_admin = True
+        employee.role_version += 1
         db.session.commit()
         return {"message": f"Employee ID {employee_id} is now an admin."}, 200
     # Else, return error message
@@ -176,6 +233,8 @@ def remove_admin(employee_id):
             return {"error": f"Employee ID {employee_id} is not an admin."}, 400
         # Remove the employee as an admin
         employee.is_admin = False
+        # Bump the role version so admin tokens issued earlier are rejected straight away
+        employee.role_version += 1
         db.session.commit()
         return {"message": f"Employee ID {employee_id} is no longer an admin."}, 200
     # Else, return error message
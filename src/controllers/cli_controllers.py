@@ -1,12 +1,21 @@
+import csv
 from datetime import date
 
+import click
 from flask import Blueprint
-from init import db, bcrypt
+from marshmallow import ValidationError
+from init import db, hasher
 from models.department import Department
 from models.team import Team
 from models.employee import Employee
-from models.status import Status
+from models.status import Status, status_registry
 from models.leave_request import LeaveRequest
+from balances import accrue, post_leave_debits, rebuild_balances
+from analytics import rebuild_leave_summary
+from imports import import_employees
+from seeding import seed_large
+from exports import iter_leave_export, leave_export_schema
+from migrations import apply_migration, describe_change, plan_migration
 
 db_commands = Blueprint("db", __name__)
 
@@ -15,6 +24,24 @@ def create_tables():
     db.create_all()
     print("Tables created.")
 
+@db_commands.cli.command("migrate")
+@click.option("--dry-run", is_flag=True, help="List the changes without applying them.")
+def migrate_tables(dry_run):
+    # Add the tables, columns and indexes the models declare but the database lacks, dropping nothing
+    # but the indexes a failed concurrent build left invalid, which are built again
+    changes, problems = plan_migration()
+    for problem in problems:
+        click.echo(f"Skipped: {problem}", err=True)
+    if not changes:
+        print("Database is up to date.")
+        return
+    if dry_run:
+        for change in changes:
+            print(describe_change(change))
+        return
+    apply_migration(changes, progress=click.echo)
+    print(f"Migration applied: {len(changes)} changes.")
+
 @db_commands.cli.command("seed")
 def seed_tables():
     # Create a list of Department instances
@@ -40,6 +67,9 @@ def seed_tables():
     db.session.add_all(teams)
     db.session.commit() # Commit to save team records before referencing them in Employee instances
     
+    # Every seeded employee has the same password, so it is hashed once
+    password = hasher.generate_password_hash("q1w2e3")
+
     # Create a list of Employee instances
     employees = [
         Employee(
@@ -47,7 +77,7 @@ def seed_tables():
             last_name = "Chung",
             team_id = 1,
             email = "veronica.chung@email.com",
-            password = bcrypt.generate_password_hash("q1w2e3").decode("utf-8"),
+            password = password,
             is_admin = True
         ), 
         Employee(
@@ -55,7 +85,7 @@ def seed_tables():
             last_name = "Smith",
             team_id = 2,
             email = "john.smith@email.com",
-            password = bcrypt.generate_password_hash("q1w2e3").decode("utf-8"),
+            password = password,
             is_admin = True
         ),
         Employee(
@@ -63,7 +93,7 @@ def seed_tables():
             last_name = "Silva",
             team_id = 3,
             email = "isidro.silva@email.com",
-            password = bcrypt.generate_password_hash("q1w2e3").decode("utf-8"),
+            password = password,
             is_admin = True
         ), 
         Employee(
@@ -71,14 +101,14 @@ def seed_tables():
             last_name = "Woodward",
             team_id = 3,
             email = "cecelia.woodward@email.com",
-            password = bcrypt.generate_password_hash("q1w2e3").decode("utf-8"),
+            password = password,
         ),
         Employee(
             first_name = "Parker",
             last_name = "Durham",
             team_id = 4,
             email = "parker.durham@email.com",
-            password = bcrypt.generate_password_hash("q1w2e3").decode("utf-8"),
+            password = password,
             is_admin = True
         ),
         Employee(
@@ -86,7 +116,7 @@ def seed_tables():
             last_name = "Joseph",
             team_id = 4,
             email = "sue.joseph@email.com",
-            password = bcrypt.generate_password_hash("q1w2e3").decode("utf-8"),
+            password = password,
         )
     ]
 
@@ -129,6 +159,10 @@ def seed_tables():
     ]
 
     db.session.add_all(leave_requests)
+    db.session.flush()
+    # Debit the approved leave from the employees' balances
+    post_leave_debits([leave_request for leave_request in leave_requests if leave_request.status_id == approved_status_id])
+    rebuild_leave_summary()
     db.session.commit()
 
     print("Tables seeded.")
@@ -136,4 +170,79 @@ def seed_tables():
 @db_commands.cli.command("drop")
 def drop_tables():
     db.drop_all()
-    print("Tables dropped.")
\ No newline at end of file
+    # Statuses are gone, so the cached lookup must be reloaded on next use
+    status_registry.invalidate()
+    print("Tables dropped.")
+
+@db_commands.cli.command("export-leave")
+@click.option("--format", "export_format", type=click.Choice(["ndjson", "csv"]), default="ndjson", help="Output format.")
+@click.option("--from", "from_date", help="Include leave ending on or after this date (YYYY-MM-DD).")
+@click.option("--to", "to_date", help="Include leave starting on or before this date (YYYY-MM-DD).")
+@click.option("--status", type=click.Choice(["pending", "approved", "rejected"]), help="Only export leave with this status.")
+@click.option("--output", type=click.File("w"), default="-", help="File to write to, defaults to stdout.")
+def export_leave(export_format, from_date, to_date, status, output):
+    # Validate the filters the same way as the export endpoint
+    args = {"format": export_format, "from": from_date, "to": to_date, "status": status}
+    try:
+        params = leave_export_schema.load({key: value for key, value in args.items() if value is not None})
+    except ValidationError as err:
+        raise click.UsageError(str(err.messages))
+    for chunk in iter_leave_export(**params):
+        output.write(chunk)
+
+@db_commands.cli.command("rebuild-balances")
+def rebuild_leave_balances():
+    # Reconcile the ledger with approved leave and recompute every balance from it in one transaction
+    posted, corrected = rebuild_balances()
+    db.session.commit()
+    print(f"Balances rebuilt: {posted} ledger entries posted, {corrected} balances corrected.")
+
+# Employees whose balances are accrued per transaction
+ACCRUAL_BATCH_SIZE = 1000
+
+@db_commands.cli.command("accrue")
+def accrue_balances():
+    # Credit the accrual periods that came due, meant to run daily from a scheduler such as cron.
+    # Balance views show the due periods as credited already, so a late run changes no answer.
+    employee_ids = db.session.scalars(db.select(Employee.id).order_by(Employee.id)).all()
+    for start in range(0, len(employee_ids), ACCRUAL_BATCH_SIZE):
+        accrue(employee_ids[start:start + ACCRUAL_BATCH_SIZE])
+        db.session.commit()
+    print(f"Balances accrued for {len(employee_ids)} employees.")
+
+@db_commands.cli.command("rebuild-analytics")
+def rebuild_analytics():
+    # Recompute the leave summary from all leave requests in one transaction
+    count = rebuild_leave_summary()
+    db.session.commit()
+    print(f"Analytics rebuilt: {count} summary rows.")
+
+@db_commands.cli.command("import-employees")
+@click.argument("file", type=click.File("r"))
+def import_employees_from_csv(file):
+    # Import every valid row of the CSV file and list the rejected ones, numbered as in the file
+    created, errors = import_employees(csv.DictReader(file))
+    db.session.commit()
+    for error in errors:
+        click.echo(f"Row {error['index'] + 2}: {error['error']}", err=True)
+    print(f"Employees imported: {len(created)} created, {len(errors)} rejected.")
+
+@db_commands.cli.command("seed-large")
+@click.option("--departments", default=10, show_default=True, help="Number of departments.")
+@click.option("--teams", default=100, show_default=True, help="Number of teams, spread over the departments.")
+@click.option("--employees", default=10000, show_default=True, help="Number of employees.")
+@click.option("--leave-per-employee", default=20, show_default=True, help="Average number of leave requests per employee.")
+@click.option("--years", default=3, show_default=True, help="Years of leave history before today.")
+@click.option("--seed", default=0, show_default=True, help="Random seed, the same seed giving the same data.")
+def seed_large_tables(departments, teams, employees, leave_per_employee, years, seed):
+    # Generated names would clash with an earlier run
+    if db.session.scalar(db.select(Department.id).filter_by(department_name="Department 1")):
+        raise click.UsageError("The database already holds generated data, run flask db drop and flask db create first.")
+    seed_large(departments, teams, employees, leave_per_employee, years=years, seed=seed, progress=click.echo)
+    # Bring the aggregates in line with the generated leave
+    click.echo("Rebuilding analytics...")
+    rebuild_leave_summary()
+    click.echo("Rebuilding balances...")
+    rebuild_balances()
+    db.session.commit()
+    print("Tables seeded.")
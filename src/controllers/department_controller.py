@@ -3,20 +3,25 @@ from flask_jwt_extended import jwt_required
 
 from init import db
 from models.department import Department, department_schema, departments_schema
-from utils import auth_as_admin_decorator
+from utils import auth_as_admin_decorator, is_unique_violation
+from pagination import paginate, page_headers
+from profiling import query_budget
+from serializers import fast_dump
+from versions import conditional
 
 from sqlalchemy.exc import IntegrityError
-from psycopg2 import errorcodes
 
 department_bp = Blueprint("department", __name__, url_prefix="/department")
 
-# View a list of all departments
+# View a list of all departments, one page at a time
 @department_bp.route("/list", methods=['GET'])
+@query_budget(2)
 @jwt_required()
+@conditional("department")
 def get_all_departments():
-    stmt = db.select(Department).order_by(Department.department_name.asc())
-    departments = db.session.scalars(stmt)
-    return departments_schema.dump(departments), 200
+    stmt = db.select(Department)
+    departments, next_cursor = paginate(stmt, Department.department_name, Department.id)
+    return fast_dump(departments_schema, departments), 200, page_headers(next_cursor)
 
 # Create a new department (admin only)
 @department_bp.route('/add', methods=['POST'])
@@ -40,7 +45,7 @@ def create_department():
 
     # Error handling
     except IntegrityError as err:
-        if err.orig.pgcode == errorcodes.UNIQUE_VIOLATION:
+        if is_unique_violation(err):
             return {"error": f"{department.department_name} Department is already registered."}, 400
     
 # Delete a department (admin only)
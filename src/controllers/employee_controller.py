@@ -1,28 +1,40 @@
 from datetime import datetime, timedelta
 
 from flask import Blueprint
-from flask_jwt_extended import jwt_required
+from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from init import db
 from models.employee import Employee, employees_schema
 from models.leave_request import LeaveRequest, leave_requests_schema
-from models.status import Status
-from utils import auth_as_admin_decorator
+from models.status import status_registry
+from models.leave_ledger import LeaveBalance, leave_balance_schema
+from utils import auth_as_admin_decorator, get_role
+from balances import projected_balance
+from pagination import paginate, page_headers
+from loading import eager_load_options
+from profiling import query_budget
+from serializers import fast_dump
+from workdays import with_working_days
+from versions import employee_leave_key
+from response_cache import cached_response
 
 employee_bp = Blueprint("employee", __name__, url_prefix="/employee")
 
-# View a list of all employees (admin only)
+# View a list of all employees, one page at a time (admin only)
 @employee_bp.route("/list", methods=['GET'])
+@query_budget(3)
 @jwt_required()
 @auth_as_admin_decorator
 def get_all_employees():
-    stmt = db.select(Employee)
-    employees = db.session.scalars(stmt)
-    return employees_schema.dump(employees), 200
+    stmt = db.select(Employee).options(*eager_load_options(Employee, employees_schema))
+    employees, next_cursor = paginate(stmt, Employee.id)
+    return fast_dump(employees_schema, employees), 200, page_headers(next_cursor)
 
 # View approved leave in the upcoming month for a specific employee
 @employee_bp.route("/<int:employee_id>", methods=["GET"])
+@query_budget(5)
 @jwt_required()
+@cached_response(employee_leave_key)
 def view_approved_leaves_for_employee(employee_id):
     # Get the current date and the date 30 days from today
     start_date = datetime.today()
@@ -34,15 +46,15 @@ def view_approved_leaves_for_employee(employee_id):
         return {"error": f"Employee ID {employee_id} not found."}, 404
     
     # Retrieve the "approved" status ID
-    approved_status = db.session.query(Status).filter(Status.status_name == "approved").first()
-    if not approved_status:
+    approved_status_id = status_registry.get_id("approved")
+    if not approved_status_id:
         return {"error": "Approved status not found."}, 404
     # Query for approved leave requests for the specified employee within the next 30 days
     leaves_stmt = db.select(LeaveRequest).filter(
         LeaveRequest.employee_id == employee.id,
-        LeaveRequest.status_id == approved_status.id,
+        LeaveRequest.status_id == approved_status_id,
         LeaveRequest.start_date.between(start_date, end_date)
-    )
+    ).options(*eager_load_options(LeaveRequest, leave_requests_schema))
     approved_leaves = db.session.execute(leaves_stmt).scalars().all()
     
     # Check conditions at the end
@@ -50,4 +62,26 @@ def view_approved_leaves_for_employee(employee_id):
         return {"message": f"No approved leave requests for employee ID {employee_id} in the next 30 days."}, 404
     else:
         # Return the approved leave requests
-        return leave_requests_schema.dump(approved_leaves), 200
\ No newline at end of file
+        return with_working_days(fast_dump(leave_requests_schema, approved_leaves), approved_leaves), 200
+
+# View the leave balance of an employee (self or admin)
+@employee_bp.route("/<int:employee_id>/balance", methods=["GET"])
+@query_budget(8)
+@jwt_required()
+def view_leave_balance(employee_id):
+    # Employees can only see their own balance unless they are an admin
+    current_employee_id = get_jwt_identity()
+    if int(current_employee_id) != employee_id and not get_role(current_employee_id)[0]:
+        return {"error": "Only an admin can view another employee's balance."}, 403
+
+    # Read the materialized balance with the employee's accrual rule and entitlement in one query
+    stmt = db.select(Employee.accrual_rule, Employee.annual_entitlement, LeaveBalance) \
+        .outerjoin(LeaveBalance, LeaveBalance.employee_id == Employee.id) \
+        .filter(Employee.id == employee_id)
+    row = db.session.execute(stmt).first()
+    if not row:
+        return {"error": f"Employee ID {employee_id} not found."}, 404
+
+    # Show the periods that came due since the last `flask db accrue` as credited, without writing
+    balance = projected_balance(employee_id, row.LeaveBalance, row.accrual_rule, row.annual_entitlement)
+    return leave_balance_schema.dump(balance), 200
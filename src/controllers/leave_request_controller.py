@@ -1,31 +1,63 @@
-from flask import Blueprint, request
+from flask import Blueprint, Response, request, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from init import db
-from models.leave_request import LeaveRequest, leave_request_schema, leave_requests_schema
-from models.status import Status
-from utils import auth_as_admin_decorator
+from models.leave_request import LeaveRequest, LeaveRequestSchema, leave_request_schema, leave_requests_schema, leave_transition_schema, leave_transitions_schema
+from models.employee import Employee
+from models.status import status_registry
+from utils import auth_as_admin_decorator, is_unique_violation
+from pagination import paginate, page_headers
+from profiling import query_budget
+from serializers import compile_schema, select_rows
+from exports import iter_leave_export, leave_export_schema
+from workdays import with_working_days
+from versions import conditional, mark_leave_changed, own_leave_list
+from analytics import update_leave_summary
+from balances import post_leave_debits, reverse_leave_debits
+from availability import find_approval_conflicts, find_capacity_conflicts, find_overlapping_leave, forget_leave, lock_employees, ranges_overlap, record_approved_leave
 
+from marshmallow import ValidationError, fields
 from sqlalchemy.exc import IntegrityError
-from psycopg2 import errorcodes
 
 leave_request_bp = Blueprint("leave_request", __name__, url_prefix="/leave_request")
 
-# View all leave requests for self
+# Largest number of leave requests accepted by one bulk submission
+BULK_MAX_ITEMS = 1000
+
+# View all leave requests for self, one page at a time
 @leave_request_bp.route("", methods=["GET"])
+@query_budget(3)
 @jwt_required()
+@conditional("leave_request", own_leave_list)
 def view_leave_requests():
     employee_id = get_jwt_identity()
 
-    # Query leave requests for the current user
-    leave_requests = LeaveRequest.query.filter_by(employee_id=employee_id).all()
+    # Query a page of leave requests for the current user as flat rows, with the employee and status joined in
+    stmt = select_rows(LeaveRequest, leave_requests_schema).add_columns(LeaveRequest.employee_id).where(LeaveRequest.employee_id == employee_id)
+    leave_requests, next_cursor = paginate(stmt, LeaveRequest.id, rows=True)
     
-    # If leave requests are found, return them
+    # If leave requests are found, return them with their working days
     if leave_requests:
-        return leave_requests_schema.dump(leave_requests), 200
+        dumped = compile_schema(leave_requests_schema).dump_rows(leave_requests)
+        return with_working_days(dumped, leave_requests), 200, page_headers(next_cursor)
     # Else, return message
     return {"message": "No leave requests found."}, 404
 
+# Export leave requests with employee, team, department and status for payroll (admin only)
+@leave_request_bp.route("/export", methods=["GET"])
+@jwt_required()
+@auth_as_admin_decorator
+def export_leave_requests():
+    # Validate the format and filters from the query string
+    params = leave_export_schema.load(request.args)
+    export_format = params.pop("format")
+
+    # Stream rows as they are fetched, so the first bytes go out before the query finishes
+    rows = iter_leave_export(export_format, **params)
+    mimetype = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    headers = {"Content-Disposition": f"attachment; filename=leave_requests.{export_format}"}
+    return Response(stream_with_context(rows), mimetype=mimetype, headers=headers)
+
 # View specific leave request for self
 @leave_request_bp.route("/<int:leave_request_id>", methods=["GET"])
 @jwt_required()
@@ -37,7 +69,7 @@ def view_specific_leave_request(leave_request_id):
 
     # If the leave request is found, return it
     if leave_request:
-        return leave_request_schema.dump(leave_request), 200
+        return with_working_days(leave_request_schema.dump(leave_request), leave_request), 200
     # Else, return error message
     return {"error": "Leave request not found."}, 404
 
@@ -54,29 +86,120 @@ def add_leave_request():
     # Check if both start_date and end_date are provided
     if not start_date or not end_date:
         return {"error": "Start date and end date are required."}, 400
+    # Parse the dates, an invalid date is reported as a validation error
+    start_date = fields.Date().deserialize(start_date)
+    end_date = fields.Date().deserialize(end_date)
     # Check if start_date is before the end_date
     if start_date > end_date:
         return {"error": "Start date must be before end date."}, 400
 
-    # Fetch the "pending" status from the database
-    pending_status = db.session.query(Status).filter(Status.status_name == "pending").first()
+    # Look up the "pending" status id from the status registry
+    pending_status_id = status_registry.get_id("pending")
+
+    # Reject the request if it overlaps leave the employee already has pending or approved
+    employee_id = int(get_jwt_identity())
+    lock_employees([employee_id])
+    active_status_ids = [pending_status_id, status_registry.get_id("approved")]
+    conflicts = find_overlapping_leave(employee_id, start_date, end_date, active_status_ids)
+    if conflicts:
+        db.session.rollback()
+        return {"error": "Leave request overlaps existing leave requests.", "conflicting_ids": [row.id for row in conflicts]}, 400
     
     # Create a new leave request model instance
     leave_request = LeaveRequest(
-        employee_id=get_jwt_identity(),
+        employee_id=employee_id,
         start_date=start_date,
         end_date=end_date,
-        status=pending_status  # Set the status to pending
+        status_id=pending_status_id  # Set the status to pending
     )
 
     try:
         db.session.add(leave_request)
+        # Count the request in the analytics summary in the same transaction
+        update_leave_summary([leave_request], None, pending_status_id)
         db.session.commit()
-        return leave_request_schema.dump(leave_request), 201
+        return with_working_days(leave_request_schema.dump(leave_request), leave_request), 201
     # Error handling
     except IntegrityError as err:
-        if err.orig.pgcode == errorcodes.UNIQUE_VIOLATION:
+        db.session.rollback()
+        if is_unique_violation(err):
             return {"error": "Leave request with the same dates already exists."}, 400
+        raise
+
+# Submit many leave requests at once, inserted in one statement and one transaction
+@leave_request_bp.route("/bulk", methods=["POST"])
+@jwt_required()
+def add_leave_requests_bulk():
+    employee_id = int(get_jwt_identity())
+    body_data = request.get_json()
+
+    # Check the body is a non-empty list within the size limit
+    if not isinstance(body_data, list) or not body_data:
+        return {"error": "A list of leave requests is required."}, 400
+    if len(body_data) > BULK_MAX_ITEMS:
+        return {"error": f"No more than {BULK_MAX_ITEMS} leave requests can be submitted at once."}, 400
+
+    # Validate every item, collecting errors instead of stopping at the first one
+    schema = LeaveRequestSchema(only=["start_date", "end_date"])
+    errors = []
+    valid_items = {}
+    seen_dates = set()
+    for index, item in enumerate(body_data):
+        try:
+            data = schema.load(item)
+        except ValidationError as err:
+            errors.append({"index": index, "error": err.messages})
+            continue
+        dates = (data["start_date"], data["end_date"])
+        # Duplicates within the batch would break the uix_employee_dates constraint
+        if dates in seen_dates:
+            errors.append({"index": index, "error": "Leave request with the same dates is already in this batch."})
+            continue
+        seen_dates.add(dates)
+        valid_items[index] = dates
+
+    # Fetch the employee's pending or approved leave across the whole batch span in one range query,
+    # then reject items overlapping it or an earlier item of the batch
+    pending_status_id = status_registry.get_id("pending")
+    if valid_items:
+        lock_employees([employee_id])
+        batch_start = min(start for start, _ in valid_items.values())
+        batch_end = max(end for _, end in valid_items.values())
+        active_status_ids = [pending_status_id, status_registry.get_id("approved")]
+        existing = find_overlapping_leave(employee_id, batch_start, batch_end, active_status_ids)
+        accepted = []
+        for index, (start, end) in list(valid_items.items()):
+            conflicting_ids = [row.id for row in existing if ranges_overlap(start, end, row.start_date, row.end_date)]
+            if conflicting_ids:
+                errors.append({"index": index, "error": "Leave request overlaps existing leave requests.", "conflicting_ids": conflicting_ids})
+                del valid_items[index]
+            elif any(ranges_overlap(start, end, other_start, other_end) for other_start, other_end in accepted):
+                errors.append({"index": index, "error": "Leave request overlaps another leave request in this batch."})
+                del valid_items[index]
+            else:
+                accepted.append((start, end))
+
+    # Insert the valid requests as pending in a single multi-row statement
+    created = []
+    if valid_items:
+        rows = [
+            {"employee_id": employee_id, "start_date": start, "end_date": end, "status_id": pending_status_id}
+            for start, end in valid_items.values()
+        ]
+        try:
+            created = db.session.scalars(db.insert(LeaveRequest).returning(LeaveRequest), rows).all()
+            update_leave_summary(created, None, pending_status_id)
+            db.session.commit()
+        # Another request inserted the same dates since the check above
+        except IntegrityError as err:
+            db.session.rollback()
+            if is_unique_violation(err):
+                return {"error": "Leave requests with the same dates were submitted at the same time, please try again."}, 400
+            raise
+
+    errors.sort(key=lambda error: error["index"])
+    result = {"created": with_working_days(leave_request_schema.dump(created, many=True), created), "errors": errors}
+    return result, 201 if created else 400
 
 # Delete leave request
 @leave_request_bp.route("/delete/<int:leave_request_id>", methods=["DELETE"])
@@ -88,8 +211,14 @@ def delete_leave_request(leave_request_id):
     
     # If leave request exists, delete the leave request
     if leave_request:
+        # Give back the days if the leave was approved, in the same transaction as the delete
+        reverse_leave_debits([leave_request_id])
+        update_leave_summary([leave_request], leave_request.status_id, None)
+        team_id = db.session.scalar(db.select(Employee.team_id).filter_by(id=leave_request.employee_id))
         db.session.delete(leave_request)
         db.session.commit()
+        # Take the leave off the cached team calendar
+        forget_leave(leave_request_id, team_id)
         return {"message": f"Leave request ID {leave_request_id} deleted successfully."}, 200
     # Else, return error message
     else:
@@ -106,12 +235,114 @@ def approve_leave_request(leave_request_id):
     
     # If leave request exists
     if leave_request:
-        # Fetch the "approved" status from the database
-        approved_status = db.session.query(Status).filter(Status.status_name == "approved").first()
-        # Update the status of the leave request
-        leave_request.status = approved_status
+        # Check the employee has no other approved leave on any of the same days
+        lock_employees([leave_request.employee_id])
+        # Only pending requests can be approved. The status is read again under the lock,
+        # so a concurrent approval of the same request cannot post the debits twice.
+        db.session.refresh(leave_request)
+        if leave_request.status_id != status_registry.get_id("pending"):
+            db.session.rollback()
+            return {"error": f"Leave request ID {leave_request_id} is already {status_registry.get_name(leave_request.status_id)}."}, 400
+        conflicts = find_overlapping_leave(
+            leave_request.employee_id, leave_request.start_date, leave_request.end_date,
+            [status_registry.get_id("approved")], exclude_id=leave_request.id
+        )
+        if conflicts:
+            db.session.rollback()
+            return {"error": "Leave request overlaps approved leave.", "conflicting_ids": [row.id for row in conflicts]}, 400
+        # Check the team stays within its maximum concurrent absence
+        over_capacity = find_capacity_conflicts([leave_request], status_registry.get_id("approved"))
+        if over_capacity:
+            db.session.rollback()
+            return {"error": over_capacity[leave_request.id]}, 400
+        # Update the status of the leave request to "approved"
+        update_leave_summary([leave_request], leave_request.status_id, status_registry.get_id("approved"))
+        leave_request.status_id = status_registry.get_id("approved")
+        # Debit the employee's leave balance in the same transaction
+        post_leave_debits([leave_request])
         db.session.commit()
-        return leave_request_schema.dump(leave_request), 200
+        # Add the leave to the cached team calendar
+        record_approved_leave([leave_request])
+        return with_working_days(leave_request_schema.dump(leave_request), leave_request), 200
     # Else, return error message
     else:
         return {"error": f"Leave request ID {leave_request_id} not found."}, 404
+
+# Approve or reject many pending leave requests at once (admin only)
+@leave_request_bp.route("/transition", methods=["POST"])
+@jwt_required()
+@auth_as_admin_decorator
+def transition_leave_requests():
+    # Validate the ids, target status and filters from the body of the request
+    body_data = leave_transition_schema.load(request.get_json())
+    ids = list(dict.fromkeys(body_data["ids"]))
+    status_name = body_data["status"]
+    pending_status_id = status_registry.get_id("pending")
+
+    # Pending requests among the ids that match the filters
+    filters = [LeaveRequest.id.in_(ids), LeaveRequest.status_id == pending_status_id]
+    if body_data.get("team_id"):
+        team_members = db.select(Employee.id).filter(Employee.team_id == body_data["team_id"])
+        filters.append(LeaveRequest.employee_id.in_(team_members))
+    if body_data.get("from_date"):
+        filters.append(LeaveRequest.end_date >= body_data["from_date"])
+    if body_data.get("to_date"):
+        filters.append(LeaveRequest.start_date <= body_data["to_date"])
+
+    # Hold back approvals that would overlap the employee's approved leave or exceed the team's capacity
+    blocked = {}
+    if status_name == "approved":
+        approved_status_id = status_registry.get_id("approved")
+        stmt = db.select(LeaveRequest.id, LeaveRequest.employee_id, LeaveRequest.start_date, LeaveRequest.end_date).filter(*filters)
+        candidates = db.session.execute(stmt).all()
+        for leave_request_id, conflicting_ids in find_approval_conflicts(candidates, approved_status_id).items():
+            blocked[leave_request_id] = {"error": "Leave request overlaps approved leave.", "conflicting_ids": conflicting_ids}
+        remaining = [row for row in candidates if row.id not in blocked]
+        for leave_request_id, error in find_capacity_conflicts(remaining, approved_status_id).items():
+            blocked[leave_request_id] = {"error": error}
+        if blocked:
+            filters.append(LeaveRequest.id.not_in(blocked))
+
+    # Move every remaining request in one set-based UPDATE, returning the changed rows
+    stmt = db.update(LeaveRequest).where(*filters)
+    stmt = stmt.values(status_id=status_registry.get_id(status_name)).returning(
+        LeaveRequest.id, LeaveRequest.employee_id, LeaveRequest.start_date, LeaveRequest.end_date
+    )
+    updated = db.session.execute(stmt).all()
+    mark_leave_changed((row.employee_id for row in updated), approved=status_name == "approved")
+    # Update the analytics summary and the leave balances in the same transaction
+    update_leave_summary(updated, pending_status_id, status_registry.get_id(status_name))
+    if status_name == "approved":
+        post_leave_debits(updated)
+    else:
+        reverse_leave_debits([row.id for row in updated])
+    db.session.commit()
+    if status_name == "approved":
+        record_approved_leave(updated)
+
+    # Explain, per id, why the remaining requests were left unchanged
+    errors = []
+    unchanged_ids = set(ids) - {row.id for row in updated}
+    if unchanged_ids:
+        stmt = db.select(LeaveRequest.id, LeaveRequest.status_id).filter(LeaveRequest.id.in_(unchanged_ids))
+        current_statuses = dict(db.session.execute(stmt).all())
+        for leave_request_id in ids:
+            if leave_request_id not in unchanged_ids:
+                continue
+            if leave_request_id in blocked:
+                errors.append({"id": leave_request_id, **blocked[leave_request_id]})
+                continue
+            if leave_request_id not in current_statuses:
+                error = f"Leave request ID {leave_request_id} not found."
+            elif current_statuses[leave_request_id] != pending_status_id:
+                error = f"Leave request ID {leave_request_id} is already {status_registry.get_name(current_statuses[leave_request_id])}."
+            else:
+                error = f"Leave request ID {leave_request_id} does not match the filters."
+            errors.append({"id": leave_request_id, "error": error})
+
+    result = {
+        "status": status_name,
+        "updated": with_working_days(leave_transitions_schema.dump([row._mapping for row in updated]), updated),
+        "errors": errors
+    }
+    return result, 200 if updated else 400
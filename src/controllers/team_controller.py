@@ -8,22 +8,36 @@ from models.employee import Employee
 from models.leave_request import LeaveRequest, leave_requests_schema
 from models.department import Department
 from models.team import Team, teams_schema, team_schema
-from models.status import Status
-from utils import auth_as_admin_decorator
+from models.status import status_registry
+from utils import auth_as_admin_decorator, is_unique_violation
+from pagination import paginate, page_headers
+from loading import eager_load_options
+from profiling import query_budget
+from serializers import fast_dump
+from workdays import with_working_days
+from versions import conditional, team_leave_key
+from response_cache import cached_response
+from availability import cached_team_calendar, load_team_calendar, team_calendar_schema
+
+from sqlalchemy.exc import IntegrityError
 
 team_bp = Blueprint("team", __name__, url_prefix="/team")
 
-# View a list of all teams
+# View a list of all teams, one page at a time
 @team_bp.route("/list", methods=["GET"])
+@query_budget(2)
 @jwt_required()
+@conditional("team")
 def get_all_teams():
-    stmt = db.select(Team).order_by(Team.team_name.asc())
-    teams = db.session.scalars(stmt)
-    return teams_schema.dump(teams), 200
+    stmt = db.select(Team).options(*eager_load_options(Team, teams_schema))
+    teams, next_cursor = paginate(stmt, Team.team_name, Team.id)
+    return fast_dump(teams_schema, teams), 200, page_headers(next_cursor)
 
 # View approved leave in upcoming month for a specific team
 @team_bp.route("/list/<int:team_id>", methods=["GET"])
+@query_budget(5)
 @jwt_required()
+@cached_response(team_leave_key)
 def view_approved_leaves_in_team(team_id):
     # Get the current date and the date 30 days from today
     start_date = datetime.today()
@@ -35,13 +49,13 @@ def view_approved_leaves_in_team(team_id):
         return {"error": f"Team with ID {team_id} not found."}, 404
 
     # Retrieve the "approved" status ID
-    approved_status = db.session.query(Status).filter(Status.status_name == "approved").first()
+    approved_status_id = status_registry.get_id("approved")
     # Query for approved leave requests for employees in the specified team within the next 30 days
     leaves_stmt = db.select(LeaveRequest).join(Employee).filter(
         Employee.team_id == team_id,
-        LeaveRequest.status_id == approved_status.id,
+        LeaveRequest.status_id == approved_status_id,
         LeaveRequest.start_date.between(start_date, end_date)
-    )
+    ).options(*eager_load_options(LeaveRequest, leave_requests_schema))
     approved_leaves = db.session.execute(leaves_stmt).scalars().all()
 
     # Check conditions at the end
@@ -51,7 +65,29 @@ def view_approved_leaves_in_team(team_id):
         return {"message": f"No approved leave requests found for team ID {team_id} in the upcoming month."}, 404
     else:
         # Return the approved leaves
-        return leave_requests_schema.dump(approved_leaves), 200
+        return with_working_days(fast_dump(leave_requests_schema, approved_leaves), approved_leaves), 200
+
+# View how many team members are on approved leave on each day of a date range
+@team_bp.route("/<int:team_id>/calendar", methods=["GET"])
+@query_budget(4)
+@jwt_required()
+def view_team_calendar(team_id):
+    # Validate the date range, which defaults to the next 30 days
+    params = team_calendar_schema.load(request.args)
+
+    # Check if the team exists, unless a current calendar of it is cached
+    calendar = cached_team_calendar(team_id, params["from_date"])
+    if calendar is None and not db.session.get(Team, team_id):
+        return {"error": f"Team with ID {team_id} not found."}, 404
+
+    # Build the per-day absences from the team's approved leave
+    calendar = calendar or load_team_calendar(team_id, params["from_date"])
+    return {
+        "team_id": team_id,
+        "from": params["from_date"].isoformat(),
+        "to": params["to_date"].isoformat(),
+        "days": calendar.days(params["from_date"], params["to_date"])
+    }, 200
 
 # Create a new team (admin only)
 @team_bp.route('/add', methods=['POST'])
@@ -73,15 +109,59 @@ def create_team():
     # Create a new team model instance
     team = Team(
         team_name=team_data.get("team_name"),
-        department_id=department_id
+        department_id=department_id,
+        max_concurrent_absence=team_data.get("max_concurrent_absence")
     )
 
     # Add and commit to the database
     db.session.add(team)
-    db.session.commit()
+    try:
+        db.session.commit()
+    # Team names are unique
+    except IntegrityError as err:
+        db.session.rollback()
+        if is_unique_violation(err):
+            return {"error": f"Team name {team.team_name} is already registered."}, 400
+        raise
     # Return acknowledgement
     return team_schema.dump(team), 201
 
+# Update a team's name or capacity (admin only)
+@team_bp.route("/update/<int:team_id>", methods=["PUT", "PATCH"])
+@jwt_required()
+@auth_as_admin_decorator
+def update_team(team_id):
+    # Fetch and lock the team, so a capacity change waits for the approvals checking the old one
+    team = db.session.get(Team, team_id, with_for_update=True)
+    if not team:
+        return {"error": f"Team ID {team_id} not found."}, 404
+
+    body_data = request.get_json()
+    # Define allowed fields
+    allowed_fields = {"team_name", "max_concurrent_absence"}
+    # Check if there are any disallowed fields in the request
+    if not all(field in allowed_fields for field in body_data.keys()):
+        return {"error": "You can only update the team name or maximum concurrent absence."}, 400
+
+    # Load data with schema after validating the fields
+    team_data = team_schema.load(body_data, partial=True)
+    team.team_name = team_data.get("team_name") or team.team_name
+    # A null capacity removes the limit
+    if "max_concurrent_absence" in team_data:
+        team.max_concurrent_absence = team_data["max_concurrent_absence"]
+
+    # Commit to the database
+    try:
+        db.session.commit()
+    # Team names are unique
+    except IntegrityError as err:
+        db.session.rollback()
+        if is_unique_violation(err):
+            return {"error": f"Team name {team_data['team_name']} is already registered."}, 400
+        raise
+    # Return acknowledgement
+    return team_schema.dump(team), 200
+
 # Delete a team (admin only)
 @team_bp.route("/delete/<int:team_id>", methods=["DELETE"])
 @jwt_required()
@@ -0,0 +1,100 @@
+import csv
+import io
+import json
+
+from marshmallow import fields, validates_schema, ValidationError
+from marshmallow.validate import OneOf
+
+from init import db, ma
+from models.department import Department
+from models.employee import Employee
+from models.leave_request import LeaveRequest
+from models.status import Status
+from models.team import Team
+from workdays import calendars
+
+# Columns of an exported leave request, in output order
+EXPORT_COLUMNS = ("id", "employee_id", "first_name", "last_name", "team_name", "department_name", "start_date", "end_date", "working_days", "status")
+
+# Rows fetched from the database per round-trip while streaming
+EXPORT_BATCH_SIZE = 1000
+
+class LeaveExportSchema(ma.Schema):
+    # Output format and optional filters of an export
+    format = fields.String(load_default="ndjson", validate=OneOf(["ndjson", "csv"]))
+    from_date = fields.Date(data_key="from")
+    to_date = fields.Date(data_key="to")
+    status = fields.String(validate=OneOf(["pending", "approved", "rejected"]))
+
+    # Date range validation
+    @validates_schema
+    def validate_dates(self, data, **kwargs):
+        if data.get("from_date") and data.get("to_date") and data["from_date"] > data["to_date"]:
+            raise ValidationError("From date must be before or the same as the to date.")
+
+leave_export_schema = LeaveExportSchema()
+
+# Selects leave requests with their employee, team, department and status, oldest first.
+# Requests overlapping the date range are included, and rows are streamed in batches from a server-side cursor.
+def leave_export_stmt(from_date=None, to_date=None, status=None):
+    stmt = db.select(
+        LeaveRequest.id,
+        LeaveRequest.employee_id,
+        Employee.first_name,
+        Employee.last_name,
+        Team.team_name,
+        Department.department_name,
+        LeaveRequest.start_date,
+        LeaveRequest.end_date,
+        Status.status_name.label("status"),
+        Team.department_id
+    ).join(Employee, LeaveRequest.employee_id == Employee.id) \
+     .join(Team, Employee.team_id == Team.id) \
+     .join(Department, Team.department_id == Department.id) \
+     .join(Status, LeaveRequest.status_id == Status.id) \
+     .order_by(LeaveRequest.id)
+
+    if from_date:
+        stmt = stmt.where(LeaveRequest.end_date >= from_date)
+    if to_date:
+        stmt = stmt.where(LeaveRequest.start_date <= to_date)
+    if status:
+        stmt = stmt.where(Status.status_name == status)
+    return stmt.execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+# Yields export rows in EXPORT_COLUMNS order, scoring the working days of each fetched batch in one vectorized call
+def _with_working_days(result):
+    for batch in result.partitions():
+        working_days = calendars.count(
+            [row.department_id for row in batch],
+            [row.start_date for row in batch],
+            [row.end_date for row in batch]
+        ).tolist()
+        for row, days in zip(batch, working_days):
+            yield (*row[:EXPORT_COLUMNS.index("working_days")], days, row.status)
+
+def _row_values(row):
+    return [value.isoformat() if hasattr(value, "isoformat") else value for value in row]
+
+# Yields one JSON document per line, as rows arrive from the database
+def iter_ndjson(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_COLUMNS, _row_values(row))), separators=(",", ":")) + "\n"
+
+# Yields CSV text in chunks of EXPORT_BATCH_SIZE rows, starting with the header
+def iter_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(_row_values(row))
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+# Streams the export in the requested format without holding all rows in memory
+def iter_leave_export(format="ndjson", from_date=None, to_date=None, status=None):
+    rows = _with_working_days(db.session.execute(leave_export_stmt(from_date, to_date, status)))
+    return iter_csv(rows) if format == "csv" else iter_ndjson(rows)
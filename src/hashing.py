@@ -0,0 +1,144 @@
+import functools
+import itertools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import bcrypt
+
+from metrics import hashing_pending, hashing_rejected
+from profiling import timed
+
+# Runs in the worker, so it must stay a top-level function that can be pickled
+def _hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+def _hash_passwords(passwords, rounds):
+    return [_hash_password(password, rounds) for password in passwords]
+
+def _check_password(pw_hash, password):
+    return bcrypt.checkpw(password.encode("utf-8"), pw_hash.encode("utf-8"))
+
+# Raised when every hashing slot is taken, handled as 503 with a Retry-After header
+class HashingPoolSaturated(Exception):
+    def __init__(self, retry_after):
+        super().__init__("Password hashing pool is saturated.")
+        self.retry_after = retry_after
+
+# Runs bcrypt work on a dedicated pool of HASHING_WORKERS. The request thread still waits for its
+# hash, so the pool adds no concurrency: it caps how many hashes burn CPU at once, keeps them off the
+# web process's GIL in process mode, and turns requests away with 503 once the queue is full.
+class PasswordHasher:
+    def __init__(self):
+        self.mode = "process"
+        self.rounds = 12
+        self.workers = 1
+        self.queue_size = 0
+        self.retry_after = 1
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        # "process" (default), "thread" or "inline" to hash on the request thread
+        app.config.setdefault("HASHING_EXECUTOR", "process")
+        app.config.setdefault("HASHING_WORKERS", os.cpu_count() or 1)
+        # Hashes allowed to wait for a free worker before new ones are turned away
+        app.config.setdefault("HASHING_QUEUE_SIZE", 32)
+        app.config.setdefault("HASHING_RETRY_AFTER", 1)
+        app.config.setdefault("BCRYPT_LOG_ROUNDS", 12)
+
+        self.mode = app.config["HASHING_EXECUTOR"]
+        self.rounds = int(app.config["BCRYPT_LOG_ROUNDS"])
+        self.workers = int(app.config["HASHING_WORKERS"])
+        self.queue_size = int(app.config["HASHING_QUEUE_SIZE"])
+        self.retry_after = int(app.config["HASHING_RETRY_AFTER"])
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        app.extensions["password_hasher"] = self
+
+    # Creates the pool on first use, so importing the app never starts worker processes
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self.mode == "thread":
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="hashing")
+                else:
+                    # Spawned workers do not inherit the parent's threads or database connections
+                    context = multiprocessing.get_context("spawn")
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._executor
+
+    def _run(self, fn, *args):
+        with timed("hash"):
+            return self._submit(fn, *args)
+
+    def _submit(self, fn, *args):
+        if self.mode == "inline":
+            return fn(*args)
+        # Fail fast instead of queueing without bound when the pool is busy
+        if not self._slots.acquire(blocking=False):
+            hashing_rejected.inc()
+            raise HashingPoolSaturated(self.retry_after)
+        # Counted before the submit, so the done callback never decrements it first
+        hashing_pending.inc()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        # Blocks the request thread until a worker has hashed it
+        return future.result()
+
+    def _release(self, future=None, count=1):
+        hashing_pending.dec(count)
+        self._slots.release()
+
+    def generate_password_hash(self, password):
+        return self._run(_hash_password, password, self.rounds)
+
+    # Hashes many passwords at once for bulk imports, spread over all workers. Each chunk takes a
+    # slot like a single hash does, but waits for it instead of being turned away, and at most one
+    # chunk per worker is in flight, so the queue slots stay free for logins and registrations.
+    def generate_password_hashes(self, passwords):
+        with timed("hash"):
+            if self.mode == "inline":
+                return _hash_passwords(passwords, self.rounds)
+            # Bigger chunks mean fewer round-trips to the worker processes
+            chunksize = max(1, len(passwords) // (self.workers * 4))
+            chunks = [passwords[start:start + chunksize] for start in range(0, len(passwords), chunksize)]
+            in_flight = threading.BoundedSemaphore(self.workers)
+            futures = []
+            hashing_pending.inc(len(passwords))
+            try:
+                for chunk in chunks:
+                    in_flight.acquire()
+                    self._slots.acquire()
+                    try:
+                        future = self._get_executor().submit(_hash_passwords, chunk, self.rounds)
+                    except Exception:
+                        in_flight.release()
+                        self._slots.release()
+                        raise
+                    future.add_done_callback(functools.partial(self._release_chunk, in_flight, len(chunk)))
+                    futures.append(future)
+            except Exception:
+                # The chunks never submitted are no longer pending
+                hashing_pending.dec(sum(len(chunk) for chunk in chunks[len(futures):]))
+                raise
+            return list(itertools.chain.from_iterable(future.result() for future in futures))
+
+    def _release_chunk(self, in_flight, count, future):
+        in_flight.release()
+        self._release(count=count)
+
+    def check_password_hash(self, pw_hash, password):
+        return self._run(_check_password, pw_hash, password)
+
+    # True if the hash was made with a lower cost factor than the one configured
+    def needs_rehash(self, pw_hash):
+        try:
+            return int(pw_hash.split("$")[2]) < self.rounds
+        except (IndexError, ValueError):
+            return True
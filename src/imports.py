@@ -0,0 +1,117 @@
+from marshmallow import fields, validates_schema, ValidationError
+from marshmallow.validate import Length, Regexp
+
+from init import db, hasher
+from models.employee import Employee, EmployeeSchema
+from models.team import Team
+
+# Rows inserted per statement when importing employees
+IMPORT_BATCH_SIZE = 1000
+
+# A bcrypt hash as produced by the password hasher, accepted in place of a plain password
+BCRYPT_HASH = r"^\$2[aby]\$\d{2}\$[./A-Za-z0-9]{53}$"
+
+class EmployeeImportSchema(EmployeeSchema):
+    # Name fields are checked here, as rows are inserted without going through the model
+    first_name = fields.String(required=True, validate=Length(min=1, max=50, error="First name must be between 1 and 50 characters long."))
+    last_name = fields.String(required=True, validate=Length(min=1, max=50, error="Last name must be between 1 and 50 characters long."))
+    is_admin = fields.Boolean()
+    # Either a plain password, or the bcrypt hash of one when moving employees from another system
+    password = fields.String(load_only=True, validate=Length(min=6, error="Password must be at least 6 characters long."))
+    password_hash = fields.String(load_only=True, validate=Regexp(BCRYPT_HASH, error="Invalid bcrypt password hash."))
+    # The team is given by name or by id
+    team_name = fields.String()
+    team_id = fields.Integer()
+
+    @validates_schema
+    def validate_required(self, data, **kwargs):
+        if not data.get("password") and not data.get("password_hash"):
+            raise ValidationError("A password or a password hash is required.")
+        if not data.get("team_name") and not data.get("team_id"):
+            raise ValidationError("A team name or a team ID is required.")
+
+    class Meta:
+        # Fields accepted for each imported employee
+        fields = ("first_name", "last_name", "email", "password", "password_hash", "team_id", "team_name", "is_admin", "annual_entitlement", "accrual_rule")
+
+employee_import_schema = EmployeeImportSchema()
+
+# Validates, hashes and inserts many employees at once, in the current transaction.
+# `records` are dicts such as CSV rows, where empty cells count as missing.
+# Returns the created employees as {"index", "id", "email"} and the rejected rows as {"index", "error"}.
+def import_employees(records):
+    errors = []
+    valid = {}
+    seen_emails = set()
+    for index, record in enumerate(records):
+        try:
+            data = employee_import_schema.load({key: value for key, value in record.items() if value not in ("", None)})
+        except ValidationError as err:
+            errors.append({"index": index, "error": err.messages})
+            continue
+        # Duplicates within the import would break the unique email constraint
+        if data["email"] in seen_emails:
+            errors.append({"index": index, "error": "Email address is already in this import."})
+            continue
+        seen_emails.add(data["email"])
+        valid[index] = data
+
+    # Resolve team names and check team IDs in one query
+    team_names = {data["team_name"] for data in valid.values() if data.get("team_name")}
+    team_ids = {data["team_id"] for data in valid.values() if data.get("team_id")}
+    teams_by_name, known_team_ids = {}, set()
+    if valid:
+        stmt = db.select(Team.id, Team.team_name).filter(db.or_(Team.team_name.in_(team_names), Team.id.in_(team_ids)))
+        for row in db.session.execute(stmt):
+            teams_by_name[row.team_name] = row.id
+            known_team_ids.add(row.id)
+
+    # Find the emails already registered in one query
+    registered = set()
+    if valid:
+        stmt = db.select(Employee.email).filter(Employee.email.in_(seen_emails))
+        registered = set(db.session.scalars(stmt))
+
+    for index, data in list(valid.items()):
+        if data.get("team_name"):
+            data["team_id"] = teams_by_name.get(data["team_name"])
+            error = None if data["team_id"] else f"Team {data['team_name']} not found."
+        else:
+            error = None if data["team_id"] in known_team_ids else f"Team ID {data['team_id']} not found."
+        if data["email"] in registered:
+            error = "Email address is already registered."
+        if error:
+            errors.append({"index": index, "error": error})
+            del valid[index]
+
+    # Hash the plain passwords across the hashing pool
+    to_hash = [index for index, data in valid.items() if not data.get("password_hash")]
+    hashes = hasher.generate_password_hashes([valid[index]["password"] for index in to_hash])
+    for index, password_hash in zip(to_hash, hashes):
+        valid[index]["password_hash"] = password_hash
+
+    # Insert in multi-row statements, returning the new ids
+    indexes = list(valid)
+    rows = [
+        {
+            "first_name": data["first_name"],
+            "last_name": data["last_name"],
+            "email": data["email"],
+            "password": data["password_hash"],
+            "team_id": data["team_id"],
+            # Every row needs the same keys, so missing values take the column defaults
+            **{name: data.get(name, Employee.__table__.c[name].default.arg) for name in ("is_admin", "annual_entitlement", "accrual_rule")}
+        }
+        for data in valid.values()
+    ]
+    created = []
+    for start in range(0, len(rows), IMPORT_BATCH_SIZE):
+        stmt = db.insert(Employee).returning(Employee.id, Employee.email, sort_by_parameter_order=True)
+        inserted = db.session.execute(stmt, rows[start:start + IMPORT_BATCH_SIZE]).all()
+        created.extend(
+            {"index": index, "id": row.id, "email": row.email}
+            for index, row in zip(indexes[start:start + IMPORT_BATCH_SIZE], inserted)
+        )
+
+    errors.sort(key=lambda error: error["index"])
+    return created, errors
@@ -3,7 +3,16 @@ from flask_marshmallow import Marshmallow
 from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager
 
-db = SQLAlchemy()
+from hashing import PasswordHasher
+from metrics import Metrics
+from profiling import Instrumentation
+from routing import RoutingSession
+
+# Sessions send the reads of GET requests to the replica, when one is configured
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 ma = Marshmallow()
 bcrypt = Bcrypt()
-jwt = JWTManager()
\ No newline at end of file
+jwt = JWTManager()
+hasher = PasswordHasher()
+instrumentation = Instrumentation()
+metrics = Metrics()
\ No newline at end of file
@@ -0,0 +1,34 @@
+from marshmallow import fields
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload, selectinload
+
+# Returns the schema a field nests, looking inside List(Nested(...)) as well
+def _nested_schema(field):
+    if isinstance(field, fields.List):
+        field = field.inner
+    if isinstance(field, fields.Nested):
+        return field.schema
+    return None
+
+def _loader_options(model, schema, parent):
+    options = []
+    relationships = inspect(model).relationships
+    for name, field in schema.dump_fields.items():
+        nested = _nested_schema(field)
+        if nested is None or name not in relationships:
+            continue
+        relationship = relationships[name]
+        attribute = getattr(model, name)
+        # Collections are loaded with one extra IN query, single objects are joined into the main query
+        if relationship.uselist:
+            option = selectinload(attribute) if parent is None else parent.selectinload(attribute)
+        else:
+            option = joinedload(attribute) if parent is None else parent.joinedload(attribute)
+        options.append(option)
+        options.extend(_loader_options(relationship.mapper.class_, nested, option))
+    return options
+
+# Builds loader options for every relationship the schema dumps (after only/exclude),
+# so a list endpoint costs a fixed number of queries instead of one per row and relationship
+def eager_load_options(model, schema):
+    return _loader_options(model, schema, None)
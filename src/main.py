@@ -2,26 +2,72 @@ import os
 from flask import Flask
 from marshmallow.exceptions import ValidationError
 
-from init import db, ma, bcrypt, jwt
+from init import db, ma, bcrypt, jwt, hasher, instrumentation, metrics
+from hashing import HashingPoolSaturated
+from serializers import OrjsonProvider, orjson
+from versions import collection_versions
+from response_cache import response_cache
+from routing import REPLICA_BIND
 from controllers.cli_controllers import db_commands
 from controllers.auth_controller import auth_bp
 from controllers.leave_request_controller import leave_request_bp
 from controllers.employee_controller import employee_bp
 from controllers.department_controller import department_bp
 from controllers.team_controller import team_bp
+from controllers.analytics_controller import analytics_bp
 
 
 def create_app():
     app = Flask(__name__)
+    # Faster JSON encoding when orjson is installed, with the same output
+    if orjson is not None:
+        app.json = OrjsonProvider(app)
     app.json.sort_keys = False
     app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
+    # Connection pool settings of the primary and the replica, the SQLAlchemy defaults when unset
+    engine_options = {"pool_pre_ping": os.environ.get("DATABASE_POOL_PRE_PING", "false").lower() in ("1", "true", "yes")}
+    for option, variable in (("pool_size", "DATABASE_POOL_SIZE"), ("max_overflow", "DATABASE_MAX_OVERFLOW"), ("pool_timeout", "DATABASE_POOL_TIMEOUT"), ("pool_recycle", "DATABASE_POOL_RECYCLE")):
+        if os.environ.get(variable):
+            engine_options[option] = int(os.environ.get(variable))
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options
+    # Optional read replica, serving the reads of GET requests
+    if os.environ.get("DATABASE_REPLICA_URL"):
+        app.config["SQLALCHEMY_BINDS"] = {REPLICA_BIND: {"url": os.environ.get("DATABASE_REPLICA_URL"), **engine_options}}
     app.config["JWT_SECRET_KEY"] = os.environ.get("JWT_SECRET_KEY")
+    # Page sizes for list endpoints
+    app.config["PAGINATION_DEFAULT_LIMIT"] = int(os.environ.get("PAGINATION_DEFAULT_LIMIT", 50))
+    app.config["PAGINATION_MAX_LIMIT"] = int(os.environ.get("PAGINATION_MAX_LIMIT", 200))
+    # Password hashing settings
+    app.config["BCRYPT_LOG_ROUNDS"] = int(os.environ.get("BCRYPT_LOG_ROUNDS", 12))
+    app.config["HASHING_EXECUTOR"] = os.environ.get("HASHING_EXECUTOR", "process")
+    app.config["HASHING_WORKERS"] = int(os.environ.get("HASHING_WORKERS") or os.cpu_count() or 1)
+    app.config["HASHING_QUEUE_SIZE"] = int(os.environ.get("HASHING_QUEUE_SIZE", 32))
+    # Plain passwords a bulk registration may carry, as each takes a bcrypt hash
+    app.config["BULK_REGISTER_MAX_PASSWORDS"] = int(os.environ.get("BULK_REGISTER_MAX_PASSWORDS", 100))
+    # Directory of the per-department working day calendar files
+    app.config["WORKDAY_CALENDAR_DIR"] = os.environ.get("WORKDAY_CALENDAR_DIR") or os.path.join(app.root_path, "calendars")
+    # Per-request SQL and timing instrumentation
+    app.config["INSTRUMENTATION_ENABLED"] = os.environ.get("INSTRUMENTATION_ENABLED", "false").lower() in ("1", "true", "yes")
+    app.config["INSTRUMENTATION_SAMPLE_RATE"] = float(os.environ.get("INSTRUMENTATION_SAMPLE_RATE", 1.0))
+    app.config["INSTRUMENTATION_SLOW_MS"] = float(os.environ.get("INSTRUMENTATION_SLOW_MS", 500))
+    # Prometheus metrics at /metrics
+    app.config["METRICS_ENABLED"] = os.environ.get("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+    # Where the version counters behind ETags are kept: "database", or "memory" for a single process
+    app.config["VERSION_STORE"] = os.environ.get("VERSION_STORE", "database")
+    # Size and lifetime in seconds of the cached upcoming leave responses
+    app.config["RESPONSE_CACHE_MAXSIZE"] = int(os.environ.get("RESPONSE_CACHE_MAXSIZE", 1024))
+    app.config["RESPONSE_CACHE_TTL"] = int(os.environ.get("RESPONSE_CACHE_TTL", 60))
 
     # Initialises extensions
     db.init_app(app)
     ma.init_app(app)
     bcrypt.init_app(app)
     jwt.init_app(app)
+    hasher.init_app(app)
+    instrumentation.init_app(app)
+    metrics.init_app(app, db, hasher)
+    collection_versions.init_app(app)
+    response_cache.init_app(app)
 
     # Error handling
     @app.errorhandler(ValidationError)
@@ -32,6 +78,10 @@ def create_app():
     def bad_request(err):
         return {"error": err.messages}, 400
     
+    @app.errorhandler(HashingPoolSaturated)
+    def hashing_pool_saturated(err):
+        return {"error": "The server is busy, please try again shortly."}, 503, {"Retry-After": str(err.retry_after)}
+
     @app.errorhandler(401)
     def unauthorised():
         return {"error": "Unauthorised user."}, 401
@@ -43,5 +93,6 @@ def create_app():
     app.register_blueprint(employee_bp)
     app.register_blueprint(department_bp)
     app.register_blueprint(team_bp)
+    app.register_blueprint(analytics_bp)
 
     return app
\ No newline at end of file
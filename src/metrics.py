@@ -0,0 +1,182 @@
+import functools
+import os
+import time
+
+from flask import Response, g, request
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+# Under gunicorn, set PROMETHEUS_MULTIPROC_DIR to an empty directory before the workers start.
+# Every worker then writes its samples to memory-mapped files there and /metrics adds them up,
+# whichever worker answers the scrape. Gauges say how the values of the workers are combined.
+
+# Requests by route template, e.g. "/leave_request/<int:leave_request_id>", so ids do not multiply the series
+http_requests = Counter(
+    "http_requests_total", "Requests handled.",
+    ["blueprint", "route", "method", "status"]
+)
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Time from the start of the request until the response is returned.",
+    ["blueprint", "route", "method", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+http_requests_in_flight = Gauge(
+    "http_requests_in_flight", "Requests being handled.",
+    multiprocess_mode="livesum"
+)
+
+# Connection pool of each engine, "default" being the main database
+db_pool_size = Gauge(
+    "db_pool_size", "Connections the pool keeps open, not counting overflow.",
+    ["engine"], multiprocess_mode="livesum"
+)
+db_pool_max_overflow = Gauge(
+    "db_pool_max_overflow", "Connections the pool may open on top of its size.",
+    ["engine"], multiprocess_mode="livesum"
+)
+db_pool_checked_out = Gauge(
+    "db_pool_checked_out", "Connections in use.",
+    ["engine"], multiprocess_mode="livesum"
+)
+db_pool_overflow = Gauge(
+    "db_pool_overflow", "Connections open beyond the pool size.",
+    ["engine"], multiprocess_mode="livesum"
+)
+# A checkout waits for a connection once every connection, overflow included, is checked out
+db_pool_waits = Counter(
+    "db_pool_waits_total", "Checkouts that found every connection, overflow included, in use and had to wait.",
+    ["engine"]
+)
+db_pool_wait_duration = Histogram(
+    "db_pool_wait_seconds", "Time the checkouts that had to wait spent getting a connection.",
+    ["engine"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+db_pool_timeouts = Counter(
+    "db_pool_timeouts_total", "Checkouts that gave up waiting for a free connection."
+)
+
+# Password hashing pool, see hashing.PasswordHasher
+hashing_workers = Gauge(
+    "password_hashing_workers", "Workers of the password hashing pool.",
+    multiprocess_mode="livesum"
+)
+hashing_pending = Gauge(
+    "password_hashing_pending", "Hashes submitted to the pool and not finished, running or queued.",
+    multiprocess_mode="livesum"
+)
+hashing_rejected = Counter(
+    "password_hashing_rejected_total", "Hashes turned away because the pool was saturated."
+)
+
+# Lookups of the response cache, see response_cache.cached_response
+response_cache_requests = Counter(
+    "response_cache_requests_total", "Response cache lookups, by endpoint and result (hit or miss).",
+    ["endpoint", "result"]
+)
+
+# Label of the route that matched, the same for every unmatched path
+def _route():
+    if request.url_rule is not None:
+        return request.url_rule.rule
+    return "unmatched"
+
+# Keeps the pool gauges of an engine up to date from its checkout and checkin events
+def _watch_pool(name, pool):
+    if hasattr(pool, "size"):
+        db_pool_size.labels(name).set(pool.size())
+    if hasattr(pool, "_max_overflow"):
+        db_pool_max_overflow.labels(name).set(max(pool._max_overflow, 0))
+    checked_out = db_pool_checked_out.labels(name)
+    overflow = db_pool_overflow.labels(name)
+
+    @event.listens_for(pool, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        checked_out.inc()
+        if hasattr(pool, "overflow"):
+            overflow.set(max(pool.overflow(), 0))
+
+    @event.listens_for(pool, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        checked_out.dec()
+        if hasattr(pool, "overflow"):
+            overflow.set(max(pool.overflow(), 0))
+
+    # Pools without a size, e.g. those of SQLite files, never make a checkout wait
+    if hasattr(pool, "size") and hasattr(pool, "checkedout") and getattr(pool, "_max_overflow", -1) >= 0:
+        _time_waits(name, pool)
+
+# Wraps the pool's connect() to count the checkouts that start with every connection in use, which
+# have to wait for one to be checked in, and how long they wait. A checkout that gives up after the
+# pool timeout is counted in db_pool_timeouts_total, whatever made the request.
+def _time_waits(name, pool):
+    waits = db_pool_waits.labels(name)
+    wait_duration = db_pool_wait_duration.labels(name)
+    connect = pool.connect
+
+    @functools.wraps(connect)
+    def timed_connect():
+        if pool.checkedout() < pool.size() + pool._max_overflow:
+            return connect()
+        start = time.perf_counter()
+        try:
+            return connect()
+        except PoolTimeoutError:
+            db_pool_timeouts.inc()
+            raise
+        finally:
+            waits.inc()
+            wait_duration.observe(time.perf_counter() - start)
+
+    pool.connect = timed_connect
+
+# Request metrics and the /metrics endpoint in Prometheus text format
+class Metrics:
+    def __init__(self):
+        self.enabled = True
+
+    def init_app(self, app, db=None, hasher=None):
+        app.config.setdefault("METRICS_ENABLED", True)
+        self.enabled = bool(app.config["METRICS_ENABLED"])
+        app.extensions["metrics"] = self
+        if not self.enabled:
+            return
+
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+        app.add_url_rule("/metrics", "metrics", self.view, methods=["GET"])
+
+        if db is not None:
+            with app.app_context():
+                for bind_key, engine in db.engines.items():
+                    _watch_pool(bind_key or "default", engine.pool)
+        if hasher is not None and hasher.mode != "inline":
+            hashing_workers.set(hasher.workers)
+
+    def _start(self):
+        g.metrics_start = time.perf_counter()
+        http_requests_in_flight.inc()
+
+    def _finish(self, response):
+        start = g.get("metrics_start")
+        if start is not None:
+            labels = (request.blueprint or "", _route(), request.method, str(response.status_code))
+            http_requests.labels(*labels).inc()
+            http_request_duration.labels(*labels).observe(time.perf_counter() - start)
+        return response
+
+    # Runs even when the response could not be built
+    def _teardown(self, exc):
+        if g.pop("metrics_start", None) is not None:
+            http_requests_in_flight.dec()
+
+    def view(self):
+        if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
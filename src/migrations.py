@@ -0,0 +1,113 @@
+from sqlalchemy import DDL, inspect
+from sqlalchemy.schema import CreateColumn
+
+from init import db
+
+# True if the index is created on this dialect. Indexes declared for one dialect only name it in
+# info["dialect"], next to their ddl_if(dialect=...).
+def _index_applies(index, dialect):
+    return index.info.get("dialect", dialect.name) == dialect.name
+
+# Names of the indexes of each table that PostgreSQL marks invalid, as a CREATE INDEX CONCURRENTLY
+# that failed or was interrupted leaves them. They exist but are never used by queries.
+def _invalid_indexes(connection):
+    if connection.dialect.name != "postgresql":
+        return {}
+    rows = connection.exec_driver_sql(
+        "SELECT t.relname, i.relname FROM pg_index x "
+        "JOIN pg_class i ON i.oid = x.indexrelid JOIN pg_class t ON t.oid = x.indrelid "
+        "WHERE NOT x.indisvalid AND pg_catalog.pg_table_is_visible(t.oid)"
+    )
+    invalid = {}
+    for table_name, index_name in rows:
+        invalid.setdefault(table_name, set()).add(index_name)
+    return invalid
+
+def _add_column_ddl(table, column, dialect):
+    preparer = dialect.identifier_preparer
+    return f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {CreateColumn(column).compile(dialect=dialect)}"
+
+# Changes that bring the database in line with the models, without dropping anything but invalid
+# indexes: ("table", table), ("column", table, column), ("index", index) and ("rebuild", index) for
+# an index of the models left invalid by a failed concurrent build. Also returns the problems that
+# need a hand-written migration, such as a NOT NULL column without a server default, or an invalid
+# index the models do not declare.
+def plan_migration():
+    engine = db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.connect() as connection:
+        invalid_indexes = _invalid_indexes(connection)
+    changes, problems = [], []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            # Created together with its indexes
+            changes.append(("table", table))
+            continue
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            # Existing rows need a value for the new column
+            if not column.nullable and column.server_default is None:
+                problems.append(f"{table.name}.{column.name} is NOT NULL without a server default.")
+            else:
+                changes.append(("column", table, column))
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        invalid = invalid_indexes.get(table.name, set())
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if not _index_applies(index, engine.dialect):
+                continue
+            if index.name in invalid:
+                changes.append(("rebuild", index))
+            elif index.name not in existing_indexes:
+                changes.append(("index", index))
+        for index_name in sorted(invalid - {index.name for index in table.indexes}):
+            problems.append(f"Index {index_name} on {table.name} is invalid and not declared by the models, drop it by hand.")
+    return changes, problems
+
+def describe_change(change):
+    if change[0] == "table":
+        return f"Create table {change[1].name}"
+    if change[0] == "column":
+        return f"Add column {change[1].name}.{change[2].name}"
+    if change[0] == "rebuild":
+        return f"Rebuild invalid index {change[1].name} on {change[1].table.name}"
+    return f"Create index {change[1].name} on {change[1].table.name}"
+
+# Applies the planned changes. Tables and columns are added in one transaction. Indexes are built
+# one at a time afterwards, with CREATE INDEX CONCURRENTLY on PostgreSQL so writes to a populated
+# table are not blocked meanwhile. A concurrent build that fails leaves an invalid index behind;
+# running the migration again drops it (DROP INDEX CONCURRENTLY) and builds it anew.
+def apply_migration(changes, progress=print):
+    engine = db.engine
+    with engine.begin() as connection:
+        tables = [change[1] for change in changes if change[0] == "table"]
+        if tables:
+            db.metadata.create_all(connection, tables=tables)
+        for change in changes:
+            if change[0] == "column":
+                connection.exec_driver_sql(_add_column_ddl(change[1], change[2], engine.dialect))
+        for change in changes:
+            if change[0] in ("table", "column"):
+                progress(describe_change(change))
+
+    indexes = [change for change in changes if change[0] in ("index", "rebuild")]
+    if not indexes:
+        return
+    concurrently = engine.dialect.name == "postgresql"
+    # CONCURRENTLY cannot run inside a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for change in indexes:
+            index = change[1]
+            if concurrently and index.dialect_options["postgresql"]["using"] == "gist":
+                connection.execute(DDL("CREATE EXTENSION IF NOT EXISTS btree_gist"))
+            previous = index.dialect_options["postgresql"]["concurrently"]
+            index.dialect_options["postgresql"]["concurrently"] = concurrently
+            try:
+                if change[0] == "rebuild":
+                    index.drop(connection)
+                index.create(connection)
+            finally:
+                index.dialect_options["postgresql"]["concurrently"] = previous
+            progress(describe_change(change))
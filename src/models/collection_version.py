@@ -0,0 +1,10 @@
+from init import db
+
+class CollectionVersion(db.Model):
+    # Name of the table
+    __tablename__ = "collection_version"
+
+    # Attributes of the table: a counter per cached collection, e.g. "department" or "leave_request:employee:4",
+    # bumped after every commit that changes the collection
+    key = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
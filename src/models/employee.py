@@ -1,6 +1,6 @@
 from init import db, ma
 from marshmallow import fields
-from marshmallow.validate import Regexp, Length
+from marshmallow.validate import Regexp, Length, Range, OneOf
 
 class Employee(db.Model):
     # Name of the table
@@ -12,29 +12,39 @@ class Employee(db.Model):
     last_name = db.Column(db.String(50), nullable=False)
     email = db.Column(db.String(100), unique=True, nullable=False)
     password = db.Column(db.String(100), nullable=False)
-    team_id = db.Column(db.Integer, db.ForeignKey('team.id'), nullable=False)
+    team_id = db.Column(db.Integer, db.ForeignKey('team.id'), nullable=False, index=True)
     is_admin = db.Column(db.Boolean, default=False)
+    # Incremented whenever the admin role changes, so tokens carrying an older version stop working
+    role_version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # Days of leave credited per year, either at once on 1 January ("annual") or a twelfth each month ("monthly")
+    annual_entitlement = db.Column(db.Integer, nullable=False, default=20, server_default="20")
+    accrual_rule = db.Column(db.String(20), nullable=False, default="annual", server_default="annual")
 
     # Relationships
     team = db.relationship('Team', back_populates='employees')
     leave_requests = db.relationship('LeaveRequest', back_populates='employee')
+    ledger_entries = db.relationship('LeaveLedgerEntry', back_populates='employee', cascade="all, delete-orphan")
+    leave_balance = db.relationship('LeaveBalance', back_populates='employee', uselist=False, cascade="all, delete-orphan")
 
 class EmployeeSchema(ma.Schema):
     # Nested relationship fields
     leave_requests = fields.List(fields.Nested('LeaveRequestSchema', exclude=["employee"]))
-    team = fields.Nested('TeamSchema', exclude=["employees"])
+    team = fields.Nested('TeamSchema', exclude=["employees", "max_concurrent_absence"])
 
     # Email format validation
     email = fields.String(required=True, validate=Regexp(r"^\S+@\S+\.\S+$", error="Invalid email format."))
     # Password length validation
     password = fields.String(load_only=True, required=True, validate=Length(min=6, error="Password must be at least 6 characters long."))
+    # Leave entitlement validation
+    annual_entitlement = fields.Integer(validate=Range(min=0, max=366, error="Annual entitlement must be between 0 and 366 days."))
+    accrual_rule = fields.String(validate=OneOf(["annual", "monthly"]))
 
     class Meta:
         # Fields to expose
-        fields = ("id", "first_name", "last_name", "email", "password", "is_admin", "leave_requests", "team_id", "team")
+        fields = ("id", "first_name", "last_name", "email", "password", "is_admin", "annual_entitlement", "accrual_rule", "leave_requests", "team_id", "team")
 
 # To handle a single employee object
-employee_schema = EmployeeSchema(exclude=["password", "leave_requests", "team_id"])
+employee_schema = EmployeeSchema(exclude=["password", "annual_entitlement", "accrual_rule", "leave_requests", "team_id"])
 
 # To handle a list of employee objects
-employees_schema = EmployeeSchema(many=True, exclude=["password", "leave_requests", "team_id"])
\ No newline at end of file
+employees_schema = EmployeeSchema(many=True, exclude=["password", "annual_entitlement", "accrual_rule", "leave_requests", "team_id"])
\ No newline at end of file
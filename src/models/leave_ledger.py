@@ -0,0 +1,49 @@
+from init import db, ma
+from marshmallow import fields
+
+class LeaveLedgerEntry(db.Model):
+    # Name of the table
+    __tablename__ = "leave_ledger_entry"
+
+    # Attributes of the table
+    id = db.Column(db.Integer, primary_key=True)
+    employee_id = db.Column(db.Integer, db.ForeignKey('employee.id'), nullable=False, index=True)
+    # Not a foreign key, so entries outlive a deleted leave request for audits
+    leave_request_id = db.Column(db.Integer, nullable=True, index=True)
+    # "accrual" for entitlement credited, "debit" for approved leave taken, "reversal" for taken leave given back,
+    # "adjustment" for a rebuild correcting the days taken by approved leave
+    entry_type = db.Column(db.String(20), nullable=False)
+    # Days credited (positive) or debited (negative)
+    days = db.Column(db.Numeric(8, 2), nullable=False)
+    effective_date = db.Column(db.Date, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+
+    # Relationships
+    employee = db.relationship('Employee', back_populates='ledger_entries')
+
+class LeaveBalance(db.Model):
+    # Name of the table
+    __tablename__ = "leave_balance"
+
+    # Attributes of the table, kept equal to the totals of the employee's ledger entries
+    employee_id = db.Column(db.Integer, db.ForeignKey('employee.id'), primary_key=True)
+    accrued = db.Column(db.Numeric(8, 2), nullable=False, default=0, server_default="0")
+    taken = db.Column(db.Numeric(8, 2), nullable=False, default=0, server_default="0")
+    balance = db.Column(db.Numeric(8, 2), nullable=False, default=0, server_default="0")
+    # Start of the last accrual period credited, empty until the first accrual
+    accrued_through = db.Column(db.Date, nullable=True)
+
+    # Relationships
+    employee = db.relationship('Employee', back_populates='leave_balance')
+
+class LeaveBalanceSchema(ma.Schema):
+    accrued = fields.Float()
+    taken = fields.Float()
+    balance = fields.Float()
+
+    class Meta:
+        # Fields to expose
+        fields = ("employee_id", "accrued", "taken", "balance", "accrued_through")
+
+# To handle a single balance object
+leave_balance_schema = LeaveBalanceSchema()
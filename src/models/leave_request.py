@@ -1,6 +1,8 @@
 from datetime import date
+from sqlalchemy import DDL, event
 from init import db, ma
 from marshmallow import fields, validates_schema, ValidationError
+from marshmallow.validate import Length, OneOf
 
 class LeaveRequest(db.Model):
     # Name of the table
@@ -19,8 +21,35 @@ class LeaveRequest(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint('employee_id', 'start_date', 'end_date', name='uix_employee_dates'),
+        # An employee's approved (or pending) leave starting in a date window
+        db.Index('ix_leave_request_employee_status_start', 'employee_id', 'status_id', 'start_date'),
+        # Leave of one status starting in a date window, across employees, e.g. for a team or an export
+        db.Index('ix_leave_request_status_start', 'status_id', 'start_date'),
+        # An employee's leave requests in id order, for the pages of GET /leave_request
+        db.Index('ix_leave_request_employee_id', 'employee_id', 'id'),
     )
 
+# Inclusive PostgreSQL daterange of a leave request, used for overlap checks
+def leave_period(start_date, end_date):
+    return db.func.daterange(start_date, end_date, db.literal_column("'[]'"))
+
+# GiST index answering "which of this employee's requests overlap this range" in O(log n) on PostgreSQL.
+# info["dialect"] tells `flask db migrate` the same as ddl_if tells create_all.
+db.Index(
+    'ix_leave_request_employee_period',
+    LeaveRequest.employee_id,
+    leave_period(LeaveRequest.start_date, LeaveRequest.end_date),
+    postgresql_using='gist',
+    info={'dialect': 'postgresql'}
+).ddl_if(dialect='postgresql')
+
+# The GiST index needs btree_gist for the integer employee_id column
+event.listen(
+    LeaveRequest.__table__,
+    'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS btree_gist').execute_if(dialect='postgresql')
+)
+
 class LeaveRequestSchema(ma.Schema):
     # Nested relationship fields
     employee = fields.Nested('EmployeeSchema', only=["first_name", "last_name"])
@@ -45,4 +74,20 @@ class LeaveRequestSchema(ma.Schema):
 leave_request_schema = LeaveRequestSchema(exclude=["employee_id", "employee", "status_id"])
 
 # To handle a list of leave request objects
-leave_requests_schema = LeaveRequestSchema(many=True, exclude=["employee_id"])
\ No newline at end of file
+leave_requests_schema = LeaveRequestSchema(many=True, exclude=["employee_id"])
+
+class LeaveTransitionSchema(ma.Schema):
+    # Leave requests to move out of "pending", and the status to move them to
+    ids = fields.List(fields.Integer(), required=True, validate=Length(min=1, max=1000, error="Between 1 and 1000 leave request IDs are required."))
+    status = fields.String(required=True, validate=OneOf(["approved", "rejected"]))
+
+    # Optional filters, leave requests outside them are left unchanged
+    team_id = fields.Integer()
+    from_date = fields.Date(data_key="from")
+    to_date = fields.Date(data_key="to")
+
+# To validate a batch status change
+leave_transition_schema = LeaveTransitionSchema()
+
+# To handle the leave requests changed by a batch status change
+leave_transitions_schema = LeaveRequestSchema(many=True, only=["id", "employee_id", "start_date", "end_date"])
@@ -0,0 +1,38 @@
+from init import db, ma
+from marshmallow import fields, validates_schema, ValidationError
+from marshmallow.validate import OneOf
+
+class LeaveSummary(db.Model):
+    # Name of the table
+    __tablename__ = "leave_summary"
+
+    # Attributes of the table: working days and number of leave requests per team, month and status.
+    # A request spanning several months counts in each of them, with the days falling in that month.
+    team_id = db.Column(db.Integer, db.ForeignKey('team.id'), primary_key=True)
+    month = db.Column(db.Date, primary_key=True)
+    status_id = db.Column(db.Integer, db.ForeignKey('status.id'), primary_key=True)
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=False)
+    days = db.Column(db.Integer, nullable=False, default=0)
+    requests = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_leave_summary_month', 'month'),
+    )
+
+class LeaveAnalyticsSchema(ma.Schema):
+    # Grouping and optional filters of the analytics
+    group_by = fields.String(load_default="department", validate=OneOf(["department", "team"]))
+    from_date = fields.Date(data_key="from")
+    to_date = fields.Date(data_key="to")
+    status = fields.String(validate=OneOf(["pending", "approved", "rejected"]))
+    department_id = fields.Integer()
+    team_id = fields.Integer()
+
+    # Date range validation
+    @validates_schema
+    def validate_dates(self, data, **kwargs):
+        if data.get("from_date") and data.get("to_date") and data["from_date"] > data["to_date"]:
+            raise ValidationError("From date must be before or the same as the to date.")
+
+# To validate the analytics query string
+leave_analytics_schema = LeaveAnalyticsSchema()
@@ -1,7 +1,16 @@
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
 from init import db, ma
+from routing import on_primary
 from marshmallow import fields
 from marshmallow.validate import OneOf
 
+# Statuses the API relies on
+STATUS_NAMES = ["pending", "approved", "rejected"]
+
 class Status(db.Model):
     # Name of the table
     __tablename__ = "status"
@@ -18,7 +27,7 @@ class StatusSchema(ma.Schema):
     leave_requests = fields.List(fields.Nested('LeaveRequestSchema', exclude=["status"]))
 
     # Validate status name against predefined values using the database records
-    status_name = fields.String(validate=OneOf(["pending", "approved", "rejected"]))
+    status_name = fields.String(validate=OneOf(STATUS_NAMES))
 
     class Meta:
         # Fields to expose
@@ -28,4 +37,75 @@ class StatusSchema(ma.Schema):
 status_schema = StatusSchema()
 
 # To handle a list of status objects
-statuses_schema = StatusSchema(many=True)
\ No newline at end of file
+statuses_schema = StatusSchema(many=True)
+
+# Process-wide lookup of the status table, so controllers don't query it on every request
+class StatusRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = None
+        self._names = None
+
+    # Reads the status table from the primary, so a table just seeded is seen before the replica
+    # catches up. Split out so sessions other than db.session, such as the async ones, can run it.
+    def stmt(self):
+        return on_primary(db.select(Status.id, Status.status_name))
+
+    # Returns both directions of the mapping of the rows, and keeps them if every status in
+    # STATUS_NAMES is there. An empty or partly seeded table is read again on the next lookup.
+    def fill(self, rows):
+        names = {row.id: row.status_name for row in rows}
+        ids = {status_name: status_id for status_id, status_name in names.items()}
+        if all(status_name in ids for status_name in STATUS_NAMES):
+            with self._lock:
+                self._ids, self._names = ids, names
+        return ids, names
+
+    @property
+    def loaded(self):
+        return self._ids is not None
+
+    # Loads the status table once and keeps both directions of the mapping
+    def _load(self):
+        with self._lock:
+            if self._ids is not None:
+                return self._ids, self._names
+        return self.fill(db.session.execute(self.stmt()).all())
+
+    # Returns the id of a status name, or None if the status does not exist
+    def get_id(self, status_name):
+        ids, _ = self._load()
+        return ids.get(status_name)
+
+    # Returns the name of a status id, or None if the status does not exist
+    def get_name(self, status_id):
+        _, names = self._load()
+        return names.get(status_id)
+
+    # Forgets the loaded statuses so the next lookup reloads them
+    def invalidate(self):
+        with self._lock:
+            self._ids = None
+            self._names = None
+
+status_registry = StatusRegistry()
+
+# Flags the session when a status row changes, so the registry reloads once the change is final
+@event.listens_for(Status, "after_insert")
+@event.listens_for(Status, "after_update")
+@event.listens_for(Status, "after_delete")
+def flag_status_change(mapper, connection, target):
+    object_session(target).info["status_changed"] = True
+
+# Flags bulk INSERT, UPDATE and DELETE statements on the status table the same way
+@event.listens_for(Session, "do_orm_execute")
+def flag_bulk_status_change(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        if any(mapper.class_ is Status for mapper in orm_execute_state.all_mappers):
+            orm_execute_state.session.info["status_changed"] = True
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def reload_status_registry(session):
+    if session.info.pop("status_changed", False):
+        status_registry.invalidate()
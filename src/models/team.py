@@ -1,5 +1,6 @@
 from init import db, ma
 from marshmallow import fields
+from marshmallow.validate import Range
 
 class Team(db.Model):
     # Name of the table
@@ -9,6 +10,8 @@ class Team(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     team_name = db.Column(db.String(100), nullable=False, unique=True)
     department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=False)
+    # Most team members allowed on approved leave on the same day, no limit when empty
+    max_concurrent_absence = db.Column(db.Integer, nullable=True)
 
     # Relationships
     employees = db.relationship('Employee', back_populates='team')
@@ -19,12 +22,15 @@ class TeamSchema(ma.Schema):
     employees = fields.List(fields.Nested('EmployeeSchema', only=["first_name", "last_name"]))
     department = fields.Nested('DepartmentSchema', only=["department_name"])
 
+    # Capacity validation
+    max_concurrent_absence = fields.Integer(allow_none=True, validate=Range(min=1, error="Maximum concurrent absence must be at least 1."))
+
     class Meta:
         # Fields to expose
-        fields = ("id", "team_name", "department_id", "employees", "department")
+        fields = ("id", "team_name", "department_id", "max_concurrent_absence", "employees", "department")
 
 # To handle a single team object
 team_schema = TeamSchema()
 
 # To handle a list of team objects
-teams_schema = TeamSchema(many=True, exclude=["department_id", "employees"])
\ No newline at end of file
+teams_schema = TeamSchema(many=True, exclude=["department_id", "max_concurrent_absence", "employees"])
\ No newline at end of file
@@ -0,0 +1,79 @@
+import base64
+import json
+
+from flask import request, current_app
+from marshmallow import ValidationError
+from sqlalchemy import tuple_
+
+from init import db
+
+# Turns the sort key values of the last row into an opaque cursor string
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+# Reads the sort key values back, one per column and each of the column's python type,
+# so a tampered cursor is refused instead of being compared with the wrong type
+def decode_cursor(cursor, columns):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except ValueError:
+        raise ValidationError({"cursor": ["Invalid cursor."]})
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValidationError({"cursor": ["Invalid cursor."]})
+    if not all(_matches_type(value, column) for value, column in zip(values, columns)):
+        raise ValidationError({"cursor": ["Invalid cursor."]})
+    return values
+
+def _matches_type(value, column):
+    python_type = column.type.python_type
+    # JSON true and false load as bool, a subclass of int
+    if isinstance(value, bool) and python_type is not bool:
+        return False
+    return isinstance(value, python_type)
+
+# Reads the page size from the query string (or the given args), capped by PAGINATION_MAX_LIMIT
+def get_limit(args=None):
+    args = request.args if args is None else args
+    default_limit = current_app.config.get("PAGINATION_DEFAULT_LIMIT", 50)
+    max_limit = current_app.config.get("PAGINATION_MAX_LIMIT", 200)
+    limit = args.get("limit", default_limit, type=int)
+    if limit is None or limit < 1:
+        raise ValidationError({"limit": ["Limit must be a positive number."]})
+    return min(limit, max_limit)
+
+# Builds "sort key is after the cursor" for any number of ascending columns as a row value
+# comparison, e.g. (name, id) > (a, b), which PostgreSQL and SQLite (3.15 and later) answer with
+# one range scan of an index on the same columns, where the expanded OR form scans each branch
+def _after(columns, values):
+    if len(columns) == 1:
+        return columns[0] > values[0]
+    return tuple_(*columns) > tuple_(*values)
+
+# Narrows the select statement to the page after the cursor, with one extra row to know whether there is another page
+def page_statement(stmt, columns, limit, cursor):
+    if cursor:
+        stmt = stmt.where(_after(columns, decode_cursor(cursor, columns)))
+    return stmt.order_by(*[column.asc() for column in columns]).limit(limit + 1)
+
+# Drops the extra row of a fetched page, returning the page and the cursor of the next one
+def split_page(items, columns, limit):
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor([getattr(items[-1], column.key) for column in columns])
+    return items, next_cursor
+
+# Returns one page of the select statement and the cursor of the next page (None on the last page).
+# The columns must end with a unique column (normally the id) so the order is total.
+# With rows=True the page holds SQL rows instead of ORM objects.
+def paginate(stmt, *columns, rows=False):
+    limit = get_limit()
+    stmt = page_statement(stmt, columns, limit, request.args.get("cursor"))
+    items = db.session.execute(stmt).all() if rows else db.session.scalars(stmt).all()
+    return split_page(items, columns, limit)
+
+# Response headers that point the client at the next page
+def page_headers(next_cursor):
+    return {"X-Next-Cursor": next_cursor} if next_cursor else {}
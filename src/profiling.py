@@ -0,0 +1,165 @@
+import contextlib
+import functools
+import json
+import logging
+import random
+import time
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Slow request log lines go to this logger
+logger = logging.getLogger("instrumentation")
+
+# Raised in test mode when an endpoint runs more queries than its budget allows
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+# Counts every statement sent to the database during the current app context
+@event.listens_for(Engine, "before_cursor_execute")
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context():
+        g.query_count = g.get("query_count", 0) + 1
+
+# Fails the request when the decorated endpoint runs more than max_queries statements.
+# Only enforced when QUERY_BUDGET_ENFORCED is set, which defaults to on when testing.
+def query_budget(max_queries):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not current_app.config.get("QUERY_BUDGET_ENFORCED", current_app.testing):
+                return fn(*args, **kwargs)
+            start = g.get("query_count", 0)
+            result = fn(*args, **kwargs)
+            used = g.get("query_count", 0) - start
+            if used > max_queries:
+                raise QueryBudgetExceeded(f"{fn.__name__} ran {used} queries, the budget is {max_queries}.")
+            return result
+        return wrapper
+    return decorator
+
+# Timings of one sampled request
+class RequestProfile:
+    def __init__(self, slowest):
+        self.start = time.perf_counter()
+        self.query_count = 0
+        self.sql_time = 0.0
+        self.timings = {}
+        # The slowest statements as (seconds, statement), at most `slowest` of them
+        self.statements = []
+        self._slowest = slowest
+
+    def add_query(self, statement, elapsed):
+        self.query_count += 1
+        self.sql_time += elapsed
+        if len(self.statements) < self._slowest:
+            self.statements.append((elapsed, statement))
+        elif self._slowest and elapsed > self.statements[0][0]:
+            self.statements[0] = (elapsed, statement)
+        else:
+            return
+        self.statements.sort(key=lambda item: item[0])
+
+    def add_timing(self, name, elapsed):
+        self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+def _current_profile():
+    if has_request_context():
+        return g.get("profile")
+    return None
+
+# Adds the time spent in the block to the current request's profile under `name`, e.g. "serialize".
+# Costs one attribute lookup when the request is not being profiled.
+@contextlib.contextmanager
+def timed(name):
+    profile = _current_profile()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_timing(name, time.perf_counter() - start)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_profile() is not None:
+        conn.info.setdefault("profile_starts", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile()
+    starts = conn.info.get("profile_starts")
+    if profile is not None and starts:
+        profile.add_query(statement, time.perf_counter() - starts.pop())
+
+# Profiles a sample of requests: query count, SQL time, the slowest statements, and the time spent
+# hashing, serializing and encoding JSON. Sampled responses carry a Server-Timing header, and sampled
+# requests slower than INSTRUMENTATION_SLOW_MS are logged as one JSON line.
+class Instrumentation:
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 1.0
+        self.slow_ms = 500
+        self.slowest = 3
+
+    def init_app(self, app):
+        app.config.setdefault("INSTRUMENTATION_ENABLED", False)
+        # Share of requests profiled, from 0 to 1
+        app.config.setdefault("INSTRUMENTATION_SAMPLE_RATE", 1.0)
+        app.config.setdefault("INSTRUMENTATION_SLOW_MS", 500)
+        # Number of slowest statements included in the log line
+        app.config.setdefault("INSTRUMENTATION_SLOWEST", 3)
+
+        self.enabled = bool(app.config["INSTRUMENTATION_ENABLED"])
+        self.sample_rate = float(app.config["INSTRUMENTATION_SAMPLE_RATE"])
+        self.slow_ms = float(app.config["INSTRUMENTATION_SLOW_MS"])
+        self.slowest = int(app.config["INSTRUMENTATION_SLOWEST"])
+        app.extensions["instrumentation"] = self
+        if not self.enabled:
+            return
+
+        if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+        # Time JSON encoding of every response, whichever provider is installed
+        encode = app.json.response
+        def timed_response(*args, **kwargs):
+            with timed("encode"):
+                return encode(*args, **kwargs)
+        app.json.response = timed_response
+
+    def _start(self):
+        if self.sample_rate >= 1 or random.random() < self.sample_rate:
+            g.profile = RequestProfile(self.slowest)
+
+    def _finish(self, response):
+        profile = g.pop("profile", None)
+        if profile is None:
+            return response
+        total_ms = (time.perf_counter() - profile.start) * 1000
+        metrics = [f'sql;dur={profile.sql_time * 1000:.2f};desc="{profile.query_count} queries"']
+        metrics.extend(f"{name};dur={elapsed * 1000:.2f}" for name, elapsed in profile.timings.items())
+        metrics.append(f"total;dur={total_ms:.2f}")
+        response.headers["Server-Timing"] = ", ".join(metrics)
+
+        if total_ms >= self.slow_ms:
+            record = {
+                "method": request.method,
+                "path": request.path,
+                "endpoint": request.endpoint,
+                "status": response.status_code,
+                "duration_ms": round(total_ms, 2),
+                "query_count": profile.query_count,
+                "sql_ms": round(profile.sql_time * 1000, 2),
+                "timings_ms": {name: round(elapsed * 1000, 2) for name, elapsed in profile.timings.items()},
+                "slowest_statements": [
+                    {"duration_ms": round(elapsed * 1000, 2), "statement": " ".join(statement.split())[:500]}
+                    for elapsed, statement in reversed(profile.statements)
+                ],
+            }
+            logger.warning(json.dumps(record))
+        return response
@@ -0,0 +1,73 @@
+import functools
+from datetime import date
+
+from flask import current_app, request
+
+from cache import TTLCache
+from metrics import response_cache_requests
+from versions import collection_versions
+
+# Statuses worth keeping: the leave found, or the answer that there is none
+CACHED_STATUSES = (200, 404)
+
+# Encoded responses of read-heavy views. Entries live in TTLCache by default, bounded by
+# RESPONSE_CACHE_MAXSIZE and RESPONSE_CACHE_TTL; RESPONSE_CACHE_BACKEND replaces it with any
+# object that has get(key) and set(key, value), e.g. a client of a cache shared by all workers.
+class ResponseCache:
+    def __init__(self):
+        self.backend = TTLCache()
+
+    def init_app(self, app):
+        app.config.setdefault("RESPONSE_CACHE_MAXSIZE", 1024)
+        app.config.setdefault("RESPONSE_CACHE_TTL", 60)
+        app.config.setdefault("RESPONSE_CACHE_BACKEND", None)
+        backend = app.config["RESPONSE_CACHE_BACKEND"]
+        if backend is None:
+            backend = TTLCache(maxsize=int(app.config["RESPONSE_CACHE_MAXSIZE"]), ttl=int(app.config["RESPONSE_CACHE_TTL"]))
+        self.backend = backend
+        app.extensions["response_cache"] = self
+
+    # The cached response of the current request's endpoint, or None
+    def get_response(self, cache_key):
+        entry = self.backend.get(cache_key)
+        if entry is None:
+            response_cache_requests.labels(request.endpoint, "miss").inc()
+            return None
+        response_cache_requests.labels(request.endpoint, "hit").inc()
+        body, status, headers = entry
+        return current_app.response_class(body, status=status, headers=headers)
+
+    # Keeps the body, status and headers, so a hit answers exactly like the view did
+    def set_response(self, cache_key, response):
+        if response.status_code in CACHED_STATUSES:
+            self.backend.set(cache_key, (response.get_data(), response.status_code, list(response.headers.items())))
+
+response_cache = ResponseCache()
+
+# Key of a cached response: the view, its arguments, the day and the current versions of its keys
+def response_cache_key(endpoint, view_args, names, versions):
+    return "|".join([
+        endpoint,
+        *(f"{name}={value}" for name, value in sorted(view_args.items())),
+        # The views look 30 days ahead of today, so the day is part of the key
+        date.today().isoformat(),
+        *(f"{name}@{versions[name]}" for name in names),
+    ])
+
+# Caches the view's response per endpoint, view arguments and day. Keys are version counters,
+# or functions of the view arguments returning one, whose current values are part of the cache
+# key: bumping any of them makes the next request miss, so no entry has to be deleted.
+# Goes below @jwt_required(), as cached responses are shared by every employee.
+def cached_response(*keys):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            names = [key(**kwargs) if callable(key) else key for key in keys]
+            cache_key = response_cache_key(request.endpoint, kwargs, names, collection_versions.store.get_many(names))
+            response = response_cache.get_response(cache_key)
+            if response is None:
+                response = current_app.make_response(fn(*args, **kwargs))
+                response_cache.set_response(cache_key, response)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,36 @@
+from flask import has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql import Select
+
+# Bind key of the read replica in SQLALCHEMY_BINDS, set from DATABASE_REPLICA_URL
+REPLICA_BIND = "replica"
+
+# Requests whose plain SELECTs may be answered by the replica
+READ_METHODS = ("GET", "HEAD")
+
+# Marks a SELECT that must see the primary's latest data even in a GET request, such as an
+# authorization check or a read deciding about a write. Does not pin the rest of the request.
+def on_primary(stmt):
+    return stmt.execution_options(use_primary=True)
+
+# Sends the SELECTs of GET requests to the replica when one is configured. Everything else goes to
+# the primary: flushes, INSERT/UPDATE/DELETE, SELECT ... FOR UPDATE, text statements, CLI commands.
+# Once a request has used the primary for any of those, the rest of it stays there, so it reads its
+# own writes and the rows it locked.
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._reads_from_replica(mapper, clause):
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _reads_from_replica(self, mapper, clause):
+        if not has_request_context() or request.method not in READ_METHODS:
+            return False
+        if self.info.get("pinned_to_primary") or REPLICA_BIND not in self._db.engines:
+            return False
+        if isinstance(clause, Select) and clause._for_update_arg is None:
+            return not clause.get_execution_options().get("use_primary")
+        # get_bind() without a mapper or clause only asks for the dialect
+        if mapper is not None or clause is not None:
+            self.info["pinned_to_primary"] = True
+        return False
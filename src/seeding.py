@@ -0,0 +1,116 @@
+import random
+from datetime import date, timedelta
+
+from init import db, hasher
+from models.department import Department
+from models.employee import Employee
+from models.leave_request import LeaveRequest
+from models.status import Status, status_registry
+from models.team import Team
+
+# Rows inserted per statement by the large seed
+SEED_CHUNK_SIZE = 10000
+
+# Length of a leave request in calendar days, mostly single days and whole weeks
+LEAVE_LENGTHS = (1, 2, 3, 5, 7, 10, 14)
+LEAVE_LENGTH_WEIGHTS = (30, 12, 10, 20, 12, 10, 6)
+
+# Status of leave that has started, and of leave still to come
+PAST_STATUSES = (("approved", 85), ("rejected", 12), ("pending", 3))
+FUTURE_STATUSES = (("pending", 50), ("approved", 45), ("rejected", 5))
+
+FIRST_NAMES = ("Alex", "Sam", "Jordan", "Taylor", "Morgan", "Casey", "Riley", "Jamie", "Avery", "Quinn", "Robin", "Charlie")
+LAST_NAMES = ("Smith", "Chen", "Garcia", "Nguyen", "Patel", "Kim", "Brown", "Silva", "Novak", "Okafor", "Larsen", "Haddad")
+
+# Password shared by every generated employee
+SEED_PASSWORD = "q1w2e3"
+
+# Inserts rows in multi-row statements of SEED_CHUNK_SIZE, reporting progress after each one
+def _insert_chunks(model, rows, total, label, progress):
+    chunk = []
+    done = 0
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == SEED_CHUNK_SIZE:
+            db.session.execute(db.insert(model), chunk)
+            done += len(chunk)
+            chunk = []
+            progress(f"{label}: {done} of about {total}")
+    if chunk:
+        db.session.execute(db.insert(model), chunk)
+        done += len(chunk)
+    progress(f"{label}: {done} inserted")
+
+# Picks one of (value, weight) pairs
+def _weighted(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights)[0]
+
+# Yields an employee's leave requests, spread without overlap over the history window
+def _employee_leave(rng, employee_id, count, first_day, last_day, today, status_ids):
+    # Leaves room for the leave itself, about five days on average
+    average_gap = max(1, (last_day - first_day).days // max(count, 1) - 5)
+    day = first_day
+    for _ in range(count):
+        start_date = day + timedelta(days=rng.randint(0, 2 * average_gap))
+        # Leave mostly starts on a weekday
+        if start_date.weekday() >= 5:
+            start_date += timedelta(days=7 - start_date.weekday())
+        end_date = start_date + timedelta(days=rng.choices(LEAVE_LENGTHS, LEAVE_LENGTH_WEIGHTS)[0] - 1)
+        if end_date > last_day:
+            return
+        status = _weighted(rng, PAST_STATUSES if start_date <= today else FUTURE_STATUSES)
+        yield {"employee_id": employee_id, "start_date": start_date, "end_date": end_date, "status_id": status_ids[status]}
+        day = end_date + timedelta(days=1)
+
+# Fills an empty database with departments, teams, employees and leave requests for load testing.
+# The same seed, sizes and date give the same data. Leave covers `years` of history and six months ahead.
+# Every employee shares one password, hashed once. Rows go in through multi-row inserts of SEED_CHUNK_SIZE.
+def seed_large(departments, teams, employees, leave_per_employee, years=3, seed=0, today=None, progress=print):
+    rng = random.Random(seed)
+    today = today or date.today()
+
+    # Statuses are only created if missing, so the generator also runs after `flask db seed`-style setups
+    existing = set(db.session.scalars(db.select(Status.status_name)))
+    db.session.add_all(Status(status_name=name) for name in ("pending", "approved", "rejected") if name not in existing)
+    db.session.flush()
+    status_registry.invalidate()
+    status_ids = {name: status_registry.get_id(name) for name in ("pending", "approved", "rejected")}
+
+    # Departments and teams, with teams spread evenly over the departments
+    stmt = db.insert(Department).returning(Department.id, sort_by_parameter_order=True)
+    department_ids = db.session.scalars(stmt, [{"department_name": f"Department {number}"} for number in range(1, departments + 1)]).all()
+    stmt = db.insert(Team).returning(Team.id, sort_by_parameter_order=True)
+    team_rows = [{"team_name": f"Team {number}", "department_id": department_ids[number % departments]} for number in range(1, teams + 1)]
+    team_ids = db.session.scalars(stmt, team_rows).all()
+    progress(f"Departments: {departments}, teams: {teams}")
+
+    # Employees, all sharing one precomputed hash
+    password = hasher.generate_password_hash(SEED_PASSWORD)
+    employee_rows = (
+        {
+            "first_name": rng.choice(FIRST_NAMES),
+            "last_name": rng.choice(LAST_NAMES),
+            "email": f"employee{number}@example.com",
+            "password": password,
+            "team_id": rng.choice(team_ids),
+            "is_admin": number == 1,
+            "annual_entitlement": rng.choice((20, 20, 20, 25, 30)),
+            "accrual_rule": "annual" if rng.random() < 0.8 else "monthly",
+        }
+        for number in range(1, employees + 1)
+    )
+    last_employee_id = db.session.scalar(db.select(db.func.max(Employee.id))) or 0
+    _insert_chunks(Employee, employee_rows, employees, "Employees", progress)
+    employee_ids = db.session.scalars(db.select(Employee.id).filter(Employee.id > last_employee_id).order_by(Employee.id)).all()
+
+    # Leave requests, each employee taking a number around the average
+    first_day = today - timedelta(days=365 * years)
+    last_day = today + timedelta(days=182)
+    total = len(employee_ids) * leave_per_employee
+    leave_rows = (
+        row
+        for employee_id in employee_ids
+        for row in _employee_leave(rng, employee_id, rng.randint(leave_per_employee // 2, leave_per_employee * 3 // 2), first_day, last_day, today, status_ids)
+    )
+    _insert_chunks(LeaveRequest, leave_rows, total, "Leave requests", progress)
@@ -0,0 +1,232 @@
+import datetime
+import re
+import threading
+
+from flask.json.provider import DefaultJSONProvider
+from marshmallow import fields, missing
+from sqlalchemy import inspect, select
+from sqlalchemy.orm import aliased
+
+from profiling import timed
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the default provider is used without it
+    orjson = None
+
+# Separates the nested field name from the column name in row labels, e.g. "employee__first_name"
+LABEL_SEPARATOR = "__"
+
+def _nested_schema(field):
+    if isinstance(field, fields.List):
+        field = field.inner
+    if isinstance(field, fields.Nested):
+        return field.schema
+    return None
+
+def _identity(value):
+    return value
+
+def _to_str(value):
+    return value if value is None or type(value) is str else str(value)
+
+def _to_int(value):
+    return value if value is None or type(value) is int else int(value)
+
+def _to_iso(value):
+    return None if value is None else value.isoformat()
+
+# Converters for the field types used by the schemas. Anything else goes through marshmallow.
+_CONVERTERS = {
+    fields.String: _to_str,
+    fields.Integer: _to_int,
+    fields.Date: _to_iso,
+}
+
+# Same output as fields.Inferred, which picks a field class from the exact type of the value
+_INFERRED = {
+    int: _identity,
+    str: _identity,
+    bool: _identity,
+    type(None): _identity,
+    datetime.date: _to_iso,
+    datetime.datetime: _to_iso,
+}
+
+# Returns a function converting a raw attribute value like the field would, or None for field types
+# that are not handled here. Fields with a dump default always go through marshmallow.
+def _leaf_converter(field, attr_name):
+    if field.dump_default is not missing:
+        return None
+    if type(field) in _CONVERTERS:
+        return _CONVERTERS[type(field)]
+    if type(field) is fields.Boolean:
+        return lambda value: value if value is None or type(value) is bool else field._serialize(value, attr_name, None)
+    if type(field) is fields.Inferred:
+        return lambda value: _INFERRED[type(value)](value) if type(value) in _INFERRED else field._serialize(value, attr_name, None)
+    return None
+
+# Compiles a schema (with its only/exclude and nested schemas) once into a flat
+# function that turns one object into the same dict schema.dump() would return
+def _compile_object(schema):
+    steps = []
+    for attr_name, field in schema.dump_fields.items():
+        key = field.data_key if field.data_key is not None else attr_name
+        attribute = field.attribute or attr_name
+        nested = _nested_schema(field)
+        if nested is not None and field.dump_default is missing:
+            many = isinstance(field, fields.List) or field.many
+            steps.append((key, attribute, "many" if many else "one", _compile_object(nested)))
+            continue
+        convert = _leaf_converter(field, attr_name)
+        if convert is None:
+            # Other field types keep marshmallow's own behaviour
+            steps.append((key, attr_name, "field", (field, schema.get_attribute)))
+        else:
+            steps.append((key, attribute, "value", convert))
+
+    def dump_one(obj):
+        result = {}
+        for key, attribute, kind, extra in steps:
+            if kind == "field":
+                field, accessor = extra
+                value = field.serialize(attribute, obj, accessor=accessor)
+                if value is not missing:
+                    result[key] = value
+                continue
+            value = getattr(obj, attribute, missing)
+            if value is missing:
+                continue
+            if kind == "value":
+                result[key] = extra(value)
+            elif value is None:
+                result[key] = None
+            elif kind == "one":
+                result[key] = extra(value)
+            else:
+                result[key] = [extra(item) for item in value]
+        return result
+
+    return dump_one
+
+# Compiles a schema into a function reading flat SQL rows, where nested fields come
+# from columns labelled "<nested>__<field>" as built by select_rows()
+def _compile_row(schema, prefix=""):
+    steps = []
+    for attr_name, field in schema.dump_fields.items():
+        key = field.data_key if field.data_key is not None else attr_name
+        label = prefix + attr_name
+        nested = _nested_schema(field)
+        if nested is not None:
+            if isinstance(field, fields.List) or field.many:
+                raise ValueError(f"Collection field '{attr_name}' cannot be read from flat rows.")
+            steps.append((key, None, _compile_row(nested, label + LABEL_SEPARATOR)))
+            continue
+        convert = _leaf_converter(field, attr_name)
+        if convert is None:
+            raise ValueError(f"Field '{attr_name}' cannot be read from flat rows.")
+        steps.append((key, label, convert))
+
+    def dump_row(mapping):
+        result = {}
+        for key, label, convert in steps:
+            if label is None:
+                result[key] = convert(mapping)
+                continue
+            value = mapping.get(label, missing)
+            if value is not missing:
+                result[key] = convert(value)
+        return result
+
+    return dump_row
+
+class CompiledSchema:
+    def __init__(self, schema):
+        self.many = schema.many
+        self._dump_one = _compile_object(schema)
+        self._schema = schema
+        self._dump_row = None
+
+    # Drop-in replacement for schema.dump() on ORM objects
+    def dump(self, data):
+        with timed("serialize"):
+            if self.many:
+                return [self._dump_one(obj) for obj in data]
+            return self._dump_one(data)
+
+    # Dumps SQL rows from select_rows() without building ORM instances
+    def dump_rows(self, rows):
+        if self._dump_row is None:
+            self._dump_row = _compile_row(self._schema)
+        with timed("serialize"):
+            dumped = [self._dump_row(row._mapping) for row in rows]
+        return dumped if self.many else (dumped[0] if dumped else None)
+
+_compiled_lock = threading.Lock()
+
+# Returns the compiled form of a schema instance, compiling it on first use. It is kept on the
+# instance rather than in a process-wide table, so schemas built per request, e.g. with only=...,
+# are freed along with it. (The compiled form refers back to the schema through its fields, so a
+# weak-keyed table would keep every entry alive.)
+def compile_schema(schema):
+    compiled = schema.__dict__.get("_compiled")
+    if compiled is None:
+        with _compiled_lock:
+            compiled = schema.__dict__.get("_compiled")
+            if compiled is None:
+                compiled = schema._compiled = CompiledSchema(schema)
+    return compiled
+
+# Same result as schema.dump(data), through the compiled schema
+def fast_dump(schema, data):
+    return compile_schema(schema).dump(data)
+
+def _collect_columns(entity, mapper, schema, prefix, columns, joins):
+    for attr_name, field in schema.dump_fields.items():
+        attribute = field.attribute or attr_name
+        nested = _nested_schema(field)
+        if nested is not None:
+            relationship = mapper.relationships[attribute]
+            target = aliased(relationship.mapper.class_)
+            joins.append((target, getattr(entity, attribute).of_type(target)))
+            _collect_columns(target, relationship.mapper, nested, prefix + attr_name + LABEL_SEPARATOR, columns, joins)
+        elif attribute in mapper.column_attrs:
+            columns.append(getattr(entity, attribute).label(prefix + attr_name))
+
+# Builds a select of labelled columns (joining the nested many-to-one relationships)
+# whose rows can be passed to compile_schema(schema).dump_rows()
+def select_rows(model, schema):
+    columns, joins = [], []
+    _collect_columns(model, inspect(model), schema, "", columns, joins)
+    stmt = select(*columns).select_from(model)
+    for target, onclause in joins:
+        stmt = stmt.outerjoin(target, onclause)
+    return stmt
+
+# Floats the standard library writes in exponent form: orjson writes 1e16 where json writes 1e+16,
+# and 0.000015 where json writes 1.5e-05
+_EXPONENT = re.compile(rb"\d[eE][-+\d]|\b0\.0000")
+
+# Encodes compact responses with orjson, falling back to the default provider whenever
+# orjson's bytes would differ from what the standard library produces. Floats, e.g. the leave
+# balances, are written alike unless json would use an exponent (below 1e-4 or from 1e16 on), so
+# bodies with such a number fall back; text that merely looks like one only costs the speed-up.
+# NaN and infinities, which orjson writes as null, cannot come from the Numeric balance columns.
+class OrjsonProvider(DefaultJSONProvider):
+    # Dates, datetimes and dataclasses are left to the default() hook, as in the default provider
+    _options = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS) if orjson else 0
+
+    def response(self, *args, **kwargs):
+        if self.sort_keys or self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        try:
+            body = orjson.dumps(obj, default=self.default, option=self._options)
+        except (TypeError, orjson.JSONEncodeError):
+            return super().response(*args, **kwargs)
+        # orjson writes non-ASCII text unescaped, unlike json.dumps(ensure_ascii=True)
+        if self.ensure_ascii and not body.isascii():
+            return super().response(*args, **kwargs)
+        if _EXPONENT.search(body):
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
@@ -0,0 +1,69 @@
+from datetime import date, timedelta
+
+import pytest
+
+from availability import team_calendars
+from init import db
+from main import create_app
+from models.employee import Employee
+from models.leave_request import LeaveRequest
+from models.status import status_registry
+from routing import REPLICA_BIND
+from utils import role_cache
+
+PASSWORD = "q1w2e3"
+ADMIN_EMAIL = "veronica.chung@email.com"
+EMPLOYEE_EMAIL = "sue.joseph@email.com"
+
+# Builds the app on SQLite files in a temporary directory, with fast inline password hashing.
+# The process-wide caches are emptied, as every test starts from a new database.
+@pytest.fixture
+def make_app(tmp_path, monkeypatch):
+    def make(**env):
+        monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'primary.db'}")
+        monkeypatch.setenv("JWT_SECRET_KEY", "test-secret-" * 4)
+        monkeypatch.setenv("BCRYPT_LOG_ROUNDS", "4")
+        monkeypatch.setenv("HASHING_EXECUTOR", "inline")
+        monkeypatch.setenv("VERSION_STORE", "memory")
+        monkeypatch.setenv("METRICS_ENABLED", "false")
+        for variable, value in env.items():
+            monkeypatch.setenv(variable, value)
+        status_registry.invalidate()
+        role_cache.clear()
+        team_calendars.clear()
+        app = create_app()
+        app.config["TESTING"] = True
+        return app
+    yield make
+    # init_app registers a metadata per bind key, which would outlive the replica of this test
+    db.metadatas.pop(REPLICA_BIND, None)
+
+def run_command(app, *args):
+    result = app.test_cli_runner().invoke(args=list(args))
+    assert result.exception is None, result.output
+    return result
+
+def login(client, email):
+    response = client.post("/auth/login", json={"email": email, "password": PASSWORD})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return {"Authorization": f"Bearer {response.json['token']}"}
+
+# App on generated data, with enough rows per page that a query per row would show
+@pytest.fixture
+def seeded(make_app):
+    # The database store counts the version lookups of conditional and cached views too
+    app = make_app(VERSION_STORE="database", PAGINATION_DEFAULT_LIMIT="10")
+    run_command(app, "db", "create")
+    run_command(app, "db", "seed-large", "--departments", "3", "--teams", "6", "--employees", "60", "--leave-per-employee", "6", "--years", "1", "--seed", "1")
+    client = app.test_client()
+    headers = login(client, "employee1@example.com")
+
+    # An employee with approved leave in the next 30 days, so the upcoming leave views dump rows
+    with app.app_context():
+        today = date.today()
+        stmt = db.select(LeaveRequest.employee_id, Employee.team_id).join(Employee).filter(
+            LeaveRequest.status_id == status_registry.get_id("approved"),
+            LeaveRequest.start_date.between(today, today + timedelta(days=30))
+        ).limit(1)
+        employee_id, team_id = db.session.execute(stmt).one()
+    return client, headers, employee_id, team_id
@@ -0,0 +1,57 @@
+import pytest
+
+pytest.importorskip("starlette")
+pytest.importorskip("a2wsgi")
+pytest.importorskip("aiosqlite")
+# Starlette's TestClient runs on httpx
+pytest.importorskip("httpx")
+
+from starlette.testclient import TestClient
+
+from asgi import create_asgi_app
+from models.status import status_registry
+from response_cache import response_cache
+
+# Both stacks on the same database. The statuses are forgotten, so the ASGI app loads them itself.
+@pytest.fixture
+def stacks(seeded):
+    client, headers, employee_id, team_id = seeded
+    status_registry.invalidate()
+    with TestClient(create_asgi_app()) as asgi_client:
+        # Loaded at startup through the async session
+        assert status_registry.loaded
+        yield client, asgi_client, headers, employee_id, team_id
+
+def answer(response, body):
+    return response.status_code, body, response.headers.get("ETag"), response.headers.get("X-Next-Cursor")
+
+# Sends the request to both stacks, each one with an empty response cache, and returns the answer of both
+def get_both(client, asgi_client, url, headers):
+    response_cache.backend.clear()
+    response = client.get(url, headers=headers)
+    expected = answer(response, response.get_data())
+    response_cache.backend.clear()
+    response = asgi_client.get(url, headers=headers)
+    assert answer(response, response.content) == expected, url
+    return expected
+
+# The async views answer exactly like the Flask views they replace
+def test_asgi_views_answer_like_flask(stacks):
+    client, asgi_client, headers, employee_id, team_id = stacks
+    urls = [
+        "/department/list?limit=2",
+        "/team/list?limit=4",
+        "/leave_request?limit=2",
+        f"/team/list/{team_id}",
+        f"/employee/{employee_id}",
+        "/team/list/999999",
+        "/employee/999999",
+    ]
+    for url in urls:
+        status, body, etag, next_cursor = get_both(client, asgi_client, url, headers)
+        assert status in (200, 404) and body, url
+        # The next page of a list, and the 304 of its tag
+        if next_cursor:
+            get_both(client, asgi_client, f"{url}&cursor={next_cursor}", headers)
+        if etag:
+            assert get_both(client, asgi_client, url, {**headers, "If-None-Match": etag})[0] == 304
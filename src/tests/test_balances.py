@@ -0,0 +1,27 @@
+from init import db
+from models.leave_ledger import LeaveBalance, LeaveLedgerEntry
+from tests.conftest import EMPLOYEE_EMAIL, login, run_command
+
+# The balance view shows the accrual periods that came due as credited without posting them,
+# and `flask db accrue` then posts exactly what it showed
+def test_balance_view_projects_due_accruals(make_app):
+    app = make_app()
+    run_command(app, "db", "create")
+    run_command(app, "db", "seed")
+    client = app.test_client()
+    headers = login(client, EMPLOYEE_EMAIL)
+    with app.app_context():
+        employee_id = db.session.execute(db.text("SELECT id FROM employee WHERE email = :email"), {"email": EMPLOYEE_EMAIL}).scalar()
+        # Start the employee over with nothing credited
+        db.session.execute(db.delete(LeaveLedgerEntry).filter_by(employee_id=employee_id))
+        db.session.execute(db.delete(LeaveBalance).filter_by(employee_id=employee_id))
+        db.session.commit()
+
+    projected = client.get(f"/employee/{employee_id}/balance", headers=headers)
+    assert projected.status_code == 200
+    assert projected.json["accrued"] > 0
+    with app.app_context():
+        assert db.session.get(LeaveBalance, employee_id) is None
+
+    run_command(app, "db", "accrue")
+    assert client.get(f"/employee/{employee_id}/balance", headers=headers).json == projected.json
@@ -0,0 +1,48 @@
+import pytest
+
+# Each endpoint fails with QueryBudgetExceeded when it runs more queries than its @query_budget,
+# as TESTING turns the budgets on. The data has enough rows per page that a query per row would show.
+def get_pages(client, url, headers):
+    response = client.get(url, headers=headers)
+    assert response.status_code in (200, 404), response.get_data(as_text=True)
+    # The next page runs the cursor query
+    cursor = response.headers.get("X-Next-Cursor")
+    if cursor:
+        separator = "&" if "?" in url else "?"
+        response = client.get(f"{url}{separator}cursor={cursor}", headers=headers)
+        assert response.status_code == 200, response.get_data(as_text=True)
+    return response
+
+@pytest.mark.parametrize("url", [
+    "/department/list?limit=2",
+    "/team/list?limit=4",
+    "/employee/list",
+    "/leave_request?limit=2",
+    "/analytics/leave",
+])
+def test_list_endpoints_stay_within_budget(seeded, url):
+    client, headers, employee_id, team_id = seeded
+    get_pages(client, url, headers)
+
+def test_upcoming_leave_stays_within_budget(seeded):
+    client, headers, employee_id, team_id = seeded
+    for url in (f"/employee/{employee_id}", f"/team/list/{team_id}"):
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        assert len(response.json) >= 1
+
+def test_balance_stays_within_budget(seeded):
+    client, headers, employee_id, team_id = seeded
+    response = client.get(f"/employee/{employee_id}/balance", headers=headers)
+    assert response.status_code == 200, response.get_data(as_text=True)
+
+def test_team_calendar_stays_within_budget(seeded):
+    client, headers, employee_id, team_id = seeded
+    # The first view loads the calendar, the second is answered from the cached one
+    responses = [client.get(f"/team/{team_id}/calendar", headers=headers) for _ in range(2)]
+    for response in responses:
+        assert response.status_code == 200, response.get_data(as_text=True)
+    assert responses[0].json == responses[1].json
+    days = responses[0].json["days"]
+    assert any(day["absent"] for day in days)
+    assert all(day["absent"] == len(day["employees"]) for day in days)
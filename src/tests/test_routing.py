@@ -0,0 +1,56 @@
+import shutil
+
+from init import db
+from models.department import Department
+from routing import REPLICA_BIND
+from tests.conftest import ADMIN_EMAIL, EMPLOYEE_EMAIL, login, run_command
+
+# The replica is a copy of the primary taken before it was seeded, so it answers every
+# list with nothing: a read that reaches it is easy to tell from one that reaches the primary.
+def make_routed_app(make_app, tmp_path):
+    app = make_app()
+    run_command(app, "db", "create")
+    shutil.copy(tmp_path / "primary.db", tmp_path / "replica.db")
+    run_command(app, "db", "seed")
+    return make_app(DATABASE_REPLICA_URL=f"sqlite:///{tmp_path / 'replica.db'}")
+
+def test_get_reads_go_to_the_replica(make_app, tmp_path):
+    app = make_routed_app(make_app, tmp_path)
+    client = app.test_client()
+    headers = login(client, EMPLOYEE_EMAIL)
+
+    response = client.get("/department/list", headers=headers)
+    assert response.status_code == 200
+    assert response.json == []
+
+def test_writes_go_to_the_primary(make_app, tmp_path):
+    app = make_routed_app(make_app, tmp_path)
+    client = app.test_client()
+    headers = login(client, ADMIN_EMAIL)
+
+    response = client.post("/department/add", headers=headers, json={"department_name": "Research"})
+    assert response.status_code == 201
+    with app.app_context():
+        names = db.session.scalars(db.select(Department.department_name), bind_arguments={"bind": db.engines[None]}).all()
+        assert "Research" in names
+        assert db.session.execute(db.select(Department), bind_arguments={"bind": db.engines[REPLICA_BIND]}).all() == []
+
+def test_admin_checks_read_the_primary(make_app, tmp_path):
+    app = make_routed_app(make_app, tmp_path)
+    client = app.test_client()
+
+    # The replica has no employees, so the role must come from the primary
+    response = client.get("/employee/list", headers=login(client, ADMIN_EMAIL))
+    assert response.status_code == 200
+    assert response.json == []
+
+def test_balance_view_reads_the_replica(make_app, tmp_path):
+    app = make_routed_app(make_app, tmp_path)
+    client = app.test_client()
+    headers = login(client, EMPLOYEE_EMAIL)
+    with app.app_context():
+        employee_id = db.session.execute(db.text("SELECT id FROM employee WHERE email = :email"), {"email": EMPLOYEE_EMAIL}).scalar()
+
+    # The view no longer accrues, so it reads the replica, which has no employees
+    response = client.get(f"/employee/{employee_id}/balance", headers=headers)
+    assert response.status_code == 404
@@ -1,23 +1,93 @@
 import functools
-from flask_jwt_extended import get_jwt_identity
+from flask import current_app
+from flask_jwt_extended import get_jwt, get_jwt_identity
+from sqlalchemy.dialects import postgresql, sqlite
 
 from init import db
+from cache import TTLCache
 from models.employee import Employee
+from routing import on_primary
+
+# Employee id -> (version of role_key, (is_admin, role_version)). An entry is only used while the
+# version is unchanged: every committed change to the employee bumps it in the shared version
+# store (see versions.py), so a role revoked by any worker is refused by every worker at once.
+role_cache = TTLCache(maxsize=4096, ttl=300)
+
+# Version counter of one employee's role
+def role_key(employee_id):
+    return f"role:employee:{employee_id}"
+
+# Returns the employee's current (is_admin, role_version), or (False, None) if the employee no longer exists
+def get_role(employee_id):
+    key = role_key(employee_id)
+    # Read the version before the role, and from the primary, so a change applies before the replica catches up
+    version = current_app.extensions["collection_versions"].get_many([key], primary=True)[key]
+    entry = role_cache.get(employee_id)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    stmt = on_primary(db.select(Employee.is_admin, Employee.role_version).filter_by(id=employee_id))
+    row = db.session.execute(stmt).first()
+    role = (bool(row.is_admin), row.role_version) if row else (False, None)
+    role_cache.set(employee_id, (version, role))
+    return role
+
+# SQLSTATE codes of the integrity errors the controllers tell apart
+UNIQUE_VIOLATION = "23505"
+NOT_NULL_VIOLATION = "23502"
+
+# Returns the SQLSTATE code of an IntegrityError. PostgreSQL reports it directly,
+# SQLite only names the failed constraint in its message.
+def integrity_error_code(err):
+    code = getattr(err.orig, "pgcode", None)
+    if code:
+        return code
+    message = str(err.orig)
+    if message.startswith("UNIQUE constraint failed"):
+        return UNIQUE_VIOLATION
+    if message.startswith("NOT NULL constraint failed"):
+        return NOT_NULL_VIOLATION
+    return None
+
+def is_unique_violation(err):
+    return integrity_error_code(err) == UNIQUE_VIOLATION
+
+def is_not_null_violation(err):
+    return integrity_error_code(err) == NOT_NULL_VIOLATION
+
+# Returns the column of a NOT NULL violation, e.g. "team_id"
+def violated_column(err):
+    diag = getattr(err.orig, "diag", None)
+    if diag is not None:
+        return diag.column_name
+    # SQLite: "NOT NULL constraint failed: employee.team_id"
+    return str(err.orig).rsplit(".", 1)[-1]
+
+# Returns an INSERT for the model on the session's database (or the given engine or connection), supporting on_conflict_do_update() on PostgreSQL and SQLite
+def dialect_insert(model, bind=None):
+    bind = bind or db.session.get_bind()
+    if bind.dialect.name == "sqlite":
+        return sqlite.insert(model)
+    return postgresql.insert(model)
 
 #  Checks if the current employee is an admin before allowing the decorated function to execute
 def auth_as_admin_decorator(fn):
     @functools.wraps(fn)
     def wrapper(*args, **kwargs):
-        # Gets the employee's id from get_jwt_identity
+        # Gets the employee's id and role claims from the JWT
         employee_id = get_jwt_identity()
-        # Fetches the employee from the database
-        stmt = db.select(Employee).filter_by(id=employee_id)
-        employee = db.session.scalar(stmt)
+        claims = get_jwt()
+        # Admin tokens must match the current role version, so tokens issued before a revocation are refused.
+        # Other tokens, including those issued before role claims were added or before the employee was
+        # made an admin, are checked against the current role.
+        if claims.get("is_admin") and "role_version" in claims:
+            is_admin = get_role(employee_id) == (True, claims["role_version"])
+        else:
+            is_admin = get_role(employee_id)[0]
         # If the employee is an admin, the function is executed
-        if employee.is_admin:
+        if is_admin:
             return fn(*args, **kwargs)
         # If not, error 403 is returned
         else:
             return {"error": "Only an admin can perform this action."}, 403
     
-    return wrapper
\ No newline at end of file
+    return wrapper
@@ -0,0 +1,255 @@
+import functools
+import hashlib
+import logging
+import threading
+import uuid
+
+from flask import Response, current_app, g, has_app_context, has_request_context, request
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from init import db
+from models.collection_version import CollectionVersion
+from models.department import Department
+from models.employee import Employee
+from models.leave_request import LeaveRequest
+from models.status import Status, status_registry
+from models.team import Team
+from routing import on_primary
+from utils import dialect_insert, role_key
+
+# Key of one employee's leave request list
+def leave_list_key(employee_id):
+    return f"leave_request:employee:{employee_id}"
+
+# Key of the current employee's leave request list, for conditional()
+def own_leave_list(**view_args):
+    return leave_list_key(get_jwt_identity())
+
+# Keys of the approved leave coming up for one employee, and for one team
+def employee_leave_key(employee_id):
+    return f"approved_leave:employee:{employee_id}"
+
+def team_leave_key(team_id):
+    return f"approved_leave:team:{team_id}"
+
+def _employee_keys(employee):
+    # Employee names are nested in their leave requests
+    keys = {leave_list_key(employee.id), employee_leave_key(employee.id)}
+    # A team move changes the upcoming leave of both teams
+    history = inspect(employee).attrs.team_id.history
+    keys.update(team_leave_key(team_id) for team_id in (*history.deleted, *history.unchanged, *history.added) if team_id is not None)
+    # Cached roles are checked against it (see utils.get_role). Bumped on every change of the row,
+    # which also covers employees deleted, and new ones taking over the id of a deleted one.
+    keys.add(role_key(employee.id))
+    return keys
+
+# True if the leave request is approved or was before this flush. Only approved leave shows in
+# the upcoming leave views and team calendars, so pending and rejected requests leave them as they are.
+def _is_approved_leave(leave_request):
+    history = inspect(leave_request).attrs.status_id.history
+    return status_registry.get_id("approved") in (*history.deleted, *history.unchanged, *history.added)
+
+# The team keys of approved leave are added by collect_changed_rows, with one query for all of them
+def _leave_request_keys(leave_request):
+    if _is_approved_leave(leave_request):
+        return {leave_list_key(leave_request.employee_id), employee_leave_key(leave_request.employee_id)}
+    return {leave_list_key(leave_request.employee_id)}
+
+# Keys of the upcoming leave of the teams the employees belong to, read on the flushing connection
+def _team_keys(session, employee_ids):
+    stmt = db.select(Employee.team_id).filter(Employee.id.in_(employee_ids), Employee.team_id.is_not(None)).distinct()
+    return {team_leave_key(team_id) for team_id in session.connection().scalars(stmt)}
+
+# Collections to bump when a row of each model is added, changed or deleted.
+# "leave_request" covers every leave list and upcoming leave, for changes that cannot be narrowed down.
+ROW_KEYS = {
+    Department: lambda department: ("department", "team"),
+    # Creating or deleting a team changes the "not found" answer about its upcoming leave
+    Team: lambda team: ("team", team_leave_key(team.id)),
+    Employee: _employee_keys,
+    LeaveRequest: _leave_request_keys,
+    Status: lambda status: ("leave_request",),
+}
+
+# Collections to bump for bulk INSERT, UPDATE and DELETE statements, which do not say which rows they touch
+BULK_KEYS = {
+    Department: ("department", "team"),
+    Team: ("team", "leave_request"),
+    Employee: ("leave_request",),
+    LeaveRequest: ("leave_request",),
+    Status: ("leave_request",),
+}
+
+# Logs the version bumps that failed, as the change they follow is already committed
+logger = logging.getLogger("versions")
+
+# Versions kept in this process. Only right when a single process serves the API.
+class MemoryVersionStore:
+    def __init__(self):
+        # Counters start again when the process restarts, so versions carry a token of the process
+        self._token = uuid.uuid4().hex[:8]
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        return {key: f"{self._token}.{self._versions.get(key, 0)}" for key in keys}
+
+    # Returns {key: (version before, version after)}
+    def bump(self, keys):
+        bumped = {}
+        with self._lock:
+            for key in keys:
+                version = self._versions.get(key, 0)
+                self._versions[key] = version + 1
+                bumped[key] = (f"{self._token}.{version}", f"{self._token}.{version + 1}")
+        return bumped
+
+# Versions kept in the collection_version table, shared by every worker process
+class DatabaseVersionStore:
+    def get_many(self, keys):
+        return self.versions_of(keys, db.session.execute(self.stmt(keys)).all())
+
+    # The lookup is split so sessions other than db.session, such as the async ones, can run it
+    def stmt(self, keys):
+        return db.select(CollectionVersion.key, CollectionVersion.version).filter(CollectionVersion.key.in_(keys))
+
+    def versions_of(self, keys, rows):
+        versions = dict(rows)
+        return {key: versions.get(key, 0) for key in keys}
+
+    # Runs once the change is committed, in a transaction of its own. Keys are sorted so
+    # concurrent bumps lock the rows in the same order. Returns {key: (version before, version after)}.
+    def bump(self, keys):
+        with db.engine.begin() as connection:
+            stmt = dialect_insert(CollectionVersion, connection).values([{"key": key, "version": 1} for key in sorted(keys)])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[CollectionVersion.key],
+                set_={"version": CollectionVersion.version + 1}
+            ).returning(CollectionVersion.key, CollectionVersion.version)
+            return {key: (version - 1, version) for key, version in connection.execute(stmt)}
+
+# ETag of a response built from the collections at these versions, for a path with its query string
+def make_etag(keys, versions, full_path):
+    raw = "|".join(f"{key}={versions[key]}" for key in keys) + "|" + full_path
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+VERSION_STORES = {"memory": MemoryVersionStore, "database": DatabaseVersionStore}
+
+# Version counters of cached collections, bumped after every commit that changes them.
+# VERSION_STORE is "database" (default), "memory", or any object with get_many(keys) and bump(keys),
+# bump returning {key: (version before, version after)}.
+class CollectionVersions:
+    def __init__(self):
+        self.store = MemoryVersionStore()
+
+    def init_app(self, app):
+        app.config.setdefault("VERSION_STORE", "database")
+        store = app.config["VERSION_STORE"]
+        self.store = VERSION_STORES[store]() if isinstance(store, str) else store
+        app.extensions["collection_versions"] = self
+
+    # Strong ETag of the current request's response while none of the collections change.
+    # The path and query string are part of it, so every page and filter has its own tag.
+    def etag(self, keys):
+        return make_etag(keys, self.store.get_many(keys), request.full_path)
+
+    # Current versions of the keys. With the database store, `primary` reads them from the
+    # primary, for checks that must see a change as soon as it is committed.
+    def get_many(self, keys, primary=False):
+        if primary and isinstance(self.store, DatabaseVersionStore):
+            return self.store.versions_of(keys, db.session.execute(on_primary(self.store.stmt(keys))).all())
+        return self.store.get_many(keys)
+
+    # The versions bumped during a request are kept in g.bumped_versions, so caches this process
+    # updates in place can move to the new version when nobody else changed the key meanwhile
+    def bump(self, keys):
+        if not keys:
+            return
+        bumped = self.store.bump(keys)
+        if has_request_context():
+            g.setdefault("bumped_versions", {}).update(bumped)
+
+    # The (before, after) versions of a key bumped by the current request, or None
+    def bumped(self, key):
+        return g.get("bumped_versions", {}).get(key) if has_request_context() else None
+
+collection_versions = CollectionVersions()
+
+# Answers a GET whose If-None-Match holds the current ETag with 304 before the view runs,
+# and tags the view's 200 responses. Keys are collection names, or functions of the view
+# arguments returning one. Goes below @jwt_required() so the identity is known.
+def conditional(*keys):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            # Read the versions before the data, so a tag never claims newer data than the response holds
+            etag = collection_versions.etag([key(**kwargs) if callable(key) else key for key in keys])
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                response = current_app.make_response(fn(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            # Clients keep the response, but check it is still current before using it
+            response.headers["Cache-Control"] = "private, no-cache"
+            return response
+        return wrapper
+    return decorator
+
+def _pending_keys(session):
+    return session.info.setdefault("version_keys", set())
+
+# Adds the keys of the employees' leave to bump when the current transaction commits, for
+# set-based UPDATEs whose changed rows the caller knows from RETURNING. `approved` says whether
+# approved leave changed, which the upcoming leave views of the employees and teams show.
+def mark_leave_changed(employee_ids, approved):
+    employee_ids = set(employee_ids)
+    if not employee_ids:
+        return
+    keys = _pending_keys(db.session)
+    keys.update(leave_list_key(employee_id) for employee_id in employee_ids)
+    if approved:
+        keys.update(employee_leave_key(employee_id) for employee_id in employee_ids)
+        keys.update(_team_keys(db.session, employee_ids))
+
+# Collects the collections touched by each flush, to bump them once the transaction commits
+@event.listens_for(Session, "after_flush")
+def collect_changed_rows(session, flush_context):
+    keys = _pending_keys(session)
+    leave_employee_ids = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        row_keys = ROW_KEYS.get(type(obj))
+        if row_keys is None or (obj in session.dirty and not session.is_modified(obj)):
+            continue
+        keys.update(row_keys(obj))
+        if isinstance(obj, LeaveRequest) and _is_approved_leave(obj):
+            # A request moved to another employee changes the leave of both teams
+            history = inspect(obj).attrs.employee_id.history
+            leave_employee_ids.update(employee_id for employee_id in (*history.deleted, *history.unchanged, *history.added) if employee_id is not None)
+    if leave_employee_ids:
+        keys.update(_team_keys(session, leave_employee_ids))
+
+@event.listens_for(Session, "do_orm_execute")
+def collect_bulk_statements(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        keys = _pending_keys(orm_execute_state.session)
+        for mapper in orm_execute_state.all_mappers:
+            keys.update(BULK_KEYS.get(mapper.class_, ()))
+
+@event.listens_for(Session, "after_commit")
+def bump_versions(session):
+    keys = session.info.pop("version_keys", None)
+    if keys and has_app_context():
+        # The change is committed, so a failed bump is logged rather than failing the request.
+        # Until the keys are bumped again, ETags and cached responses of them stay as they were.
+        try:
+            collection_versions.bump(keys)
+        except Exception:
+            logger.exception("Could not bump the versions of %s", ", ".join(sorted(keys)))
+
+@event.listens_for(Session, "after_rollback")
+def forget_versions(session):
+    session.info.pop("version_keys", None)
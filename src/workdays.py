@@ -0,0 +1,115 @@
+import json
+import os
+import threading
+from datetime import date
+
+import numpy as np
+from flask import current_app
+
+from init import db
+from models.employee import Employee
+from models.team import Team
+
+# Monday to Friday, used when neither the department nor the default calendar file sets a weekmask
+DEFAULT_WEEKMASK = "1111100"
+
+# Ordinal of 1970-01-01, day zero of datetime64[D]
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Converts dates to a datetime64[D] array. Going through ordinals is much faster than
+# letting NumPy convert each date object on its own.
+def as_days(dates):
+    if isinstance(dates, np.ndarray):
+        return dates.astype("datetime64[D]")
+    ordinals = np.fromiter(map(date.toordinal, dates), dtype=np.int64, count=len(dates))
+    return (ordinals - EPOCH_ORDINAL).astype("datetime64[D]")
+
+# Weekend mask and holidays of one department, wrapping a NumPy business day calendar
+class WorkCalendar:
+    def __init__(self, weekmask=DEFAULT_WEEKMASK, holidays=()):
+        self.busdaycal = np.busdaycalendar(weekmask=weekmask, holidays=np.array(holidays, dtype="datetime64[D]"))
+
+    # Loads a calendar file holding {"weekmask": "1111100", "holidays": ["2024-12-25", ...]}
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as file:
+            data = json.load(file)
+        return cls(data.get("weekmask", DEFAULT_WEEKMASK), data.get("holidays", []))
+
+    # Working days from each start date to each end date, both included, for whole arrays at once
+    def count(self, start_dates, end_dates):
+        start_dates = as_days(start_dates)
+        end_dates = as_days(end_dates)
+        return np.busday_count(start_dates, end_dates + 1, busdaycal=self.busdaycal)
+
+# Process-wide calendars per department, read from "department_<id>.json" in the WORKDAY_CALENDAR_DIR
+# directory on first use. Departments without a file use "default.json", or Monday to Friday without it.
+class CalendarRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calendars = {}
+
+    def _load(self, name):
+        path = os.path.join(current_app.config["WORKDAY_CALENDAR_DIR"], f"{name}.json")
+        if os.path.exists(path):
+            return WorkCalendar.from_file(path)
+        return None
+
+    # Returns the calendar of a department
+    def get(self, department_id):
+        calendar = self._calendars.get(department_id)
+        if calendar is None:
+            with self._lock:
+                if "default" not in self._calendars:
+                    self._calendars["default"] = self._load("default") or WorkCalendar()
+                calendar = self._load(f"department_{department_id}") or self._calendars["default"]
+                self._calendars[department_id] = calendar
+        return calendar
+
+    # Working days of many date ranges, each counted with its department's calendar.
+    # Ranges are grouped per department, so the work is one vectorized count per department.
+    def count(self, department_ids, start_dates, end_dates):
+        department_ids = np.asarray(department_ids, dtype=np.int64)
+        start_dates = as_days(start_dates)
+        end_dates = as_days(end_dates)
+        counts = np.zeros(len(department_ids), dtype=np.int64)
+        for department_id in np.unique(department_ids):
+            selected = department_ids == department_id
+            counts[selected] = self.get(int(department_id)).count(start_dates[selected], end_dates[selected])
+        return counts
+
+calendars = CalendarRegistry()
+
+# Department of each employee, looked up in one query
+def department_ids_of(employee_ids):
+    return dict(db.session.execute(department_ids_stmt(employee_ids)).all())
+
+def department_ids_stmt(employee_ids):
+    return db.select(Employee.id, Team.department_id) \
+        .join(Team, Employee.team_id == Team.id) \
+        .filter(Employee.id.in_(set(employee_ids)))
+
+# Working days of leave requests, given as rows or objects with employee_id, start_date and end_date,
+# in the same order as the requests
+def leave_working_days(leave_requests):
+    if not leave_requests:
+        return []
+    return working_days_in(department_ids_of({leave_request.employee_id for leave_request in leave_requests}), leave_requests)
+
+# Same, with the department of each employee already looked up
+def working_days_in(departments, leave_requests):
+    counts = calendars.count(
+        [departments[leave_request.employee_id] for leave_request in leave_requests],
+        [leave_request.start_date for leave_request in leave_requests],
+        [leave_request.end_date for leave_request in leave_requests]
+    )
+    return counts.tolist()
+
+# Adds "working_days" to a dumped leave request, or to a list of them matched by position with the requests
+def with_working_days(dumped, leave_requests):
+    if isinstance(dumped, dict):
+        dumped["working_days"] = leave_working_days([leave_requests])[0]
+        return dumped
+    for item, working_days in zip(dumped, leave_working_days(leave_requests)):
+        item["working_days"] = working_days
+    return dumped